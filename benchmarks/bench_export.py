@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+    star.export: CPU latency and throughput of keras model.predict vs. the exported artifacts
+
+    A STAR model with random weights is exported to a temporary directory and run on
+    synthetic TaxiBJ-shaped inputs at batch sizes 1, 16 and the full test set (28 days).
+
+Usage:
+    python benchmarks/bench_export.py [channels_first|channels_last] [number_of_test_samples]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import shutil
+import tempfile
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from star.export import build_model, export, FrozenModel, TFLiteModel
+
+
+def timeit(predict, X, batch_size, repeat=3):
+    """best time (s) of predict over X, batch by batch"""
+    n = len(X[0]) if batch_size > 1 else min(len(X[0]), 200)
+    X = [x[:n] for x in X]
+    predict(X, batch_size)  # warm up
+    best = np.inf
+    for _ in range(repeat):
+        ts = time.time()
+        predict(X, batch_size)
+        best = min(best, time.time() - ts)
+    return best, n
+
+
+def main(data_format='channels_first', nb_sample=28 * 48):
+    rng = np.random.RandomState(1337)
+    model = build_model(data_format=data_format)
+    shape = tuple(int(d) for d in model.inputs[0].shape[1:])
+    X = [rng.rand(nb_sample, *shape).astype(np.float32) * 2 - 1,
+         rng.rand(nb_sample, 8).astype(np.float32)]
+
+    path = tempfile.mkdtemp()
+    try:
+        info = export(model, os.path.join(path, 'star'), tflite=data_format == 'channels_last',
+                      data_format=data_format)
+        models = [('keras', model.predict), ('frozen', FrozenModel(os.path.join(path, 'star')).predict)]
+        if os.path.exists(os.path.join(path, 'star.tflite')):
+            models.append(('tflite', TFLiteModel(os.path.join(path, 'star')).predict))
+
+        y_keras = model.predict(X, batch_size=256)
+        print('=' * 10)
+        print('data_format: %s, output: %s' % (data_format, info['output_shapes'][0]))
+        for name, predict in models[1:]:
+            print('%s: max abs diff to keras %.2e' % (name, np.abs(predict(X, 256) - y_keras).max()))
+        for batch_size in [1, 16, nb_sample]:
+            for name, predict in models:
+                elapsed, n = timeit(predict, X, batch_size)
+                print('batch_size: %4i, %6s: %8.2f ms/batch, %8.1f samples/s'
+                      % (batch_size, name, elapsed * 1000. * batch_size / n, n / elapsed))
+    finally:
+        shutil.rmtree(path)
+
+if __name__ == '__main__':
+    main(data_format=sys.argv[1] if len(sys.argv) > 1 else 'channels_first',
+         nb_sample=int(sys.argv[2]) if len(sys.argv) > 2 else 28 * 48)
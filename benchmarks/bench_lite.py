@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+    STAR vs. lite variants: parameters, multiply-adds per sample and CPU throughput of model.predict
+
+    The accuracy side of the trade-off is measured by training the variants with
+    exptTaxiBJ.py (settings nb_filter, conv_type, unit_depth).
+
+Usage:
+    python benchmarks/bench_lite.py [channels_first|channels_last] [number_of_samples]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from star.model import STAR, complexity
+
+# (name, kwargs of STAR), the first one being the reference
+VARIANTS = [('STAR', dict()),
+            ('conv32', dict(nb_filter=32)),
+            ('sep64', dict(conv_type='separable')),
+            ('sep32', dict(conv_type='separable', nb_filter=32)),
+            ('sep32x1', dict(conv_type='separable', nb_filter=32, unit_depth=1))]
+
+
+def throughput(model, X, batch_size=256, repeat=3):
+    """best samples/s of model.predict over X"""
+    model.predict([x[:batch_size] for x in X], batch_size=batch_size)  # warm up
+    best = np.inf
+    for _ in range(repeat):
+        ts = time.time()
+        model.predict(X, batch_size=batch_size)
+        best = min(best, time.time() - ts)
+    return len(X[0]) / best
+
+
+def main(data_format='channels_first', nb_sample=1024, nb_residual_unit=4):
+    rng = np.random.RandomState(1337)
+    print('=' * 10)
+    print('data_format: %s, # of residual units: %i, # of samples: %i' % (data_format, nb_residual_unit, nb_sample))
+    ref = None
+    for name, kwargs in VARIANTS:
+        model = STAR(external_dim=8, nb_residual_unit=nb_residual_unit, data_format=data_format, **kwargs)
+        shape = tuple(int(d) for d in model.inputs[0].shape[1:])
+        X = [rng.rand(nb_sample, *shape).astype(np.float32), rng.rand(nb_sample, 8).astype(np.float32)]
+        c = complexity(model)
+        speed = throughput(model, X)
+        ref = ref or (c['flops'], speed)
+        print('%-8s %9i params %8.1f M multiply-adds (x%.2f) %8.1f samples/s (x%.2f)'
+              % (name, c['params'], c['flops'] / 1e6, ref[0] / float(c['flops']), speed, speed / ref[1]))
+
+if __name__ == '__main__':
+    main(data_format=sys.argv[1] if len(sys.argv) > 1 else 'channels_first',
+         nb_sample=int(sys.argv[2]) if len(sys.argv) > 2 else 1024)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+    star.pipeline: STAR training epochs fed by in-memory NumPy arrays vs. the tf.data pipeline,
+    with the input stall time of the pipeline and the cost of its NumPy round trip (every batch is
+    fetched out of the graph by STPipeline, then fed back into it by fit_generator)
+
+Usage:
+    python benchmarks/bench_pipeline.py [number_of_days] [number_of_epochs]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from star import as_timeslots, timestamp2vec
+from star.STMatrix import STMatrix
+from star.STDataset import STDataset
+from bench_stmatrix import synthetic_stdata
+
+
+def _timed(f, nb_batch):
+    ts = time.time()
+    for _ in range(nb_batch):
+        f()
+    return (time.time() - ts) / nb_batch * 1000.
+
+
+def round_trip(pipeline, nb_batch=50):
+    """ms per batch of the NumPy round trip of the batches of pipeline:
+    fetch: sess.run of the batch minus sess.run of an op consuming it in the graph
+    feed: sess.run of the batch fed back through placeholders
+    """
+    import tensorflow as tf
+    sess = pipeline.sess
+    X, Y = pipeline.next_batch
+    tensors = list(X) + [Y]
+    with sess.graph.as_default():
+        consume = tf.group(*tensors)
+        placeholders = [tf.placeholder(t.dtype, t.shape) for t in tensors]
+        fed = tf.group(*[tf.identity(p) for p in placeholders])
+    in_graph = _timed(lambda: sess.run(consume), nb_batch)
+    fetch = _timed(lambda: sess.run(tensors), nb_batch)
+    batch = sess.run(tensors)
+    feed = _timed(lambda: sess.run(fed, feed_dict=dict(zip(placeholders, batch))), nb_batch)
+    return max(fetch - in_graph, 0.), feed
+
+
+def main(nb_day=30, nb_epoch=2, batch_size=16):
+    from star.model import STAR
+    from star.pipeline import STPipeline, StallTime
+    data, timestamps = synthetic_stdata(nb_day=nb_day, missing_ratio=0.)
+    timestamps = as_timeslots(timestamps, T=48)
+    index, target = STMatrix(data, timestamps, 48, CheckComplete=False).create_index(
+        len_closeness=3, len_period=1, len_trend=1)
+    dataset = STDataset((data * 2 - 1).astype(np.float32), index, target,
+                        timestamp2vec(timestamps[target]).astype(np.float32), timestamps[target])
+    print('=' * 10)
+    print('# of samples: %i, batch size: %i' % (len(dataset), batch_size))
+
+    model = STAR(external_dim=8, nb_residual_unit=2)
+    model.compile(loss='mse', optimizer='adam')
+
+    X, Y = dataset.materialize()
+    ts = time.time()
+    model.fit(X, Y, epochs=nb_epoch, batch_size=batch_size, shuffle=True, verbose=0)
+    print('numpy arrays: %.2f s/epoch' % ((time.time() - ts) / nb_epoch))
+
+    pipeline = STPipeline(dataset, batch_size=batch_size, shuffle=True, seed=1337)
+    stall = StallTime(pipeline, verbose=0)
+    ts = time.time()
+    model.fit_generator(pipeline, steps_per_epoch=len(pipeline), epochs=nb_epoch, callbacks=[stall], workers=0,
+                        verbose=0)
+    elapsed = (time.time() - ts) / nb_epoch
+    print('tf.data pipeline: %.2f s/epoch, input stall per epoch: %s s'
+          % (elapsed, ', '.join('%.3f' % s for s in stall.history)))
+    fetch, feed = round_trip(pipeline)
+    step = elapsed / len(pipeline) * 1000.
+    print('numpy round trip: fetch %.3f ms + feed %.3f ms per batch, %.2f%% of a training step (%.1f ms)'
+          % (fetch, feed, (fetch + feed) / step * 100., step))
+
+if __name__ == '__main__':
+    main(nb_day=int(sys.argv[1]) if len(sys.argv) > 1 else 30,
+         nb_epoch=int(sys.argv[2]) if len(sys.argv) > 2 else 2)
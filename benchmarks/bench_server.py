@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+    star.server: client latency and throughput of /predict, without and with micro-batching
+
+    A STAR model with random weights serves synthetic TaxiBJ-shaped frames on a local
+    port; every client thread sends its requests over its own keep-alive connection.
+
+Usage:
+    python benchmarks/bench_server.py [number_of_clients] [number_of_requests_per_client]
+"""
+from __future__ import print_function
+import os
+import sys
+import json
+import time
+import threading
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from http.client import HTTPConnection
+from star.minmax_normalization import MinMaxNormalization
+from star.server import PredictionServer
+from bench_stmatrix import synthetic_stdata
+
+
+def client(port, nb_request, latencies, body):
+    conn = HTTPConnection('127.0.0.1', port)
+    for _ in range(nb_request):
+        ts = time.time()
+        conn.request('POST', '/predict', body=body, headers={'Content-Type': 'application/json'})
+        response = conn.getresponse()
+        content = json.loads(response.read().decode('utf-8'))
+        assert response.status == 200, content
+        latencies.append((time.time() - ts) * 1000.)
+    conn.close()
+
+
+def run(model, mmn, data, timestamps, nb_client, nb_request, max_batch, max_delay):
+    app = PredictionServer(model, mmn, frame_shape=data.shape[1:], T=48, len_closeness=3, len_period=1,
+                           len_trend=1, meta_data=True, max_batch=max_batch, max_delay=max_delay)
+    app.extend(data, timestamps)
+    httpd = app.serve(port=0)
+    server = threading.Thread(target=httpd.serve_forever)
+    server.daemon = True
+    server.start()
+
+    body = json.dumps(dict()).encode('utf-8')
+    latencies = []
+    client(httpd.server_address[1], 2, [], body)  # warm up
+    ts = time.time()
+    threads = [threading.Thread(target=client, args=(httpd.server_address[1], nb_request, latencies, body))
+               for _ in range(nb_client)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - ts
+    httpd.shutdown()
+    httpd.server_close()
+
+    p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+    print('max_batch: %3i, %.1f requests/s, client latency (ms) p50: %.1f, p90: %.1f, p99: %.1f, '
+          'mean batch size: %.1f' % (max_batch, len(latencies) / elapsed, p50, p90, p99,
+                                     app.stats.summary()['mean_batch_size']))
+
+
+def main(nb_client=8, nb_request=50):
+    from star.model import STAR
+    model = STAR(c_conf=(3, 2, 32, 32), p_conf=(1, 2, 32, 32), t_conf=(1, 2, 32, 32),
+                 external_dim=8, nb_residual_unit=4)
+    model._make_predict_function()
+    # 8 days: the trend dependencies of the next slot are available
+    data, timestamps = synthetic_stdata(nb_day=8, missing_ratio=0.)
+    data = np.round(data * 1000)
+    mmn = MinMaxNormalization()
+    mmn.fit(data)
+
+    print('=' * 10)
+    print('# of clients: %i, # of requests per client: %i' % (nb_client, nb_request))
+    for max_batch, max_delay in [(1, 0.), (32, 0.005)]:
+        run(model, mmn, data, timestamps, nb_client, nb_request, max_batch, max_delay)
+
+if __name__ == '__main__':
+    main(nb_client=int(sys.argv[1]) if len(sys.argv) > 1 else 8,
+         nb_request=int(sys.argv[2]) if len(sys.argv) > 2 else 50)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+    STMatrix.create_dataset: vectorized index plan vs. the original per-timestamp loop
+
+Usage:
+    python benchmarks/bench_stmatrix.py [number_of_days]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from star import string2timestamp
+from star.STMatrix import STMatrix
+
+
+def synthetic_stdata(nb_day=120, T=48, nb_flow=2, map_height=32, map_width=32, missing_ratio=0.01, seed=1337):
+    """random flows over `nb_day` days with a few missing timeslots
+    """
+    rng = np.random.RandomState(seed)
+    start = datetime(2013, 7, 1)
+    timestamps = []
+    for d in range(nb_day):
+        day = (start + timedelta(days=d)).strftime('%Y%m%d')
+        for slot in range(1, T + 1):
+            timestamps.append(('%s%02i' % (day, slot)).encode('ascii'))
+    keep = rng.rand(len(timestamps)) >= missing_ratio
+    timestamps = [t for t, k in zip(timestamps, keep) if k]
+    data = rng.rand(len(timestamps), nb_flow, map_height, map_width)
+    return data, timestamps
+
+
+def create_dataset_loop(data, timestamps, T=48, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1):
+    """the original STMatrix.create_dataset, kept as the reference implementation
+    """
+    pd_timestamps = string2timestamp(timestamps, T=T)
+    get_index = dict()
+    for i, ts in enumerate(pd_timestamps):
+        get_index[ts] = i
+
+    def get_matrix(timestamp):
+        return data[get_index[timestamp]]
+
+    def check_it(depends):
+        for d in depends:
+            if d not in get_index.keys():
+                return False
+        return True
+
+    offset_frame = pd.DateOffset(minutes=24 * 60 // T)
+    XC = []
+    XP = []
+    XT = []
+    Y = []
+    timestamps_Y = []
+
+    C_in_P = 2
+    C_in_T = 2
+
+    depends = [range(1, len_closeness+1),
+               [i + PeriodInterval * T * j for j in range(1, len_period+1) for i in range(0, C_in_P)],
+               [i + TrendInterval * T * j for j in range(1, len_trend+1) for i in range(0, C_in_T)]]
+    i = max(T * TrendInterval * len_trend + C_in_T-1, T * PeriodInterval * len_period, len_closeness)
+    while i < len(pd_timestamps):
+        Flag = True
+        for depend in depends:
+            if Flag is False:
+                break
+            Flag = check_it([pd_timestamps[i] - j * offset_frame for j in depend])
+
+        if Flag is False:
+            i += 1
+            continue
+        x_c = [get_matrix(pd_timestamps[i] - j * offset_frame) for j in depends[0]]
+        x_p = [get_matrix(pd_timestamps[i] - j * offset_frame) for j in depends[1]]
+        x_t = [get_matrix(pd_timestamps[i] - j * offset_frame) for j in depends[2]]
+        y = get_matrix(pd_timestamps[i])
+        if len_closeness > 0:
+            XC.append(np.vstack(x_c))
+        if len_period > 0:
+            XP.append(np.vstack(x_p))
+        if len_trend > 0:
+            XT.append(np.vstack(x_t))
+        Y.append(y)
+        timestamps_Y.append(timestamps[i])
+        i += 1
+    return np.asarray(XC), np.asarray(XP), np.asarray(XT), np.asarray(Y), timestamps_Y
+
+
+def main(nb_day=120, T=48):
+    data, timestamps = synthetic_stdata(nb_day=nb_day, T=T)
+    kwargs = dict(len_closeness=3, len_period=1, len_trend=1)
+
+    ts = time.time()
+    expected = create_dataset_loop(data, timestamps, T, **kwargs)
+    t_loop = time.time() - ts
+
+    ts = time.time()
+    st = STMatrix(data, timestamps, T, CheckComplete=False)
+    result = st.create_dataset(**kwargs)
+    t_vec = time.time() - ts
+
+    for name, a, b in zip(['XC', 'XP', 'XT', 'Y'], expected[:4], result[:4]):
+        assert np.array_equal(a, b), name
+    assert list(expected[4]) == list(result[4].to_strings()), 'timestamps_Y'
+
+    print('=' * 10)
+    print('# of timeslots: %i, # of samples: %i' % (len(timestamps), len(result[4])))
+    print('loop:       %.3f seconds' % t_loop)
+    print('vectorized: %.3f seconds (x%.1f)' % (t_vec, t_loop / max(t_vec, 1e-9)))
+
+if __name__ == '__main__':
+    main(nb_day=int(sys.argv[1]) if len(sys.argv) > 1 else 120)
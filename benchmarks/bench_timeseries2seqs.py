@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+    unified timeseries2seqs (strided views) vs. the original per-window loop
+
+Usage:
+    python benchmarks/bench_timeseries2seqs.py [number_of_days]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+import tracemalloc
+from copy import copy
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from star import string2timestamp, timeseries2seqs
+from bench_stmatrix import synthetic_stdata
+
+
+def timeseries2seqs_meta_loop(data, timestamps, length=3, T=48):
+    """the original timeseries2seqs_meta (timeseries2seqs without the timestamps)"""
+    raw_ts = copy(timestamps)
+    timestamps = string2timestamp(timestamps, T=T)
+    offset = pd.DateOffset(minutes=24 * 60 // T)
+
+    breakpoints = [0]
+    for i in range(1, len(timestamps)):
+        if timestamps[i-1] + offset != timestamps[i]:
+            breakpoints.append(i)
+    breakpoints.append(len(timestamps))
+    X = []
+    Y = []
+    avail_timestamps = []
+    for b in range(1, len(breakpoints)):
+        idx = range(breakpoints[b-1], breakpoints[b])
+        for i in range(len(idx) - length):
+            avail_timestamps.append(raw_ts[idx[i+length]])
+            x = np.vstack(data[idx[i:i+length]])
+            y = data[idx[i+length]]
+            X.append(x)
+            Y.append(y)
+    X = np.asarray(X)
+    Y = np.asarray(Y)
+    return X, Y, avail_timestamps
+
+
+def timeseries2seqs_peroid_trend_loop(data, timestamps, length=3, T=48, peroid=pd.DateOffset(days=7), peroid_len=2):
+    """the original timeseries2seqs_peroid_trend (exact on data without gaps)"""
+    timestamps = string2timestamp(timestamps, T=T)
+    timestamp_idx = dict()
+    for i, t in enumerate(timestamps):
+        timestamp_idx[t] = i
+    X = []
+    Y = []
+    idx = range(0, len(timestamps))
+    for i in range(len(idx) - length):
+        target_timestamp = timestamps[i+length]
+        legal_idx = []
+        for pi in range(1, 1+peroid_len):
+            if target_timestamp - peroid * pi not in timestamp_idx:
+                break
+            legal_idx.append(timestamp_idx[target_timestamp - peroid * pi])
+        if len(legal_idx) != peroid_len:
+            continue
+        legal_idx += idx[i:i+length]
+        X.append(np.vstack(data[legal_idx]))
+        Y.append(data[idx[i+length]])
+    return np.asarray(X), np.asarray(Y)
+
+
+def measure(f, *args, **kwargs):
+    tracemalloc.start()
+    ts = time.time()
+    ret = f(*args, **kwargs)
+    elapsed = time.time() - ts
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return ret, elapsed, peak
+
+
+def report(name, t_loop, m_loop, t_new, m_new):
+    print('%-14s loop: %7.3f s %8.1f MB   unified: %7.3f s %8.1f MB' % (
+        name, t_loop, m_loop / 2.**20, t_new, m_new / 2.**20))
+
+
+def main(nb_day=60, T=48, length=3):
+    # with gaps
+    data, timestamps = synthetic_stdata(nb_day=nb_day, T=T, missing_ratio=0.002)
+    print('=' * 10, '# of timeslots: %i' % len(timestamps))
+    expected, t_loop, m_loop = measure(timeseries2seqs_meta_loop, data, timestamps, length=length, T=T)
+    result, t_new, m_new = measure(timeseries2seqs, data, timestamps, length=length, T=T, return_timestamps=True)
+    assert np.array_equal(expected[0], result[0]) and np.array_equal(expected[1], result[1])
+    assert expected[2] == list(result[2].to_strings())
+    report('2D', t_loop, m_loop, t_new, m_new)
+
+    result, t_new, m_new = measure(timeseries2seqs, data, timestamps, length=length, T=T, layout='3D')
+    nb_flow = data.shape[1]
+    assert np.array_equal(expected[0].reshape((len(expected[0]), nb_flow, length) + data.shape[2:]), result[0])
+    assert np.array_equal(expected[1].reshape((len(expected[1]), nb_flow, 1) + data.shape[2:]), result[1])
+    report('3D', t_loop, m_loop, t_new, m_new)
+
+    # without gaps, where the original period/trend lookup is exact
+    data, timestamps = synthetic_stdata(nb_day=nb_day, T=T, missing_ratio=0.)
+    expected, t_loop, m_loop = measure(timeseries2seqs_peroid_trend_loop, data, timestamps, length=length, T=T)
+    result, t_new, m_new = measure(timeseries2seqs, data, timestamps, length=length, T=T,
+                                   peroid=pd.DateOffset(days=7), peroid_len=2)
+    assert np.array_equal(expected[0], result[0]) and np.array_equal(expected[1], result[1])
+    report('period/trend', t_loop, m_loop, t_new, m_new)
+
+if __name__ == '__main__':
+    main(nb_day=int(sys.argv[1]) if len(sys.argv) > 1 else 60)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+    vectorized timestamp parsing vs. the original per-string functions of star/__init__.py
+
+Usage:
+    python benchmarks/bench_timestamp.py [number_of_days]
+"""
+from __future__ import print_function
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from star import string2timestamp, string2slot, timestamp2vec
+
+
+def synthetic_timestamps(nb_day=4 * 365, T=48):
+    start = datetime(2013, 1, 1)
+    timestamps = []
+    for d in range(nb_day):
+        day = (start + timedelta(days=d)).strftime('%Y%m%d')
+        for slot in range(1, T + 1):
+            timestamps.append(('%s%02i' % (day, slot)).encode('ascii'))
+    return timestamps
+
+
+def string2timestamp_loop(strings, T=48):
+    """the original string2timestamp"""
+    timestamps = []
+
+    time_per_slot = 24.0 / T
+    num_per_T = T // 24
+    for t in strings:
+        year, month, day, slot = int(t[:4]), int(t[4:6]), int(t[6:8]), int(t[8:])-1
+        timestamps.append(pd.Timestamp(datetime(year, month, day, hour=int(slot * time_per_slot), minute=(slot % num_per_T) * int(60.0 * time_per_slot))))
+
+    return timestamps
+
+
+def timestamp2vec_loop(timestamps):
+    """the original timestamp2vec"""
+    vec = [time.strptime(t[:8].decode('ascii'), '%Y%m%d').tm_wday for t in timestamps]
+    ret = []
+    for i in vec:
+        v = [0 for _ in range(7)]
+        v[i] = 1
+        if i >= 5:
+            v.append(0)  # weekend
+        else:
+            v.append(1)  # weekday
+        ret.append(v)
+    return np.asarray(ret)
+
+
+def bench(name, f_loop, f_vec, *args):
+    ts = time.time()
+    expected = f_loop(*args)
+    t_loop = time.time() - ts
+    ts = time.time()
+    result = f_vec(*args)
+    t_vec = time.time() - ts
+    print('%-18s loop: %7.3f s  vectorized: %7.3f s  (x%.1f)' % (name, t_loop, t_vec, t_loop / max(t_vec, 1e-9)))
+    return expected, result
+
+
+def main(nb_day=4 * 365):
+    for T in [48, 24]:
+        timestamps = synthetic_timestamps(nb_day=nb_day, T=T)
+        print('=' * 10, 'T=%i, # of timeslots: %i' % (T, len(timestamps)))
+
+        expected, result = bench('string2timestamp', string2timestamp_loop, string2timestamp, timestamps, T)
+        assert expected == result
+        offset = pd.Timedelta(minutes=24 * 60 // T).value
+        slots_loop = lambda strings, T: np.asarray([t.value for t in string2timestamp_loop(strings, T)], dtype=np.int64) // offset
+        expected, result = bench('string2slot', slots_loop, string2slot, timestamps, T)
+        assert np.array_equal(expected, result)
+
+        expected, result = bench('timestamp2vec', timestamp2vec_loop, timestamp2vec, timestamps)
+        assert np.array_equal(expected, result)
+
+if __name__ == '__main__':
+    main(nb_day=int(sys.argv[1]) if len(sys.argv) > 1 else 4 * 365)
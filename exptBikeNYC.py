@@ -8,14 +8,15 @@ import os
 import _pickle as pickle
 import numpy as np
 import math
-import h5py
 
 from keras.optimizers import Adam
 from keras.callbacks import EarlyStopping, ModelCheckpoint,TensorBoard, LearningRateScheduler
 from star.model import *
 from star.config import Config
 import star.metrics as metrics
+import keras.backend as K
 from star import BikeNYC
+from star.pipeline import STPipeline, StallTime
 
 np.random.seed(1337)  # for reproducibility
 
@@ -26,8 +27,10 @@ DATAPATH = Config().DATAPATH
 nb_epoch = 200  # number of epoch at training stage
 nb_epoch_cont = 150  # number of epoch at training (cont) stage
 batch_size = 16  # batch size
+eval_batch_size = 256  # batch size of the validation and test pipelines
 T = 24  # number of time intervals in one day
 CACHEDATA = True  # cache data or NOT
+path_cache = os.path.join(DATAPATH, 'CACHE')  # cache path
 
 lr = 0.00015  # learning rate
 len_closeness = 3  # length of closeness dependent sequence
@@ -48,6 +51,8 @@ map_height, map_width = 16, 8  # grid size
 # RMSE by multiplying the following factor (i.e., factor).
 nb_area = 81
 m_factor = math.sqrt(1. * map_height * map_width / nb_area)
+# the MAE is a mean, not the root of one: its factor is map_height * map_width / nb_area
+m_factor_mae = m_factor ** 2
 print('factor: ', m_factor)
 path_result = os.path.join('RET', 'NYC')
 path_model = os.path.join('MODEL', 'NYC')
@@ -57,56 +62,6 @@ for path in [path_result, path_model]:
         os.mkdir(path)
 
 
-def read_cache(fname):
-    mmn = pickle.load(open('preprocessing_nyc.pkl', 'rb'))
-
-    f = h5py.File(fname, 'r')
-    num = int(f['num'].value)
-    X_train_all, Y_train_all, X_train, Y_train, X_val, Y_val, X_test, Y_test = [], [], [], [], [], [], [], []
-    for i in range(num):
-        X_train_all.append(f['X_train_all_%i' % i].value)
-        X_train.append(f['X_train_%i' % i].value)
-        X_val.append(f['X_val_%i' % i].value)
-        X_test.append(f['X_test_%i' % i].value)
-    Y_train_all = f['Y_train_all'].value
-    Y_train = f['Y_train'].value
-    Y_val = f['Y_val'].value
-    Y_test = f['Y_test'].value
-    external_dim = f['external_dim'].value
-    timestamp_train_all = f['T_train_all'].value
-    timestamp_train = f['T_train'].value
-    timestamp_val = f['T_val'].value
-    timestamp_test = f['T_test'].value
-    f.close()
-
-    return X_train_all, Y_train_all, X_train, Y_train, X_val, Y_val, X_test, Y_test, mmn, external_dim, timestamp_train_all, timestamp_train, timestamp_val, timestamp_test
-
-def cache(fname, X_train_all, Y_train_all, X_train, Y_train, X_val, Y_val, X_test, Y_test, external_dim, timestamp_train_all, timestamp_train, timestamp_val, timestamp_test):
-    h5 = h5py.File(fname, 'w')
-    h5.create_dataset('num', data=len(X_train_all))
-
-    for i, data in enumerate(X_train_all):
-        h5.create_dataset('X_train_all_%i' % i, data=data)
-    for i, data in enumerate(X_train):
-        h5.create_dataset('X_train_%i' % i, data=data)
-    for i, data in enumerate(X_val):
-        h5.create_dataset('X_val_%i' % i, data=data)
-    # for i, data in enumerate(Y_train):
-    for i, data in enumerate(X_test):
-        h5.create_dataset('X_test_%i' % i, data=data)
-
-    h5.create_dataset('Y_train_all', data=Y_train_all)
-    h5.create_dataset('Y_train', data=Y_train)
-    h5.create_dataset('Y_val', data=Y_val)
-    h5.create_dataset('Y_test', data=Y_test)
-    external_dim = -1 if external_dim is None else int(external_dim)
-    h5.create_dataset('external_dim', data=external_dim)
-    h5.create_dataset('T_train_all', data=timestamp_train_all)
-    h5.create_dataset('T_train', data=timestamp_train)
-    h5.create_dataset('T_val', data=timestamp_val)
-    h5.create_dataset('T_test', data=timestamp_test)
-    h5.close()
-
 def build_model(external_dim):
     c_conf = (len_closeness, nb_flow, map_height,
               map_width) if len_closeness > 0 else None
@@ -140,26 +95,17 @@ def lrschedule(epoch):
 def main():
     dic_rmse = {}
     for i in range(0,10):
+        # a fresh graph per run: the models, the frames variable and the pipelines of the previous
+        # runs are freed
+        K.clear_session()
         print("loading data...")
-        fname = os.path.join(DATAPATH, 'CACHE', 'BikeNYC_C{}_P{}_T{}.h5'.format(
-            len_closeness, len_period, len_trend))
-        if os.path.exists(fname) and CACHEDATA:
-            X_train_all, Y_train_all, X_train, Y_train, \
-            X_val, Y_val, X_test, Y_test, mmn, external_dim, \
-            timestamp_train_all, timestamp_train, timestamp_val, timestamp_test = read_cache(
-                fname)
-            print("load %s successfully" % fname)
-        else:
-            X_train_all, Y_train_all, X_train, Y_train, \
-            X_val, Y_val, X_test, Y_test, mmn, external_dim, \
-            timestamp_train_all, timestamp_train, timestamp_val, timestamp_test = BikeNYC.load_data(
-                T=T, nb_flow=nb_flow, len_closeness=len_closeness, len_period=len_period, len_trend=len_trend, len_test=len_test,
-                len_val=len_val, preprocess_name='preprocessing_nyc.pkl', meta_data=True)
-            if CACHEDATA:
-                cache(fname, X_train_all, Y_train_all, X_train, Y_train, X_val, Y_val, X_test, Y_test,
-                      external_dim, timestamp_train_all, timestamp_train, timestamp_val, timestamp_test)
-
-        print("\n days (test): ", [v[:8] for v in timestamp_test[0::T]])
+        # STDataset views over the base frames: nothing is materialized
+        dataset_train_all, dataset_train, dataset_val, dataset_test, mmn, external_dim = BikeNYC.load_dataset(
+            T=T, nb_flow=nb_flow, len_closeness=len_closeness, len_period=len_period, len_trend=len_trend, len_test=len_test,
+            len_val=len_val, preprocess_name='preprocessing_nyc.pkl', meta_data=True,
+            cache_dir=path_cache if CACHEDATA else None)
+
+        print("\n days (test): ", [v[:8] for v in dataset_test.timestamps[0::T].to_strings()])
 
         print('=' * 10)
         print("compiling model...")
@@ -177,14 +123,20 @@ def main():
         model_checkpoint = ModelCheckpoint(
             fname_param, monitor='val_rmse', verbose=0, save_best_only=True, mode='min')
 
+        # tf.data pipelines, the frames uploaded once in the session and shared by all of them
+        pipeline_train = STPipeline(dataset_train, batch_size=batch_size, shuffle=True)
+        pipeline_val = STPipeline(dataset_val, batch_size=eval_batch_size)
+
         print('=' * 10)
         print("training model...")
-        history = model.fit(X_train, Y_train,
-                            epochs=nb_epoch,
-                            batch_size=batch_size,
-                            validation_data=(X_val,Y_val),
-                            callbacks=[early_stopping, model_checkpoint],
-                            verbose=2)
+        history = model.fit_generator(pipeline_train,
+                                      steps_per_epoch=len(pipeline_train),
+                                      epochs=nb_epoch,
+                                      validation_data=pipeline_val,
+                                      validation_steps=len(pipeline_val),
+                                      callbacks=[StallTime(pipeline_train), early_stopping, model_checkpoint],
+                                      workers=0,
+                                      verbose=2)
         model.save_weights(os.path.join(
             path_model, '{}.h5'.format(hyperparams_name)), overwrite=True)
         pickle.dump((history.history), open(os.path.join(
@@ -194,15 +146,13 @@ def main():
         print('evaluating using the model that has the best loss on the valid set')
 
         model.load_weights(fname_param)
-        score = model.evaluate(X_train, Y_train, batch_size=Y_train.shape[
-                               0] // 48, verbose=0)
-        print('Train score: %.6f rmse (norm): %.6f rmse (real): %.6f' %
-              (score[0], score[1], score[1] * (mmn._max - mmn._min) / 2. * m_factor))
+        score = metrics.evaluate(model, dataset_train, mmn=mmn, T=T)
+        print('Train rmse (norm): %.6f rmse (real): %.6f mae (real): %.6f mape: %.6f' %
+              (score['rmse_norm'], score['rmse'] * m_factor, score['mae'] * m_factor_mae, score['mape']))
 
-        score = model.evaluate(
-            X_test, Y_test, batch_size=Y_test.shape[0], verbose=0)
-        print('Test score: %.6f rmse (norm): %.6f rmse (real): %.6f' %
-              (score[0], score[1], score[1] * (mmn._max - mmn._min) / 2. * m_factor))
+        score = metrics.evaluate(model, dataset_test, mmn=mmn, T=T)
+        print('Test rmse (norm): %.6f rmse (real): %.6f mae (real): %.6f mape: %.6f' %
+              (score['rmse_norm'], score['rmse'] * m_factor, score['mae'] * m_factor_mae, score['mape']))
 
         print('=' * 10)
         print("training model (cont)...")
@@ -210,12 +160,16 @@ def main():
             path_model, '{}.cont.best.h5'.format(hyperparams_name))
         model_checkpoint = ModelCheckpoint(
             fname_param, monitor='rmse', verbose=0, save_best_only=True, mode='min')
-        history = model.fit(X_train_all, Y_train_all,
-                            nb_epoch=nb_epoch_cont,
-                            verbose=2,
-                            batch_size=batch_size,
-                            callbacks=[lr, model_checkpoint],
-                            validation_data=(X_test, Y_test))
+        pipeline_train_all = STPipeline(dataset_train_all, batch_size=batch_size, shuffle=True)
+        pipeline_test = STPipeline(dataset_test, batch_size=eval_batch_size)
+        history = model.fit_generator(pipeline_train_all,
+                                      steps_per_epoch=len(pipeline_train_all),
+                                      epochs=nb_epoch_cont,
+                                      verbose=2,
+                                      callbacks=[StallTime(pipeline_train_all), lr, model_checkpoint],
+                                      validation_data=pipeline_test,
+                                      validation_steps=len(pipeline_test),
+                                      workers=0)
         pickle.dump((history.history), open(os.path.join(
             path_result, '{}.cont.history.pkl'.format(hyperparams_name)), 'wb'))
         model.save_weights(os.path.join(
@@ -223,16 +177,14 @@ def main():
 
         print('=' * 10)
         print('evaluating using the final model')
-        score = model.evaluate(X_train_all, Y_train_all, batch_size=Y_train.shape[
-                               0] // 48, verbose=0)
-        print('Train score: %.6f rmse (norm): %.6f rmse (real): %.6f' %
-              (score[0], score[1], score[1] * (mmn._max - mmn._min) / 2. * m_factor))
-
-        score = model.evaluate(
-            X_test, Y_test, batch_size=Y_test.shape[0], verbose=0)
-        print('Test score: %.6f rmse (norm): %.6f rmse (real): %.6f' %
-              (score[0], score[1], score[1] * (mmn._max - mmn._min) / 2. * m_factor))
-        # dic_rmse[hyperparams_name] = score[1] * (mmn._max - mmn._min) / 2. * m_factor
+        score = metrics.evaluate(model, dataset_train_all, mmn=mmn, T=T)
+        print('Train rmse (norm): %.6f rmse (real): %.6f mae (real): %.6f mape: %.6f' %
+              (score['rmse_norm'], score['rmse'] * m_factor, score['mae'] * m_factor_mae, score['mape']))
+
+        score = metrics.evaluate(model, dataset_test, mmn=mmn, T=T)
+        print('Test rmse (norm): %.6f rmse (real): %.6f mae (real): %.6f mape: %.6f' %
+              (score['rmse_norm'], score['rmse'] * m_factor, score['mae'] * m_factor_mae, score['mape']))
+        # dic_rmse[hyperparams_name] = score['rmse'] * m_factor
     # os.system('rm /home/suhan/wanghn/DeepST/data/CACHE/'+'BikeNYC_C{}_P{}_T{}.h5'.format(
             # len_closeness, len_period, len_trend))
     # print(sorted(dic_rmse.items(), key=lambda item:item[1]))
@@ -6,7 +6,9 @@ import numpy as np
 from star import *
 from star.minmax_normalization import MinMaxNormalization
 from star.config import Config
+from star import cache
 from star.STMatrix import STMatrix
+from star.STDataset import STDataset
 
 np.random.seed(1337)  # for reproducibility
 
@@ -14,96 +16,118 @@ np.random.seed(1337)  # for reproducibility
 DATAPATH = Config().DATAPATH
 
 
-def load_data(T=24, nb_flow=2, len_closeness=None, len_period=None, len_trend=None, len_test=None, len_val=None, preprocess_name='preprocessing.pkl', meta_data=True):
-    assert(len_closeness + len_period + len_trend > 0)
-    # load data
-    data, timestamps = load_stdata(os.path.join(DATAPATH, 'BikeNYC', 'NYC14_M16x8_T60_NewEnd.h5'))
+def load_frames(fname, T=24, len_test=None, dtype=np.float32, counts=False):
+    """normalized base frames, in dtype
+
+    counts: keep the raw counts in the smallest unsigned integer type that fits instead,
+            mmn being only fitted
+
+    return: frames, timestamps, mmn
+    """
+    data, timestamps = load_stdata(fname, lazy=True)
     print(len(timestamps))
     # remove a certain day which does not have 48 timestamps
     data, timestamps = remove_incomplete_days(data, timestamps, T)
     # print(timestamps)
     # data = data[:, :nb_flow]
-    data[data < 0] = 0.
-    data_all = [data]
-    timestamps_all = [timestamps]
+    if counts:
+        dtype = count_dtype(max(chunk.max() for _, _, chunk in data.iter_chunks()))
+    frames = stack_stdata([data], dtype=dtype)
     # minmax_scale
-    data_train = data[:-len_test]
+    data_train = frames[:-len_test]
     print('train_data shape: ', data_train.shape)
     mmn = MinMaxNormalization()
     mmn.fit(data_train)
-    data_all_mmn = []
-    for d in data_all:
-        data_all_mmn.append(mmn.transform(d))
-
-    fpkl = open('preprocessing_nyc.pkl', 'wb')
+    if not counts:
+        mmn.transform(frames, out=frames)
+    return frames, timestamps, mmn
+
+
+def load_dataset(T=24, nb_flow=2, len_closeness=None, len_period=None, len_trend=None, len_test=None, len_val=None, preprocess_name='preprocessing.pkl', meta_data=True, cache_dir=None, dtype='float32', cache_dtype=None, counts=False, len_horizon=1, data_format='channels_first'):
+    """
+    same samples as load_data, kept as STDataset views over the normalized base frames
+    instead of materialized XCPT arrays
+
+    cache_dir: keep the base frames and the index plan in this directory (see star.cache)
+    dtype: dtype of the frames and meta features, converted once at load time
+    cache_dtype: dtype of the cached frames, e.g. float16 (default: dtype)
+    counts: keep the frames as raw counts in the smallest unsigned integer type that fits,
+            normalized to dtype when a batch is gathered
+    len_horizon: number of future frames of every target (Y of len_horizon * nb_flow channels)
+    data_format: layout of the XCPT and Y batches, 'channels_last' for NHWC models
+
+    return: dataset_train_all, dataset_train, dataset_val, dataset_test, mmn, metadata_dim
+    """
+    assert(len_closeness + len_period + len_trend > 0)
+    # load data
+    fname = os.path.join(DATAPATH, 'BikeNYC', 'NYC14_M16x8_T60_NewEnd.h5')
+    dtype = np.dtype(dtype)
+    # the raw counts are stored as they are
+    cache_dtype = None if counts else np.dtype(cache_dtype or dtype)
+    if cache_dir is not None:
+        config = dict(dataset='BikeNYC', T=T, len_test=len_test, scaler='MinMaxNormalization',
+                      dtype=dtype.name, cache_dtype=getattr(cache_dtype, 'name', None), counts=counts)
+        frames_dir = cache.frames_path(cache_dir, 'BikeNYC', cache.cache_key(config, [fname]))
+        config.update(len_closeness=len_closeness, len_period=len_period, len_trend=len_trend,
+                      len_horizon=len_horizon, meta_data=meta_data)
+        plan_dir = cache.plan_path(frames_dir, cache.cache_key(config, [fname]))
+
+    if cache_dir is not None and cache.exists(frames_dir):
+        print("load frames from", frames_dir)
+        frames, timestamps_all, mmn = cache.load_frames(
+            frames_dir, dtype=dtype if cache_dtype is not None else None)
+        timestamps = timestamps_all[0]
+    else:
+        frames, timestamps, mmn = load_frames(fname, T=T, len_test=len_test, dtype=dtype, counts=counts)
+        if cache_dir is not None:
+            cache.save_frames(frames_dir, frames, [timestamps], mmn, dtype=cache_dtype)
+    # written on a cache hit too, from the scaler stored with the frames
+    # (star.server and star.quantize read it)
+    fpkl = open(preprocess_name, 'wb')
     for obj in [mmn]:
         pickle.dump(obj, fpkl)
     fpkl.close()
 
-    XC, XP, XT = [], [], []
-    XCPT = []
-    Y = []
-    timestamps_Y = []
-    for data, timestamps in zip(data_all_mmn, timestamps_all):
-
-        st = STMatrix(data, timestamps, T, CheckComplete=False)
-        _XC, _XP, _XT, _Y, _timestamps_Y = st.create_dataset(
-            len_closeness=len_closeness, len_period=len_period, len_trend=len_trend)
-        # _XCPT[:, 0:6, :, :] = _XC
-        # _XCPT = np.zeros((_XC.shape[0], 2*(len_closeness+len_period+len_trend), 32, 32))
-        print("_XC shape: ", _XC.shape, "_XP shape:", _XP.shape, "_XT shape:", _XT.shape)
-        _XCPT = np.concatenate((_XC, _XP),axis=1)
-        _XCPT = np.concatenate((_XCPT, _XT),axis=1)
-        # _XCPT = np.concatenate((_XCPT, _XT),axis=1)
-        # print(_XCPT.shape)
-    # XC = np.vstack(XC)
-    # XP = np.vstack(XP)
-    # XT = np.vstack(XT)
-        XCPT.append(_XCPT)
-        Y.append(_Y)
-
-        timestamps_Y += _timestamps_Y
-        
-    Y = np.vstack(Y)
-    XCPT = np.vstack(XCPT)
-
-    # print("XC shape: ", XC.shape, "XP shape: ", XP.shape, "XT shape: ", XT.shape, "Y shape:", Y.shape)
-
-    XCPT_train_all, Y_train_all = XCPT[:-len_test], Y[:-len_test]
-    XCPT_train, Y_train = XCPT[:-len_val], Y[:-len_val]
-    XCPT_val, Y_val = XCPT[-len_val:-len_test], Y[-len_val:-len_test]
-    XCPT_test, Y_test = XCPT[-len_test:], Y[-len_test:]
-    
-    timestamp_train_all, timestamp_train, timestamp_val, timestamp_test = timestamps_Y[:-len_test], timestamps_Y[:-len_val], timestamps_Y[-len_val:-len_test], timestamps_Y[-len_test:]
-
-    X_train_all, X_train, X_val, X_test = [], [], [], []
-
-    X_train_all.append(XCPT_train_all)
-    X_train.append(XCPT_train)
-    X_val.append(XCPT_val)
-    X_test.append(XCPT_test)
-
-    meta_feature = []
-
-    # for l, X_ in zip([len_closeness, len_period, len_trend], [XC_train, XP_train, XT_train]):
-    #     if l > 0:
-    #         X_train.append(X_)
-    # for l, X_ in zip([len_closeness, len_period, len_trend], [XC_test, XP_test, XT_test]):
-    #     if l > 0:
-    #         X_test.append(X_)
-    # print('train shape:', XC_train.shape, Y_train.shape, 'test shape: ', XC_test.shape, Y_test.shape)
-    # load meta feature
-    if meta_data:
-        meta_feature = timestamp2vec(timestamps_Y)
-        metadata_dim = meta_feature.shape[1]
-        meta_feature_train_all, meta_feature_train, meta_feature_val, meta_feature_test = meta_feature[
-        :-len_test], meta_feature[:-len_val], meta_feature[-len_val:-len_test], meta_feature[-len_test:]
-        X_train_all.append(meta_feature_train_all)  
-        X_train.append(meta_feature_train)
-        X_val.append(meta_feature_val)
-        X_test.append(meta_feature_test)
+    if cache_dir is not None and cache.exists(plan_dir):
+        print("load index plan from", plan_dir)
+        index, target, meta_feature, timestamps_Y = cache.load_plan(plan_dir)
     else:
-        metadata_dim = None
+        st = STMatrix(None, timestamps, T, CheckComplete=False)
+        index, target = st.create_index(
+            len_closeness=len_closeness, len_period=len_period, len_trend=len_trend, len_horizon=len_horizon)
+        # meta features of the first predicted frame
+        timestamps_Y = timestamps[target if target.ndim == 1 else target[:, 0]]
+        # load meta feature
+        meta_feature = timestamp2vec(timestamps_Y).astype(dtype) if meta_data else None
+        if cache_dir is not None:
+            cache.save_plan(plan_dir, index, target, meta_feature, timestamps_Y)
+
+    dataset = STDataset(frames, index, target, meta_feature, timestamps_Y,
+                        mmn if counts else None, dtype, data_format)
+    metadata_dim = dataset.metadata_dim
+    print("frames shape: ", frames.shape, "XCPT shape: ", dataset.shape)
+
+    return dataset.split(len_test, len_val) + (mmn, metadata_dim)
+
+
+def load_data(T=24, nb_flow=2, len_closeness=None, len_period=None, len_trend=None, len_test=None, len_val=None, preprocess_name='preprocessing.pkl', meta_data=True, cache_dir=None, dtype='float32', cache_dtype=None, counts=False, len_horizon=1, data_format='channels_first'):
+    dataset_train_all, dataset_train, dataset_val, dataset_test, mmn, metadata_dim = load_dataset(
+        T=T, nb_flow=nb_flow, len_closeness=len_closeness, len_period=len_period, len_trend=len_trend,
+        len_test=len_test, len_val=len_val, preprocess_name=preprocess_name, meta_data=meta_data,
+        cache_dir=cache_dir, dtype=dtype, cache_dtype=cache_dtype, counts=counts,
+        len_horizon=len_horizon, data_format=data_format)
+
+    # train_all is materialized once, train and val being views of it (as the splits of the
+    # original XCPT array)
+    X_train_all, Y_train_all = dataset_train_all.materialize()
+    nb_train = len(dataset_train)
+    X_train, Y_train = [X[:nb_train] for X in X_train_all], Y_train_all[:nb_train]
+    X_val, Y_val = [X[nb_train:] for X in X_train_all], Y_train_all[nb_train:]
+    X_test, Y_test = dataset_test.materialize()
+
+    timestamp_train_all, timestamp_train, timestamp_val, timestamp_test = dataset_train_all.timestamps, \
+        dataset_train.timestamps, dataset_val.timestamps, dataset_test.timestamps
+
     for _X in X_train_all:
         print(_X.shape, )
     print()    
@@ -172,8 +196,9 @@ def load_data_kdd18(T=24, nb_flow=2, len_closeness=None, len_period=None, len_tr
         XCPT.append(_XCPT)
         Y.append(_Y)
 
-        timestamps_Y += _timestamps_Y
+        timestamps_Y.append(_timestamps_Y)
         
+    timestamps_Y = Timeslots.concatenate(timestamps_Y)
     Y = np.vstack(Y)
     Y = Y.transpose(0, 2, 1, 3, 4)
     XCPT = np.vstack(XCPT)
@@ -0,0 +1,99 @@
+from __future__ import print_function
+import numpy as np
+
+
+class STDataset(object):
+    """C/P/T samples gathered on demand from a base frame tensor
+
+    frames: (nb_frame, nb_flow, map_height, map_width), shared by every split
+    index: (nb_sample, nb_depend) positions in frames of the closeness, period and
+           trend frames of every sample, in the XCPT channel order
+    target: (nb_sample,) positions in frames of the targets, or (nb_sample, nb_horizon)
+            for multi-horizon samples, whose Y stacks the nb_horizon frames along the channels
+    meta: (nb_sample, metadata_dim) external features, or None
+    timestamps: (nb_sample,) timestamps of the targets
+    scaler: applied to the gathered frames (e.g. frames of raw counts), with the result in dtype
+    data_format: layout of the XCPT and Y batches, 'channels_first' (as the frames) or
+                 'channels_last' (NHWC)
+    """
+
+    def __init__(self, frames, index, target, meta=None, timestamps=None, scaler=None, dtype=None,
+                 data_format='channels_first'):
+        super(STDataset, self).__init__()
+        assert len(index) == len(target)
+        assert meta is None or len(meta) == len(target)
+        self.frames = frames
+        self.index = index
+        self.target = target
+        self.meta = meta
+        self.timestamps = timestamps
+        self.scaler = scaler
+        self.dtype = dtype
+        self.data_format = data_format
+
+    def __len__(self):
+        return len(self.target)
+
+    @property
+    def metadata_dim(self):
+        return self.meta.shape[1] if self.meta is not None and self.meta.ndim > 1 else None
+
+    @property
+    def shape(self):
+        """shape of the materialized XCPT array"""
+        nb_flow, map_height, map_width = self.frames.shape[1:]
+        if self.data_format == 'channels_last':
+            return (len(self), map_height, map_width, self.index.shape[1] * nb_flow)
+        return (len(self), self.index.shape[1] * nb_flow, map_height, map_width)
+
+    def subset(self, start=None, stop=None):
+        """samples [start:stop], sharing the frames (no copy)"""
+        s = slice(start, stop)
+        meta = self.meta[s] if self.meta is not None else None
+        timestamps = self.timestamps[s] if self.timestamps is not None else None
+        return STDataset(self.frames, self.index[s], self.target[s], meta, timestamps, self.scaler, self.dtype,
+                         self.data_format)
+
+    def split(self, len_test, len_val):
+        """train_all, train, val and test subsets as in load_data"""
+        return (self.subset(None, -len_test), self.subset(None, -len_val),
+                self.subset(-len_val, -len_test), self.subset(-len_test, None))
+
+    def gather(self, index):
+        frames = self.frames[index.ravel()]
+        if self.scaler is not None:
+            frames = self.scaler.transform(frames, dtype=self.dtype)
+        return frames.reshape(index.shape + frames.shape[1:])
+
+    def stack(self, frames):
+        """(nb_sample, nb_frame, nb_flow, h, w) --> (nb_sample, nb_frame * nb_flow, h, w) or NHWC"""
+        if self.data_format == 'channels_last':
+            # a single copy, in the channel order of channels_first
+            frames = np.ascontiguousarray(frames.transpose(0, 3, 4, 1, 2))
+            return frames.reshape(frames.shape[:3] + (-1, ))
+        return frames.reshape((len(frames), -1) + frames.shape[3:])
+
+    def get_X(self, ids=slice(None)):
+        """[XCPT] (+ [meta]) of the samples `ids`"""
+        index = self.index[ids]
+        XCPT = self.stack(self.gather(index))
+        X = [XCPT]
+        if self.metadata_dim is not None:
+            X.append(self.meta[ids])
+        return X
+
+    def get_Y(self, ids=slice(None)):
+        target = self.target[ids]
+        Y = self.gather(target)
+        if target.ndim > 1:
+            return self.stack(Y)
+        if self.data_format == 'channels_last':
+            return np.ascontiguousarray(Y.transpose(0, 2, 3, 1))
+        return Y
+
+    def batch(self, ids):
+        return self.get_X(ids), self.get_Y(ids)
+
+    def materialize(self):
+        """dense X, Y arrays, as returned by the original load_data"""
+        return self.batch(slice(None))
@@ -1,107 +1,300 @@
 from __future__ import print_function
 import os
+import re
+from datetime import datetime
+import h5py
 import pandas as pd
 import numpy as np
 
 from star import *
 
 
+def depend_offsets(T=48, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1):
+    """offsets (in frames) of the closeness, period and trend dependencies of a target
+    """
+    C_in_P = 2
+    C_in_T = 2
+
+    return [list(range(1, len_closeness+1)),
+            [i + PeriodInterval * T * j for j in range(1, len_period+1) for i in range(0, C_in_P)],
+            [i + TrendInterval * T * j for j in range(1, len_trend+1) for i in range(0, C_in_T)]]
+
+
 class STMatrix(object):
     """docstring for STMatrix"""
 
     def __init__(self, data, timestamps, T=48, CheckComplete=True):
         super(STMatrix, self).__init__()
-        assert len(data) == len(timestamps)
+        # data may be None when only the index plan is needed
+        assert data is None or len(data) == len(timestamps)
         self.data = data
-        self.timestamps = timestamps
+        self.timestamps = as_timeslots(timestamps, T=T)
         self.T = T
-        self.pd_timestamps = string2timestamp(timestamps, T=self.T)
         if CheckComplete:
             self.check_complete()
         # index
         self.make_index()
 
     def make_index(self):
-        self.get_index = dict()
-        for i, ts in enumerate(self.pd_timestamps):
-            self.get_index[ts] = i
+        # slot number --> position, -1 for the missing slots
+        slots = self.timestamps.slots
+        self.first_slot = slots.min() if len(slots) > 0 else 0
+        self.get_index = np.full(slots.max() - self.first_slot + 1 if len(slots) > 0 else 0, -1, dtype=np.int64)
+        self.get_index[slots - self.first_slot] = np.arange(len(slots), dtype=np.int64)
 
     def check_complete(self):
-        missing_timestamps = []
-        offset = pd.DateOffset(minutes=24 * 60 // self.T)
-        pd_timestamps = self.pd_timestamps
-        i = 1
-        while i < len(pd_timestamps):
-            if pd_timestamps[i-1] + offset != pd_timestamps[i]:
-                missing_timestamps.append("(%s -- %s)" % (pd_timestamps[i-1], pd_timestamps[i]))
-            i += 1
-        for v in missing_timestamps:
-            print(v)
-        assert len(missing_timestamps) == 0
+        slots = self.timestamps.slots
+        gaps = np.flatnonzero(np.diff(slots) != 1)
+        pd_timestamps = self.timestamps[np.concatenate([gaps, gaps + 1])].to_timestamps()
+        for i in range(len(gaps)):
+            print("(%s -- %s)" % (pd_timestamps[i], pd_timestamps[len(gaps) + i]))
+        assert len(gaps) == 0
+
+    def index_of(self, slots):
+        """positions of the slot numbers `slots`, -1 for the missing ones"""
+        slots = np.asarray(slots, dtype=np.int64) - self.first_slot
+        inside = (slots >= 0) & (slots < len(self.get_index))
+        index = self.get_index[np.where(inside, slots, 0)]
+        index[~inside] = -1
+        return index
 
     def get_matrix(self, timestamp):
-        return self.data[self.get_index[timestamp]]
+        """frame at `timestamp`, a slot number or a `YYYYMMDDSS` string"""
+        if not isinstance(timestamp, (int, np.integer)):
+            timestamp = string2slot([timestamp], T=self.T)[0]
+        i = self.index_of([timestamp])[0]
+        if i < 0:
+            raise KeyError(timestamp)
+        return self.data[i]
 
     def save(self, fname):
-        pass
+        """write data and timestamps in the layout read by load_stdata"""
+        with h5py.File(fname, 'w') as f:
+            f.create_dataset('data', data=np.asarray(self.data))
+            f.create_dataset('date', data=self.timestamps.to_strings())
 
     def check_it(self, depends):
-        for d in depends:
-            if d not in self.get_index.keys():
-                return False
-        return True
+        """whether all the slot numbers `depends` are available"""
+        return bool((self.index_of(depends) >= 0).all())
 
-    def create_dataset(self, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1):
-        """current version
+    def depends(self, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1):
+        """offsets (in frames) of the closeness, period and trend dependencies of a target
         """
-        # offset_week = pd.DateOffset(days=7)
-        offset_frame = pd.DateOffset(minutes=24 * 60 // self.T)
-        XC = []
-        XP = []
-        XT = []
-        Y = []
-        timestamps_Y = []
-
-        C_in_P = 2
+        return depend_offsets(self.T, len_closeness=len_closeness, len_trend=len_trend, TrendInterval=TrendInterval,
+                              len_period=len_period, PeriodInterval=PeriodInterval)
+
+    def create_index(self, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1,
+                     len_horizon=1):
+        """index plan of the C/P/T samples
+
+        len_horizon: number of consecutive target frames of a sample (multi-horizon)
+        return:
+            index: (nb_sample, nb_depend) positions in self.data of the closeness,
+                   period and trend frames of every sample, in that order
+            target: (nb_sample,) positions in self.data of the targets,
+                    (nb_sample, len_horizon) if len_horizon > 1
+        """
+        depends = self.depends(len_closeness=len_closeness, len_trend=len_trend, TrendInterval=TrendInterval,
+                               len_period=len_period, PeriodInterval=PeriodInterval)
+        offsets = np.asarray(depends[0] + depends[1] + depends[2], dtype=np.int64)
         C_in_T = 2
+        start = max(self.T * TrendInterval * len_trend + C_in_T-1, self.T * PeriodInterval * len_period, len_closeness)
+        print(start)
 
-        depends = [range(1, len_closeness+1),
-                   # [PeriodInterval * self.T * j for j in range(1, len_period+1)],
-                   # [TrendInterval * self.T * j for j in range(1, len_trend+1)]]
-                  [i + PeriodInterval * self.T * j for j in range(1, len_period+1) for i in range(0, C_in_P)],
-                  [i + TrendInterval * self.T * j for j in range(1, len_trend+1) for i in range(0, C_in_T)]]
-        i = max(self.T * TrendInterval * len_trend + C_in_T-1, self.T * PeriodInterval * len_period, len_closeness)
-        print(i)
-        while i < len(self.pd_timestamps):
-            Flag = True
-            for depend in depends:
-                if Flag is False:
-                    break
-                Flag = self.check_it([self.pd_timestamps[i] - j * offset_frame for j in depend])
-
-            if Flag is False:
-                i += 1
-                continue
-            x_c = [self.get_matrix(self.pd_timestamps[i] - j * offset_frame) for j in depends[0]]
-            x_p = [self.get_matrix(self.pd_timestamps[i] - j * offset_frame) for j in depends[1]]
-            x_t = [self.get_matrix(self.pd_timestamps[i] - j * offset_frame) for j in depends[2]]
-            y = self.get_matrix(self.pd_timestamps[i])
-            if len_closeness > 0:
-                XC.append(np.vstack(x_c))
-            if len_period > 0:
-                XP.append(np.vstack(x_p))
-            if len_trend > 0:
-                XT.append(np.vstack(x_t))
-            Y.append(y)
-            timestamps_Y.append(self.timestamps[i])
-            i += 1
-        XC = np.asarray(XC)
-        XP = np.asarray(XP)
-        XT = np.asarray(XT)
-        Y = np.asarray(Y)
+        nb_frame = len(self.timestamps)
+        target = np.arange(start, nb_frame, dtype=np.int64)
+        index = self.index_of(self.timestamps.slots[target][:, None] - offsets[None, :])
+        complete = (index >= 0).all(axis=1)
+        if len_horizon > 1:
+            target = self.index_of(self.timestamps.slots[target][:, None] + np.arange(len_horizon)[None, :])
+            complete &= (target >= 0).all(axis=1)
+        return index[complete], target[complete]
+
+    def gather(self, index):
+        """frames at the positions `index`, with shape index.shape + frame shape
+        """
+        index = np.asarray(index)
+        frames = self.data[index.ravel()]
+        return frames.reshape(index.shape + frames.shape[1:])
+
+    def create_dataset(self, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3, PeriodInterval=1,
+                       len_horizon=1):
+        """current version
+
+        len_horizon > 1: Y stacks the len_horizon next frames along the channels,
+                         timestamps_Y are those of the first one
+        """
+        index, target = self.create_index(len_closeness=len_closeness, len_trend=len_trend,
+                                          TrendInterval=TrendInterval, len_period=len_period,
+                                          PeriodInterval=PeriodInterval, len_horizon=len_horizon)
+        nb_sample = len(target)
+        split = np.cumsum([len_closeness, 2 * len_period, 2 * len_trend])
+
+        def stack(depend_index):
+            # [nb_sample, len, nb_flow, h, w] --> [nb_sample, len * nb_flow, h, w]
+            X = self.gather(depend_index)
+            return X.reshape((nb_sample, -1) + X.shape[3:])
+
+        XC = stack(index[:, :split[0]]) if len_closeness > 0 else np.asarray([])
+        XP = stack(index[:, split[0]:split[1]]) if len_period > 0 else np.asarray([])
+        XT = stack(index[:, split[1]:split[2]]) if len_trend > 0 else np.asarray([])
+        Y = self.gather(target)
+        if len_horizon > 1:
+            Y = Y.reshape((nb_sample, -1) + Y.shape[3:])
+            target = target[:, 0]
+        timestamps_Y = self.timestamps[target]
 
         print("XC shape: ", XC.shape, "XP shape: ", XP.shape, "XT shape: ", XT.shape, "Y shape:", Y.shape)
         return XC, XP, XT, Y, timestamps_Y
 
+def create_index_all(timestamps_all, T=48, **kwargs):
+    """index plan over the concatenation of several sources (e.g. one per year)
+
+    The dependencies of a sample never cross its source; kwargs as in STMatrix.create_index.
+    return: index, target (positions in the concatenation)
+    """
+    index = []
+    target = []
+    offset = 0
+    for timestamps in timestamps_all:
+        st = STMatrix(None, timestamps, T, CheckComplete=False)
+        _index, _target = st.create_index(**kwargs)
+        index.append(_index + offset)
+        target.append(_target + offset)
+        offset += len(timestamps)
+    return np.vstack(index), np.concatenate(target)
+
+class StreamingSTMatrix(object):
+    """STMatrix fed one frame at a time, for online prediction
+
+    The frames live in a ring buffer covering the longest dependency of a target (the
+    trend lookback): the frame of slot s is kept at s % capacity until overwritten, so
+    that append is O(1) and the C/P/T input of the next slot is a single gather.
+
+    frame_shape: (nb_flow, map_height, map_width)
+    scaler: applied to every appended frame (e.g. the fitted MinMaxNormalization), after the
+            negative flows are set to 0 as in the training frames
+    """
+
+    def __init__(self, frame_shape, T=48, len_closeness=3, len_trend=3, TrendInterval=7, len_period=3,
+                 PeriodInterval=1, scaler=None, dtype=np.float32):
+        super(StreamingSTMatrix, self).__init__()
+        self.T = T
+        self.config = dict(len_closeness=len_closeness, len_trend=len_trend, TrendInterval=TrendInterval,
+                           len_period=len_period, PeriodInterval=PeriodInterval)
+        depends = depend_offsets(T, **self.config)
+        self.offsets = np.asarray(depends[0] + depends[1] + depends[2], dtype=np.int64)
+        if len(self.offsets) == 0:
+            raise ValueError('len_closeness, len_period and len_trend are all 0: no frame to buffer')
+        self.capacity = int(self.offsets.max())
+        self.scaler = scaler
+        self.buffer = np.zeros((self.capacity, ) + tuple(frame_shape), dtype=dtype)
+        # slot number held at every position of the buffer, -1 if none
+        self.slots = np.full(self.capacity, -1, dtype=np.int64)
+        self.last_slot = -1
+
+    def _slot(self, timestamp):
+        """slot number of `timestamp`; ValueError if it is neither a slot number nor a valid
+        `YYYYMMDDSS` string (a date and a slot in 1..T)
+        """
+        if timestamp is None:
+            return self.last_slot + 1
+        if isinstance(timestamp, (int, np.integer)) and not isinstance(timestamp, bool):
+            if timestamp < 0:
+                raise ValueError('negative slot number %i' % timestamp)
+            return int(timestamp)
+        if isinstance(timestamp, bytes):
+            timestamp = timestamp.decode('ascii', 'replace')
+        if not isinstance(timestamp, str) or re.match(r'^\d{9,10}$', timestamp) is None:
+            raise ValueError('timestamp %r: a YYYYMMDDSS string or a slot number expected' % (timestamp, ))
+        try:
+            datetime.strptime(timestamp[:8], '%Y%m%d')
+        except ValueError:
+            raise ValueError('timestamp %s: invalid date' % timestamp)
+        if not 1 <= int(timestamp[8:]) <= self.T:
+            raise ValueError('timestamp %s: slot out of 1..%i' % (timestamp, self.T))
+        return int(string2slot([timestamp], T=self.T)[0])
+
+    def append(self, frame, timestamp=None):
+        """frame of `timestamp` (a slot number or a `YYYYMMDDSS` string, default: the next slot)
+
+        Skipped slots are simply missing; slots must be appended in increasing order.
+        """
+        slot = self._slot(timestamp)
+        if slot <= self.last_slot:
+            raise ValueError('slot %i appended after slot %i' % (slot, self.last_slot))
+        pos = slot % self.capacity
+        # negative flows set to 0, as in the training frames (stack_stdata)
+        frame = np.maximum(frame, 0)
+        if self.scaler is not None:
+            self.scaler.transform(frame[None], out=self.buffer[pos:pos + 1])
+        else:
+            self.buffer[pos] = frame
+        self.slots[pos] = slot
+        self.last_slot = slot
+
+    def extend(self, frames, timestamps):
+        """append the frames of increasing `timestamps`; only the last `capacity` slots are written"""
+        slots = as_timeslots(timestamps, self.T).slots
+        if len(slots) == 0:
+            return
+        if slots[0] <= self.last_slot or (np.diff(slots) <= 0).any():
+            raise ValueError('slots must be increasing and after slot %i' % self.last_slot)
+        keep = np.flatnonzero(slots > slots[-1] - self.capacity)
+        pos = slots[keep] % self.capacity
+        frames = np.maximum(frames[keep[0]:keep[-1] + 1], 0)
+        if self.scaler is not None:
+            frames = self.scaler.transform(frames, dtype=self.buffer.dtype)
+        self.buffer[pos] = frames
+        self.slots[pos] = slots[keep]
+        self.last_slot = int(slots[-1])
+
+    def depend_slots(self, timestamp=None):
+        """slot numbers of the C/P/T dependencies of the target `timestamp` (default: the next slot)"""
+        return self._slot(timestamp) - self.offsets
+
+    def check_it(self, timestamp=None):
+        """whether all the dependencies of the target `timestamp` are available"""
+        depends = self.depend_slots(timestamp)
+        return bool((self.slots[depends % self.capacity] == depends).all())
+
+    def get_X(self, timestamp=None, meta_data=True, external=None):
+        """[XCPT] (+ [meta]) of the single sample predicting `timestamp` (default: the next slot)
+
+        meta: timestamp2vec of the target, followed by the `external` features if any,
+              in the layout of the meta features of load_data
+        """
+        slot = self._slot(timestamp)
+        depends = slot - self.offsets
+        pos = depends % self.capacity
+        missing = self.slots[pos] != depends
+        if missing.any():
+            raise KeyError(slot2string(depends[missing][:1], self.T)[0].decode())
+        XCPT = self.buffer[pos].reshape((1, -1) + self.buffer.shape[2:])
+        X = [XCPT]
+        if meta_data:
+            meta = [timestamp2vec(Timeslots([slot], self.T))]
+            if external is not None:
+                meta.append(np.asarray(external).reshape(1, -1))
+            X.append(np.hstack(meta).astype(self.buffer.dtype))
+        return X
+
+    def save(self, fname):
+        """buffer and state as an .npz file; the scaler is not saved"""
+        np.savez(fname, buffer=self.buffer, slots=self.slots, last_slot=self.last_slot, T=self.T,
+                 **self.config)
+
+    @classmethod
+    def load(cls, fname, scaler=None):
+        f = np.load(fname)
+        config = dict((key, int(f[key])) for key in ['len_closeness', 'len_trend', 'TrendInterval',
+                                                      'len_period', 'PeriodInterval'])
+        st = cls(f['buffer'].shape[1:], T=int(f['T']), scaler=scaler, dtype=f['buffer'].dtype, **config)
+        st.buffer[:] = f['buffer']
+        st.slots[:] = f['slots']
+        st.last_slot = int(f['last_slot'])
+        return st
+
+
 if __name__ == '__main__':
     pass
@@ -0,0 +1,32 @@
+from __future__ import print_function
+import math
+import numpy as np
+from keras.utils import Sequence
+
+
+class STSequence(Sequence):
+    """batches of an STDataset for model.fit_generator / evaluate_generator / predict_generator
+
+    Only the frames of the current batch are materialized.
+    """
+
+    def __init__(self, dataset, batch_size=16, shuffle=False, seed=None):
+        super(STSequence, self).__init__()
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.rng = np.random.RandomState(seed)
+        self.order = np.arange(len(dataset))
+        if self.shuffle:
+            self.rng.shuffle(self.order)
+
+    def __len__(self):
+        return int(math.ceil(len(self.dataset) / float(self.batch_size)))
+
+    def __getitem__(self, i):
+        ids = self.order[i * self.batch_size:(i + 1) * self.batch_size]
+        return self.dataset.batch(ids)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            self.rng.shuffle(self.order)
@@ -6,64 +6,66 @@
 from __future__ import print_function
 
 import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
 #import _pickle as pickle
 import pickle
-from copy import copy
 import numpy as np
 import h5py
 from star import *
 from star.minmax_normalization import MinMaxNormalization
 from star.config import Config
-from .STMatrix import STMatrix
+from . import cache
+from .STMatrix import create_index_all
+from .STDataset import STDataset
 np.random.seed(1337)  # for reproducibility
 
 # parameters
 DATAPATH = Config().DATAPATH
 
 
-def load_holiday(timeslots, fname=os.path.join(DATAPATH, 'TaxiBJ', 'BJ_Holiday.txt')):
+def load_holiday(timeslots, fname=os.path.join(DATAPATH, 'TaxiBJ', 'BJ_Holiday.txt'), T=48):
+    timeslots = as_timeslots(timeslots, T)
     f = open(fname, 'r')
-    holidays = f.readlines()
-    holidays = set([h.strip() for h in holidays])
-    H = np.zeros(len(timeslots))
-    for i, slot in enumerate(timeslots):
-        if slot[:8] in holidays:
-            H[i] = 1
+    holidays = [h.strip() for h in f.readlines()]
+    f.close()
+    # holidays as days since 1970-01-01, compared with the day of every slot
+    holidays, _ = parse_timeslots([h for h in holidays if h])
+    H = np.isin(timeslots.days, holidays).astype(np.float64)
     print(H.sum())
     # print(timeslots[H==1])
     return H[:, None]
 
 
-def load_meteorol(timeslots, fname=os.path.join(DATAPATH, 'TaxiBJ', 'BJ_Meteorology.h5')):
+def load_meteorol(timeslots, fname=os.path.join(DATAPATH, 'TaxiBJ', 'BJ_Meteorology.h5'), T=48):
     '''
     timeslots: the predicted timeslots
     In real-world, we dont have the meteorol data in the predicted timeslot, instead,
     we use the meteoral at previous timeslots, i.e., slot = predicted_slot - timeslot (you can use predicted meteorol data as well)
     '''
+    timeslots = as_timeslots(timeslots, T)
     f = h5py.File(fname, 'r')
-    Timeslot = f['date'].value
-    WindSpeed = f['WindSpeed'].value
-    Weather = f['Weather'].value
-    Temperature = f['Temperature'].value
+    Timeslot = string2slot(f['date'][()], T)
     f.close()
 
-    M = dict()  # map timeslot to index
-    for i, slot in enumerate(Timeslot):
-        M[slot] = i
-
-    WS = []  # WindSpeed
-    WR = []  # Weather
-    TE = []  # Temperature
-    for slot in timeslots:
-        predicted_id = M[slot]
-        cur_id = predicted_id - 1
-        WS.append(WindSpeed[cur_id])
-        WR.append(Weather[cur_id])
-        TE.append(Temperature[cur_id])
-
-    WS = np.asarray(WS)
-    WR = np.asarray(WR)
-    TE = np.asarray(TE)
+    # map timeslot to index: the last row of every slot, as a dict built in file order
+    order = np.argsort(Timeslot, kind='stable')
+    keys = Timeslot[order]
+    pos = np.searchsorted(keys, timeslots.slots, side='right') - 1
+    found = (pos >= 0) & (keys[np.maximum(pos, 0)] == timeslots.slots)
+    if not found.all():
+        raise KeyError(slot2string(timeslots.slots[~found][:1], T)[0])
+    predicted_id = order[pos]
+    cur_id = predicted_id - 1
+
+    # only the needed rows are read
+    attributes = []
+    for key in ['WindSpeed', 'Weather', 'Temperature']:
+        h5 = H5Array(fname, key)
+        attributes.append(h5[cur_id])
+        h5.close()
+    WS, WR, TE = attributes  # WindSpeed, Weather, Temperature
 
     # 0-1 scale
     WS = 1. * (WS - WS.min()) / (WS.max() - WS.min())
@@ -78,88 +80,85 @@ def load_meteorol(timeslots, fname=os.path.join(DATAPATH, 'TaxiBJ', 'BJ_Meteorol
     return merge_data
 
 
-def load_data(T=48, nb_flow=2, len_closeness=None, len_period=None, len_trend=None,
-              len_test=None, len_val=None, preprocess_name='preprocessing_bj.pkl',
-              meta_data=True, meteorol_data=True, holiday_data=True):
+def _load_year(fname, T=48, nb_flow=2, path=None, dtype=np.float64):
+    """read/clean stage of one year file
+
+    path: write the kept flows to this .npy file instead of returning them lazily,
+          so that a worker process hands them over through the file system
+    dtype: dtype of the .npy file, None for the smallest integer type holding the counts
+    return: flows (H5Array, to be closed by the caller, or the .npy path), timestamps and max flow of the year
     """
+    print("file name: ", fname)
+    _, mmax = stat(fname)
+    raw, timestamps = load_stdata(fname, lazy=True)
+    # print(timestamps)
+    # remove a certain day which does not have 48 timestamps
+    data, timestamps = remove_incomplete_days(raw, timestamps, T)
+    if data is not raw:
+        # the kept rows are a new view, with its own handle
+        raw.close()
+    print("\n")
+    if path is None:
+        return data, timestamps, mmax
+    with data:
+        frames = np.lib.format.open_memmap(path, mode='w+', dtype=dtype or count_dtype(mmax),
+                                           shape=(len(data), nb_flow) + data.shape[2:])
+        stack_stdata([data], nb_flow=nb_flow, out=frames)
+    frames.flush()
+    return path, timestamps, mmax
+
+
+def load_frames(fnames, T=48, nb_flow=2, len_test=None, workers=1, dtype=np.float32, counts=False):
+    """normalized base frames of all years, in dtype
+
+    counts: keep the raw counts in the smallest unsigned integer type that fits instead,
+            mmn being only fitted
+    return: frames, timestamps of every year, mmn
     """
-    assert(len_closeness + len_period + len_trend > 0)
-    # load data
-    # 13 - 16
-    data_all = []
-    timestamps_all = list()
-    for year in range(13, 17):
-        fname = os.path.join(
-            DATAPATH, 'TaxiBJ', 'BJ{}_M32x32_T30_InOut.h5'.format(year))
-        print("file name: ", fname)
-        stat(fname)
-        data, timestamps = load_stdata(fname)
-        # print(timestamps)
-        # remove a certain day which does not have 48 timestamps
-        data, timestamps = remove_incomplete_days(data, timestamps, T)
-        data = data[:, :nb_flow]
-        data[data < 0] = 0.
-        data_all.append(data)
-        timestamps_all.append(timestamps)
-        print("\n")
-
-    # minmax_scale
-    data_train = np.vstack(copy(data_all))[:-len_test]
-    print('train_data shape: ', data_train.shape)
+    tmpdir = None
+    if workers > 1:
+        tmpdir = tempfile.mkdtemp(prefix='TaxiBJ_')
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_load_year, fname, T=T, nb_flow=nb_flow,
+                                   path=os.path.join(tmpdir, '%i.npy' % i),
+                                   dtype=None if counts else dtype)
+                       for i, fname in enumerate(fnames)]
+            results = [future.result() for future in futures]
+        data_all = [np.load(path, mmap_mode='r') for path, _, _ in results]
+    else:
+        results = [_load_year(fname, T=T, nb_flow=nb_flow) for fname in fnames]
+        data_all = [data for data, _, _ in results]
+    timestamps_all = [timestamps for _, timestamps, _ in results]
+    if counts:
+        dtype = count_dtype(max(mmax for _, _, mmax in results))
+
+    # base frames of all years, read once: kept days and flows, negative flows set to 0
+    frames = stack_stdata(data_all, nb_flow=nb_flow, dtype=dtype)
+    for data in data_all:
+        if isinstance(data, H5Array):
+            data.close()
+    del data_all
+    if tmpdir is not None:
+        shutil.rmtree(tmpdir)
+
+    # minmax_scale, fitted year by year on the training part
+    nb_train = len(frames) - len_test
+    print('train_data shape: ', frames[:nb_train].shape)
     mmn = MinMaxNormalization()
-    mmn.fit(data_train)
-    data_all_mmn = [mmn.transform(d) for d in data_all]
-
-    fpkl = open(preprocess_name, 'wb')
-    for obj in [mmn]:
-        pickle.dump(obj, fpkl)
-    fpkl.close()
-    XCPT = []
-    Y = []
-    timestamps_Y = []
-    for data, timestamps in zip(data_all_mmn, timestamps_all):
-        # instance-based dataset --> sequences with format as (X, Y) where X is
-        # a sequence of images and Y is an image.
-        st = STMatrix(data, timestamps, T, CheckComplete=False)
-        _XC, _XP, _XT, _Y, _timestamps_Y = st.create_dataset(
-            len_closeness=len_closeness, len_period=len_period, len_trend=len_trend)
-
-        _XCPT = np.concatenate((_XC, _XP),axis=1)
-        _XCPT = np.concatenate((_XCPT, _XT),axis=1)
-
-        XCPT.append(_XCPT)
-
-        Y.append(_Y)
-        # _Y=[]
-        timestamps_Y += _timestamps_Y
-
-    
-    XCPT = np.vstack(XCPT)
-
-    Y = np.vstack(Y)
-
-
-    print("XCPT shape: ", XCPT.shape, "Y shape:", Y.shape)
-
-    XCPT_train_all, Y_train_all = XCPT[:-len_test], Y[:-len_test]
-    XCPT_train, Y_train = XCPT[:-len_val], Y[:-len_val]
-    XCPT_val, Y_val = XCPT[-len_val:-len_test], Y[-len_val:-len_test]
-    XCPT_test, Y_test = XCPT[-len_test:], Y[-len_test:]
-
-    timestamp_train_all, timestamp_train, timestamp_val, timestamp_test = timestamps_Y[:-len_test], timestamps_Y[:-len_val], timestamps_Y[-len_val:-len_test], timestamps_Y[-len_test:]
-
-    X_train_all, X_train, X_val, X_test = [], [], [], []
-
-    X_train_all.append(XCPT_train_all)
-    X_train.append(XCPT_train)
-    X_val.append(XCPT_val)
-    X_test.append(XCPT_test)
-
-    print('train shape:', XCPT_train_all.shape, Y_train_all.shape,
-          'train shape:', XCPT_train.shape, Y_train.shape,
-          'test shape: ', XCPT_val.shape, Y_val.shape,
-          'test shape: ', XCPT_test.shape, Y_test.shape)
-
+    offset = 0
+    for timestamps in timestamps_all:
+        stop = min(offset + len(timestamps), nb_train)
+        if stop > offset:
+            mmn.partial_fit(frames[offset:stop])
+        offset += len(timestamps)
+    print("min:", mmn._min, "max:", mmn._max)
+    if not counts:
+        mmn.transform(frames, out=frames)
+    return frames, timestamps_all, mmn
+
+
+def load_meta(timestamps_Y, meta_data=True, meteorol_data=True, holiday_data=True, dtype=np.float32):
+    """external features of the predicted timeslots in dtype, or None"""
     meta_feature = []
     if meta_data:
         # load time feature
@@ -167,11 +166,11 @@ def load_data(T=48, nb_flow=2, len_closeness=None, len_period=None, len_trend=No
         meta_feature.append(time_feature)
     if holiday_data:
         # load holiday
-        holiday_feature = load_holiday(timestamps_Y)
+        holiday_feature = load_holiday(timestamps_Y, T=timestamps_Y.T)
         meta_feature.append(holiday_feature)
     if meteorol_data:
         # load meteorol data
-        meteorol_feature = load_meteorol(timestamps_Y)
+        meteorol_feature = load_meteorol(timestamps_Y, T=timestamps_Y.T)
         meta_feature.append(meteorol_feature)
 
     meta_feature = np.hstack(meta_feature) if len(
@@ -183,15 +182,123 @@ def load_data(T=48, nb_flow=2, len_closeness=None, len_period=None, len_trend=No
     if meta_data and holiday_data and meteorol_data:
         print('time feature:', time_feature.shape, 'holiday feature:', holiday_feature.shape,
               'meteorol feature: ', meteorol_feature.shape, 'mete feature: ', meta_feature.shape)
+    return meta_feature.astype(dtype) if metadata_dim is not None else None
+
+
+def load_dataset(T=48, nb_flow=2, len_closeness=None, len_period=None, len_trend=None,
+                 len_test=None, len_val=None, preprocess_name='preprocessing_bj.pkl',
+                 meta_data=True, meteorol_data=True, holiday_data=True, workers=1, cache_dir=None,
+                 dtype='float32', cache_dtype=None, counts=False, len_horizon=1,
+                 data_format='channels_first'):
+    """
+    same samples as load_data, kept as STDataset views over the normalized base frames
+    instead of materialized XCPT arrays
+
+    workers: number of processes running the per-year read/clean stages (stat, read, removal of
+             the incomplete days); the frames are stacked and the C/P/T index plan built in this process
+    cache_dir: keep the base frames and the index plan in this directory (see star.cache);
+               the frames are shared by every C/P/T and meta config
+    dtype: dtype of the frames and meta features, converted once at load time
+           (float32 as Keras trains in; float64 for the original pipeline)
+    cache_dtype: dtype of the cached frames, e.g. float16 to halve the cache size (default: dtype)
+    counts: keep the frames as raw counts in the smallest unsigned integer type that fits
+            (uint16 for TaxiBJ), normalized to dtype when a batch is gathered
+    len_horizon: number of future frames of every target (Y of len_horizon * nb_flow channels)
+    data_format: layout of the XCPT and Y batches, 'channels_last' for NHWC models
+
+    return: dataset_train_all, dataset_train, dataset_val, dataset_test, mmn, metadata_dim
+    """
+    assert(len_closeness + len_period + len_trend > 0)
+    # load data
+    # 13 - 16
+    fnames = [os.path.join(DATAPATH, 'TaxiBJ', 'BJ{}_M32x32_T30_InOut.h5'.format(year))
+              for year in range(13, 17)]
+    dtype = np.dtype(dtype)
+    # the raw counts are stored as they are
+    cache_dtype = None if counts else np.dtype(cache_dtype or dtype)
+    if cache_dir is not None:
+        config = dict(dataset='TaxiBJ', T=T, nb_flow=nb_flow, len_test=len_test, scaler='MinMaxNormalization',
+                      dtype=dtype.name, cache_dtype=getattr(cache_dtype, 'name', None), counts=counts)
+        frames_dir = cache.frames_path(cache_dir, 'TaxiBJ', cache.cache_key(config, fnames))
+        meta_fnames = []
+        if holiday_data:
+            meta_fnames.append(os.path.join(DATAPATH, 'TaxiBJ', 'BJ_Holiday.txt'))
+        if meteorol_data:
+            meta_fnames.append(os.path.join(DATAPATH, 'TaxiBJ', 'BJ_Meteorology.h5'))
+        config.update(len_closeness=len_closeness, len_period=len_period, len_trend=len_trend,
+                      len_horizon=len_horizon, meta_data=meta_data, meteorol_data=meteorol_data, holiday_data=holiday_data)
+        plan_dir = cache.plan_path(frames_dir, cache.cache_key(config, fnames + meta_fnames))
+
+    if cache_dir is not None and cache.exists(frames_dir):
+        print("load frames from", frames_dir)
+        frames, timestamps_all, mmn = cache.load_frames(
+            frames_dir, dtype=dtype if cache_dtype is not None else None)
+    else:
+        frames, timestamps_all, mmn = load_frames(
+            fnames, T=T, nb_flow=nb_flow, len_test=len_test, workers=workers, dtype=dtype, counts=counts)
+        if cache_dir is not None:
+            cache.save_frames(frames_dir, frames, timestamps_all, mmn, dtype=cache_dtype)
+    # written on a cache hit too, from the scaler stored with the frames
+    # (star.server and star.quantize read it)
+    fpkl = open(preprocess_name, 'wb')
+    for obj in [mmn]:
+        pickle.dump(obj, fpkl)
+    fpkl.close()
+
+    if cache_dir is not None and cache.exists(plan_dir):
+        print("load index plan from", plan_dir)
+        index, target, meta_feature, timestamps_Y = cache.load_plan(plan_dir)
+    else:
+        # instance-based dataset --> index plan of (X, Y) where X is
+        # a sequence of images and Y is an image.
+        # the samples only keep positions in the base frames
+        index, target = create_index_all(timestamps_all, T, len_closeness=len_closeness,
+                                         len_period=len_period, len_trend=len_trend, len_horizon=len_horizon)
+        # meta features of the first predicted frame
+        timestamps_Y = Timeslots.concatenate(timestamps_all)[target if target.ndim == 1 else target[:, 0]]
+        meta_feature = load_meta(timestamps_Y, meta_data=meta_data,
+                                 meteorol_data=meteorol_data, holiday_data=holiday_data, dtype=dtype)
+        if cache_dir is not None:
+            cache.save_plan(plan_dir, index, target, meta_feature, timestamps_Y)
+
+    dataset = STDataset(frames, index, target, meta_feature, timestamps_Y,
+                        mmn if counts else None, dtype, data_format)
+    metadata_dim = dataset.metadata_dim
+    print("frames shape: ", frames.shape, "XCPT shape: ", dataset.shape)
+
+    return dataset.split(len_test, len_val) + (mmn, metadata_dim)
+
+
+def load_data(T=48, nb_flow=2, len_closeness=None, len_period=None, len_trend=None,
+              len_test=None, len_val=None, preprocess_name='preprocessing_bj.pkl',
+              meta_data=True, meteorol_data=True, holiday_data=True, workers=1, cache_dir=None,
+              dtype='float32', cache_dtype=None, counts=False, len_horizon=1,
+              data_format='channels_first'):
+    """
+    """
+    dataset_train_all, dataset_train, dataset_val, dataset_test, mmn, metadata_dim = load_dataset(
+        T=T, nb_flow=nb_flow, len_closeness=len_closeness, len_period=len_period, len_trend=len_trend,
+        len_test=len_test, len_val=len_val, preprocess_name=preprocess_name,
+        meta_data=meta_data, meteorol_data=meteorol_data, holiday_data=holiday_data, workers=workers,
+        cache_dir=cache_dir, dtype=dtype, cache_dtype=cache_dtype, counts=counts,
+        len_horizon=len_horizon, data_format=data_format)
+
+    # train_all is materialized once, train and val being views of it (as the splits of the
+    # original XCPT array)
+    X_train_all, Y_train_all = dataset_train_all.materialize()
+    nb_train = len(dataset_train)
+    X_train, Y_train = [X[:nb_train] for X in X_train_all], Y_train_all[:nb_train]
+    X_val, Y_val = [X[nb_train:] for X in X_train_all], Y_train_all[nb_train:]
+    X_test, Y_test = dataset_test.materialize()
+
+    timestamp_train_all, timestamp_train, timestamp_val, timestamp_test = dataset_train_all.timestamps, \
+        dataset_train.timestamps, dataset_val.timestamps, dataset_test.timestamps
+
+    print('train shape:', X_train_all[0].shape, Y_train_all.shape,
+          'train shape:', X_train[0].shape, Y_train.shape,
+          'test shape: ', X_val[0].shape, Y_val.shape,
+          'test shape: ', X_test[0].shape, Y_test.shape)
 
-    if metadata_dim is not None:
-        meta_feature_train_all, meta_feature_train, meta_feature_val, meta_feature_test = meta_feature[
-            :-len_test], meta_feature[:-len_val], meta_feature[-len_val:-len_test], meta_feature[-len_test:]
-        
-        X_train_all.append(meta_feature_train_all)  
-        X_train.append(meta_feature_train)
-        X_val.append(meta_feature_val)
-        X_test.append(meta_feature_test)
     for _X in X_train_all:
         print(_X.shape, )
     print()    
@@ -6,286 +6,446 @@ import numpy as np
 from copy import copy
 from datetime import datetime, timedelta
 
-def load_stdata(fname):
-    f = h5py.File(fname, 'r')
-    data = f['data'].value
-    timestamps = f['date'].value
-    f.close()
+class H5Array(object):
+    """slice-on-demand rows of an HDF5 dataset
+
+    The file is opened on first access and only the requested rows are read.
+    rows: positions in the dataset of the rows of this view (all rows if None)
+    """
+
+    def __init__(self, fname, key='data', rows=None, chunk_size=None):
+        super(H5Array, self).__init__()
+        self.fname = fname
+        self.key = key
+        self.rows = None if rows is None else np.asarray(rows, dtype=np.int64)
+        self._file = None
+        dataset = self.dataset
+        self.dtype = dataset.dtype
+        self._shape = dataset.shape
+        if chunk_size is None:
+            # ~64MB per chunk, aligned on the HDF5 chunks
+            row_bytes = max(int(np.prod(self._shape[1:])) * self.dtype.itemsize, 1)
+            chunk_size = max(2 ** 26 // row_bytes, 1)
+            if dataset.chunks is not None:
+                chunk_size = max(chunk_size // dataset.chunks[0], 1) * dataset.chunks[0]
+        self.chunk_size = chunk_size
+
+    @property
+    def dataset(self):
+        if self._file is None:
+            self._file = h5py.File(self.fname, 'r')
+        return self._file[self.key]
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_file'] = None
+        return state
+
+    @property
+    def shape(self):
+        return (len(self), ) + self._shape[1:]
+
+    @property
+    def ndim(self):
+        return len(self._shape)
+
+    def __len__(self):
+        return self._shape[0] if self.rows is None else len(self.rows)
+
+    def select(self, rows):
+        """lazy view of the rows `rows` of this view"""
+        rows = np.arange(len(self))[rows]
+        return H5Array(self.fname, self.key, rows if self.rows is None else self.rows[rows], self.chunk_size)
+
+    def _read(self, positions, max_gap=64):
+        """rows at the dataset positions `positions`, reading each span of close rows at once"""
+        positions = np.asarray(positions, dtype=np.int64)
+        if len(positions) == 0:
+            return np.empty((0, ) + self._shape[1:], dtype=self.dtype)
+        unique, inverse = np.unique(positions, return_inverse=True)
+        out = np.empty((len(unique), ) + self._shape[1:], dtype=self.dtype)
+        breaks = np.flatnonzero(np.diff(unique) > max_gap) + 1
+        dataset = self.dataset
+        for lo, hi in zip(np.concatenate([[0], breaks]), np.concatenate([breaks, [len(unique)]])):
+            first, last = unique[lo], unique[hi - 1]
+            block = dataset[first:last + 1]
+            out[lo:hi] = block[unique[lo:hi] - first]
+        return out[inverse.ravel()]
+
+    def __getitem__(self, key):
+        key = key if isinstance(key, tuple) else (key, )
+        rows, rest = key[0], key[1:]
+        if isinstance(rows, slice) and self.rows is None:
+            return self.dataset[key]
+        elif isinstance(rows, (int, np.integer)):
+            data = self._read(self._positions([rows]))[0]
+            return data[rest] if rest else data
+        else:
+            data = self._read(self._positions(rows))
+        return data[(slice(None), ) + rest] if rest else data
+
+    def _positions(self, rows):
+        rows = np.arange(len(self))[rows]
+        return rows if self.rows is None else self.rows[rows]
+
+    def iter_chunks(self, chunk_size=None):
+        """yields (start, stop, rows[start:stop]) over the whole view"""
+        chunk_size = chunk_size or self.chunk_size
+        for start in range(0, len(self), chunk_size):
+            stop = min(start + chunk_size, len(self))
+            yield start, stop, self[start:stop]
+
+    def __array__(self, dtype=None, copy=None):
+        data = self[:]
+        return data if dtype is None else data.astype(dtype)
+
+
+def load_stdata(fname, lazy=False):
+    """data and timestamps of a flow file; data is an H5Array if lazy"""
+    if lazy:
+        f = h5py.File(fname, 'r')
+        timestamps = f['date'][()]
+        f.close()
+        return H5Array(fname, 'data'), timestamps
+    with h5py.File(fname, 'r') as f:
+        # [()]: .value was removed in h5py 3
+        data = f['data'][()]
+        timestamps = f['date'][()]
     return data, timestamps
 
 
-def stat(fname):
-    def get_nb_timeslot(f):
-        s = f['date'][0]
-        e = f['date'][-1]
-        year, month, day = map(int, [s[:4], s[4:6], s[6:8]])
-        ts = time.strptime("%04i-%02i-%02i" % (year, month, day), "%Y-%m-%d")
-        year, month, day = map(int, [e[:4], e[4:6], e[6:8]])
-        te = time.strptime("%04i-%02i-%02i" % (year, month, day), "%Y-%m-%d")
-        nb_timeslot = (time.mktime(te) - time.mktime(ts)) / (0.5 * 3600) + 48
-        ts_str, te_str = time.strftime("%Y-%m-%d", ts), time.strftime("%Y-%m-%d", te)
-        return nb_timeslot, ts_str, te_str
-
-    with h5py.File(fname) as f:
-        nb_timeslot, ts_str, te_str = get_nb_timeslot(f)
-        nb_day = int(nb_timeslot / 48)
-        mmax = f['data'].value.max()
-        mmin = f['data'].value.min()
-        stat = '=' * 5 + 'stat' + '=' * 5 + '\n' + \
-               'data shape: %s\n' % str(f['data'].shape) + \
-               '# of days: %i, from %s to %s\n' % (nb_day, ts_str, te_str) + \
-               '# of timeslots: %i\n' % int(nb_timeslot) + \
-               '# of timeslots (available): %i\n' % f['date'].shape[0] + \
-               'missing ratio of timeslots: %.1f%%\n' % ((1. - float(f['date'].shape[0] / nb_timeslot)) * 100) + \
-               'max: %.3f, min: %.3f\n' % (mmax, mmin) + \
-               '=' * 5 + 'stat' + '=' * 5
-        print(stat)
-
-def string2timestamp(strings, T=48):
-    timestamps = []
+def stat(fname, chunk_size=None):
+    """print the stats of a flow file; return: min and max of the flows"""
+    # single pass over the flows, chunk by chunk
+    data = H5Array(fname, 'data', chunk_size=chunk_size)
+    mmax, mmin = -np.inf, np.inf
+    for _, _, chunk in data.iter_chunks():
+        mmax, mmin = max(mmax, chunk.max()), min(mmin, chunk.min())
+    data.close()
+
+    with h5py.File(fname, 'r') as f:
+        nb_available = f['date'].shape[0]
+        days, _ = parse_timeslots([f['date'][0], f['date'][-1]])
+    nb_timeslot = float((days[1] - days[0]) * 48 + 48)
+    ts_str, te_str = [str(d) for d in days.astype('datetime64[D]')]
+    nb_day = int(nb_timeslot / 48)
+    stat = '=' * 5 + 'stat' + '=' * 5 + '\n' + \
+           'data shape: %s\n' % str(data.shape) + \
+           '# of days: %i, from %s to %s\n' % (nb_day, ts_str, te_str) + \
+           '# of timeslots: %i\n' % int(nb_timeslot) + \
+           '# of timeslots (available): %i\n' % nb_available + \
+           'missing ratio of timeslots: %.1f%%\n' % ((1. - float(nb_available / nb_timeslot)) * 100) + \
+           'max: %.3f, min: %.3f\n' % (mmax, mmin) + \
+           '=' * 5 + 'stat' + '=' * 5
+    print(stat)
+    return mmin, mmax
+
+def parse_timeslots(strings):
+    """parse `YYYYMMDDSS` slot strings in bulk
+
+    return: days since 1970-01-01 and the 0-based slot of the day, two int64 arrays
+    """
+    strings = np.asarray(strings)
+    if strings.dtype.kind == 'U':
+        strings = strings.astype('S')
+    if len(strings) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    chars = strings.view(np.uint8).reshape(len(strings), strings.dtype.itemsize)
+    digits = chars.astype(np.int64) - ord('0')
+
+    year = digits[:, 0] * 1000 + digits[:, 1] * 100 + digits[:, 2] * 10 + digits[:, 3]
+    month = digits[:, 4] * 10 + digits[:, 5]
+    day = digits[:, 6] * 10 + digits[:, 7]
+    # the slot part may be shorter than the widest string (padded with b'\x00')
+    slot = np.zeros(len(strings), dtype=np.int64)
+    for i in range(8, chars.shape[1]):
+        valid = chars[:, i] != 0
+        slot[valid] = slot[valid] * 10 + digits[valid, i]
+
+    date = ((year - 1970).astype('datetime64[Y]').astype('datetime64[M]') + (month - 1)).astype('datetime64[D]') + (day - 1)
+    return date.astype(np.int64), slot - 1
+
+
+def string2datetime64(strings, T=48):
+    days, slot = parse_timeslots(strings)
+    return days.astype('datetime64[D]') + (slot * (24 * 60 // T)).astype('timedelta64[m]')
+
+
+def string2slot(strings, T=48):
+    """number of slots since 1970-01-01 00:00 of every `YYYYMMDDSS` string"""
+    days, slot = parse_timeslots(strings)
+    return days * T + slot
 
-    time_per_slot = 24.0 / T
-    num_per_T = T // 24
-    for t in strings:
-        year, month, day, slot = int(t[:4]), int(t[4:6]), int(t[6:8]), int(t[8:])-1
-        timestamps.append(pd.Timestamp(datetime(year, month, day, hour=int(slot * time_per_slot), minute=(slot % num_per_T) * int(60.0 * time_per_slot))))
-
-    return timestamps
 
 def string2timestamp(strings, T=48):
-    timestamps = []
-
-    time_per_slot = 24.0 / T
-    num_per_T = T // 24
-    for t in strings:
-        year, month, day, slot = int(t[:4]), int(t[4:6]), int(t[6:8]), int(t[8:])-1
-        timestamps.append(pd.Timestamp(datetime(year, month, day, hour=int(slot * time_per_slot), minute=(slot % num_per_T) * int(60.0 * time_per_slot))))
+    if isinstance(strings, Timeslots):
+        return strings.to_timestamps()
+    return pd.DatetimeIndex(string2datetime64(strings, T=T)).tolist()
+
+
+def slot2string(slots, T=48):
+    """`YYYYMMDDSS` byte strings of slot numbers since 1970-01-01 00:00"""
+    slots = np.asarray(slots, dtype=np.int64)
+    date = (slots // T).astype('datetime64[D]')
+    year = date.astype('datetime64[Y]')
+    month = date.astype('datetime64[M]')
+    fields = [(year.astype(np.int64) + 1970, 4),
+              ((month - year.astype('datetime64[M]')).astype(np.int64) + 1, 2),
+              ((date - month.astype('datetime64[D]')).astype(np.int64) + 1, 2),
+              (slots % T + 1, 2)]
+    chars = np.empty((len(slots), 10), dtype=np.uint8)
+    pos = 10
+    for value, width in reversed(fields):
+        for _ in range(width):
+            pos -= 1
+            chars[:, pos] = value % 10 + ord('0')
+            value = value // 10
+    return chars.view('S10').ravel()
+
+
+class Timeslots(object):
+    """compact timestamps: int64 slot numbers since 1970-01-01 00:00 with T slots per day
+
+    Slicing/fancy indexing returns Timeslots, an integer index returns the slot number.
+    """
+
+    def __init__(self, slots, T=48):
+        super(Timeslots, self).__init__()
+        self.slots = np.asarray(slots, dtype=np.int64)
+        self.T = T
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __getitem__(self, key):
+        slots = self.slots[key]
+        if np.ndim(slots) == 0:
+            return int(slots)
+        return Timeslots(slots, self.T)
+
+    def __iter__(self):
+        return iter(self.slots)
+
+    def __array__(self, dtype=None, copy=None):
+        return self.slots if dtype is None else self.slots.astype(dtype)
+
+    def __repr__(self):
+        return 'Timeslots(%s, T=%i)' % (self.to_strings(), self.T)
+
+    @property
+    def days(self):
+        """days since 1970-01-01"""
+        return self.slots // self.T
+
+    @property
+    def slot_of_day(self):
+        """0-based slot of the day"""
+        return self.slots % self.T
+
+    def to_strings(self):
+        return slot2string(self.slots, T=self.T)
+
+    def to_datetime64(self):
+        return self.slots * (24 * 60 // self.T) * np.timedelta64(1, 'm') + np.datetime64(0, 'm')
+
+    def to_timestamps(self):
+        return pd.DatetimeIndex(self.to_datetime64()).tolist()
+
+    @staticmethod
+    def concatenate(seq, T=None):
+        seq = list(seq)
+        T = T if T is not None else seq[0].T
+        assert all(ts.T == T for ts in seq)
+        return Timeslots(np.concatenate([ts.slots for ts in seq]), T)
+
+
+def as_timeslots(timestamps, T=48):
+    """Timeslots of `YYYYMMDDSS` strings or pd.Timestamp (no-op for Timeslots)"""
+    if isinstance(timestamps, Timeslots):
+        assert timestamps.T == T, 'Timeslots with T=%i, expected T=%i' % (timestamps.T, T)
+        return timestamps
+    if len(timestamps) > 0 and isinstance(timestamps[0], pd.Timestamp):
+        minutes = pd.DatetimeIndex(timestamps).values.astype('datetime64[m]').astype(np.int64)
+        return Timeslots(minutes // (24 * 60 // T), T)
+    return Timeslots(string2slot(timestamps, T=T), T)
 
-    return timestamps
 
 def timestamp2vec(timestamps):
     # tm_wday range [0, 6], Monday is 0
-    # vec = [time.strptime(str(t[:8], encoding='utf-8'), '%Y%m%d').tm_wday for t in timestamps]  # python3
-    vec = [time.strptime(t[:8].decode('ascii'), '%Y%m%d').tm_wday for t in timestamps]  # python2
-    ret = []
-    for i in vec:
-        v = [0 for _ in range(7)]
-        v[i] = 1
-        if i >= 5:
-            v.append(0)  # weekend
-        else:
-            v.append(1)  # weekday
-        ret.append(v)
-    return np.asarray(ret)
+    if isinstance(timestamps, Timeslots):
+        days = timestamps.days
+    else:
+        days, _ = parse_timeslots(timestamps)
+    vec = (days + 3) % 7  # 1970-01-01 is a Thursday
+    ret = np.zeros((len(vec), 8), dtype=int)
+    ret[np.arange(len(vec)), vec] = 1
+    ret[:, 7] = vec < 5  # weekday: 1, weekend: 0
+    return ret
 
 def remove_incomplete_days(data, timestamps, T=48):
     # remove a certain day which has not 48 timestamps
-    days = []  # available days: some day only contain some seqs
-    days_incomplete = []
-    i = 0
-    while i < len(timestamps):
-        if int(timestamps[i][8:]) != 1:
-            i += 1
-        elif i+T-1 < len(timestamps) and int(timestamps[i+T-1][8:]) == T:
-            days.append(timestamps[i][:8])
-            i += T
-        else:
-            days_incomplete.append(timestamps[i][:8])
-            i += 1
-    print("incomplete days: ", days_incomplete)
-    days = set(days)
-    idx = []
-    for i, t in enumerate(timestamps):
-        if t[:8] in days:
-            idx.append(i)
-
-    data = data[idx]
-    timestamps = [timestamps[i] for i in idx]
-    return data, timestamps
-
-
-def split_by_time(data, timestamps, split_timestamp):
+    timestamps = as_timeslots(timestamps, T=T)
+    # number of distinct timeslots of every day
+    slots = np.unique(timestamps.slots)
+    days, counts = np.unique(slots // T, return_counts=True)
+    complete = counts == T
+    # as before, only the incomplete days that start with their first timeslot are reported
+    has_first_slot = np.isin(days, slots[slots % T == 0] // T)
+    days_incomplete = days[~complete & has_first_slot]
+    print("incomplete days: ", [t[:8] for t in slot2string(days_incomplete * T, T=T)])
+
+    keep = np.isin(timestamps.days, days[complete])
+    if keep.all():
+        return data, timestamps
+    idx = np.flatnonzero(keep)
+    if isinstance(data, H5Array):
+        return data.select(idx), timestamps[idx]
+    return data[idx], timestamps[idx]
+
+
+def count_dtype(mmax):
+    """smallest unsigned integer type holding the counts 0..mmax"""
+    return np.min_scalar_type(max(int(np.ceil(mmax)), 0))
+
+
+def stack_stdata(sources, nb_flow=None, dtype=np.float64, out=None):
+    """flows of `sources` (arrays or H5Array, read chunk by chunk) stacked into one
+    preallocated array (or `out`), with the negative flows set to 0
+    """
+    shape = sources[0].shape[1:]
+    if nb_flow is not None:
+        shape = (nb_flow, ) + shape[1:]
+    frames = np.empty((sum(len(data) for data in sources), ) + shape, dtype=dtype) if out is None else out
+    offset = 0
+    for data in sources:
+        chunks = data.iter_chunks() if isinstance(data, H5Array) else [(0, len(data), data)]
+        for start, stop, chunk in chunks:
+            np.maximum(chunk[:, :shape[0]], 0, out=frames[offset + start:offset + stop], casting='unsafe')
+        offset += len(data)
+    return frames
+
+
+def split_by_time(data, timestamps, split_timestamp, T=48):
     # divide data into two subsets:
     # e.g., Train: ~ 2015.06.21 & Test: 2015.06.22 ~ 2015.06.28
+    # both subsets are views of data and timestamps
+    timestamps = as_timeslots(timestamps, T=T)
+    if not isinstance(split_timestamp, (int, np.integer)):
+        split_timestamp = string2slot([split_timestamp], T=T)[0]
     assert(len(data) == len(timestamps))
-    assert(split_timestamp in set(timestamps))
-
-    data_1 = []
-    timestamps_1 = []
-    data_2 = []
-    timestamps_2 = []
-    switch = False
-    for t, d in zip(timestamps, data):
-        if split_timestamp == t:
-            switch = True
-        if switch is False:
-            data_1.append(d)
-            timestamps_1.append(t)
-        else:
-            data_2.append(d)
-            timestamps_2.append(t)
-    return (np.asarray(data_1), timestamps_1), (np.asarray(data_2), timestamps_2)
-
-
-def timeseries2seqs(data, timestamps, length=3, T=48):
-    raw_ts = copy(timestamps)
-    if type(timestamps[0]) != pd.Timestamp:
-        timestamps = string2timestamp(timestamps, T=T)
-
-    offset = pd.DateOffset(minutes=24 * 60 // T)
-
-    breakpoints = [0]
-    for i in range(1, len(timestamps)):
-        if timestamps[i-1] + offset != timestamps[i]:
-            print(timestamps[i-1], timestamps[i], raw_ts[i-1], raw_ts[i])
-            breakpoints.append(i)
-    breakpoints.append(len(timestamps))
+    i = np.searchsorted(timestamps.slots, split_timestamp)
+    assert(i < len(timestamps) and timestamps.slots[i] == split_timestamp)
+
+    return (data[:i], timestamps[:i]), (data[i:], timestamps[i:])
+
+
+def contiguous_segments(timestamps, T=48):
+    """[start, stop) positions of the runs of consecutive timeslots"""
+    slots = as_timeslots(timestamps, T=T).slots
+    breakpoints = np.flatnonzero(np.diff(slots) != 1) + 1
+    starts = np.concatenate([[0], breakpoints]).astype(np.int64)
+    stops = np.concatenate([breakpoints, [len(slots)]]).astype(np.int64)
+    return starts, stops
+
+
+def window_view(data, length):
+    """zero-copy view of all windows of `length` consecutive frames
+
+    data: (nb_frame, nb_flow, ...) --> (nb_frame - length + 1, length * nb_flow, ...),
+    channels ordered from the oldest frame to the newest one
+    """
+    data = np.ascontiguousarray(data)
+    nb_window = max(len(data) - length + 1, 0)
+    shape = (nb_window, length * data.shape[1]) + data.shape[2:]
+    return np.lib.stride_tricks.as_strided(data, shape=shape, strides=data.strides, writeable=False)
+
+
+def iter_windows(data, timestamps, length=3, T=48):
+    """yields, for every contiguous segment of timestamps, the windows X, the targets Y
+    (both views of data) and the positions of the targets
+    """
+    for start, stop in zip(*contiguous_segments(timestamps, T=T)):
+        print('breakpoints: ', start, stop)
+        if stop - start <= length:
+            continue
+        segment = data[start:stop]
+        yield window_view(segment[:-1], length), segment[length:], np.arange(start + length, stop)
+
+
+def timeseries2seqs(data, timestamps, length=3, T=48, peroid=None, peroid_len=0,
+                    return_timestamps=False, layout='2D'):
+    """sequences (X, Y): X is the `length` frames before the target Y
+
+    peroid: interval in timeslots (or a pd.DateOffset) of the period/trend lookback, whose
+            peroid_len frames target - peroid * i (i = 1..peroid_len) are put before the
+            closeness frames; targets without them are skipped
+    return_timestamps: also return the timestamps (Timeslots) of the targets
+    layout: '2D' --> X (nb_sample, len * nb_flow, h, w), Y (nb_sample, nb_flow, h, w)
+            '3D' --> X (nb_sample, nb_flow, len, h, w), Y (nb_sample, nb_flow, 1, h, w),
+                     the memory layout of the 2D arrays read in that shape
+    With a single contiguous segment and no period lookback, X and Y are views of data.
+    """
+    assert layout in ['2D', '3D']
+    timestamps = as_timeslots(timestamps, T=T)
     X = []
     Y = []
-    for b in range(1, len(breakpoints)):
-        print('breakpoints: ', breakpoints[b-1], breakpoints[b])
-        idx = range(breakpoints[b-1], breakpoints[b])
-        for i in range(len(idx) - length):
-            x = np.vstack(data[idx[i:i+length]])
-            y = data[idx[i+length]]
-            X.append(x)
-            Y.append(y)
-    X = np.asarray(X)
-    Y = np.asarray(Y)
+    target = []
+    for _X, _Y, _target in iter_windows(data, timestamps, length=length, T=T):
+        X.append(_X)
+        Y.append(_Y)
+        target.append(_target)
+    if len(target) == 0:
+        X.append(window_view(data[:0], length))
+        Y.append(data[:0])
+        target.append(np.zeros(0, dtype=np.int64))
+    target = np.concatenate(target)
+
+    if peroid is not None and peroid_len > 0:
+        if not isinstance(peroid, (int, np.integer)):
+            peroid = int((pd.Timestamp(0) + peroid).value // pd.Timedelta(minutes=24 * 60 // T).value)
+        st_index = timestamps.slots - timestamps.slots.min() if len(timestamps) > 0 else timestamps.slots
+        lookup = np.full(st_index.max() + 1 if len(st_index) > 0 else 0, -1, dtype=np.int64)
+        lookup[st_index] = np.arange(len(st_index))
+        depend = st_index[target][:, None] - peroid * np.arange(1, peroid_len + 1)[None, :]
+        index = lookup[np.maximum(depend, 0)]
+        index[depend < 0] = -1
+        complete = (index >= 0).all(axis=1)
+        X = np.concatenate(X)[complete]
+        XP = data[index[complete].ravel()]
+        X = np.concatenate([XP.reshape((len(X), -1) + XP.shape[2:]), X], axis=1)
+        Y = np.concatenate(Y)[complete]
+        target = target[complete]
+    else:
+        X = X[0] if len(X) == 1 else np.concatenate(X)
+        Y = Y[0] if len(Y) == 1 else np.concatenate(Y)
+
+    if layout == '3D':
+        X = X.reshape((len(X), -1, X.shape[1] // data.shape[1]) + X.shape[2:])
+        Y = Y.reshape((len(Y), -1, 1) + Y.shape[2:])
     print("X shape: ", X.shape, "Y shape:", Y.shape)
+    if return_timestamps:
+        return X, Y, timestamps[target]
     return X, Y
 
+
 def timeseries2seqs_meta(data, timestamps, length=3, T=48):
-    raw_ts = copy(timestamps)
-    if type(timestamps[0]) != pd.Timestamp:
-        timestamps = string2timestamp(timestamps, T=T)
-
-    offset = pd.DateOffset(minutes=24 * 60 // T)
-
-    breakpoints = [0]
-    for i in range(1, len(timestamps)):
-        if timestamps[i-1] + offset != timestamps[i]:
-            print(timestamps[i-1], timestamps[i], raw_ts[i-1], raw_ts[i])
-            breakpoints.append(i)
-    breakpoints.append(len(timestamps))
-    X = []
-    Y = []
-    avail_timestamps = []
-    for b in range(1, len(breakpoints)):
-        print('breakpoints: ', breakpoints[b-1], breakpoints[b])
-        idx = range(breakpoints[b-1], breakpoints[b])
-        for i in range(len(idx) - length):
-            avail_timestamps.append(raw_ts[idx[i+length]])
-            x = np.vstack(data[idx[i:i+length]])
-            y = data[idx[i+length]]
-            X.append(x)
-            Y.append(y)
-    X = np.asarray(X)
-    Y = np.asarray(Y)
-    print("X shape: ", X.shape, "Y shape:", Y.shape)
-    return X, Y, avail_timestamps
+    return timeseries2seqs(data, timestamps, length=length, T=T, return_timestamps=True)
 
 
 def timeseries2seqs_peroid_trend(data, timestamps, length=3, T=48, peroid=pd.DateOffset(days=7), peroid_len=2):
-    raw_ts = copy(timestamps)
-    if type(timestamps[0]) != pd.Timestamp:
-        timestamps = string2timestamp(timestamps, T=T)
-
-    # timestamps index
-    timestamp_idx = dict()
-    for i, t in enumerate(timestamps):
-        timestamp_idx[t] = i
-
-    offset = pd.DateOffset(minutes=24 * 60 // T)
-
-    breakpoints = [0]
-    for i in range(1, len(timestamps)):
-        if timestamps[i-1] + offset != timestamps[i]:
-            print(timestamps[i-1], timestamps[i], raw_ts[i-1], raw_ts[i])
-            breakpoints.append(i)
-    breakpoints.append(len(timestamps))
-    X = []
-    Y = []
-    for b in range(1, len(breakpoints)):
-        print('breakpoints: ', breakpoints[b-1], breakpoints[b])
-        idx = range(breakpoints[b-1], breakpoints[b])
-        for i in range(len(idx) - length):
-            # period
-            target_timestamp = timestamps[i+length]
-
-            legal_idx = []
-            for pi in range(1, 1+peroid_len):
-                if target_timestamp - peroid * pi not in timestamp_idx:
-                    break
-                legal_idx.append(timestamp_idx[target_timestamp - peroid * pi])
-            # print("len: ", len(legal_idx), peroid_len)
-            if len(legal_idx) != peroid_len:
-                continue
-
-            legal_idx += idx[i:i+length]
-
-            # trend
-            x = np.vstack(data[legal_idx])
-            y = data[idx[i+length]]
-            X.append(x)
-            Y.append(y)
-    X = np.asarray(X)
-    Y = np.asarray(Y)
-    print("X shape: ", X.shape, "Y shape:", Y.shape)
-    return X, Y
+    return timeseries2seqs(data, timestamps, length=length, T=T, peroid=peroid, peroid_len=peroid_len)
 
 
 def timeseries2seqs_3D(data, timestamps, length=3, T=48):
-    raw_ts = copy(timestamps)
-    if type(timestamps[0]) != pd.Timestamp:
-        timestamps = string2timestamp(timestamps, T=T)
-
-    offset = pd.DateOffset(minutes=24 * 60 // T)
-
-    breakpoints = [0]
-    for i in range(1, len(timestamps)):
-        if timestamps[i-1] + offset != timestamps[i]:
-            print(timestamps[i-1], timestamps[i], raw_ts[i-1], raw_ts[i])
-            breakpoints.append(i)
-    breakpoints.append(len(timestamps))
-    X = []
-    Y = []
-    for b in range(1, len(breakpoints)):
-        print('breakpoints: ', breakpoints[b-1], breakpoints[b])
-        idx = range(breakpoints[b-1], breakpoints[b])
-        for i in range(len(idx) - length):
-            x = data[idx[i:i+length]].reshape(-1, length, 32, 32)
-            y = np.asarray([data[idx[i+length]]]).reshape(-1, 1, 32, 32)
-            X.append(x)
-            Y.append(y)
-    X = np.asarray(X)
-    Y = np.asarray(Y)
-    print("X shape: ", X.shape, "Y shape:", Y.shape)
-    return X, Y
-
-
-def bug_timeseries2seqs(data, timestamps, length=3, T=48):
-    # have a bug
-    if type(timestamps[0]) != pd.Timestamp:
-        timestamps = string2timestamp(timestamps, T=T)
-
-    offset = pd.DateOffset(minutes=24 * 60 // T)
-
-    breakpoints = [0]
-    for i in range(1, len(timestamps)):
-        if timestamps[i-1] + offset != timestamps[i]:
-            breakpoints.append(i)
-    X = []
-    Y = []
-    for b in range(1, len(breakpoints)):
-        print('breakpoints: ', breakpoints[b-1], breakpoints[b])
-        idx = range(breakpoints[b-1], breakpoints[b])
-        for i in range(len(idx) - 3):
-            x = np.vstack(data[idx[i:i+3]])
-            y = data[idx[i+3]]
-            X.append(x)
-            Y.append(y)
-    X = np.asarray(X)
-    Y = np.asarray(Y)
-    print("X shape: ", X.shape, "Y shape:", Y.shape)
-    return X, Y
\ No newline at end of file
+    return timeseries2seqs(data, timestamps, length=length, T=T, layout='3D')
@@ -0,0 +1,113 @@
+"""
+    content-addressed dataset cache
+
+    <cache_dir>/<name>_<frames key>/               normalized base frames, shared by all C/P/T configs
+        frames.npy, slots.npy, lengths.npy, info.json
+        plans/<plan key>/                           one per C/P/T/meta config
+            index.npy, target.npy, slots.npy, [meta.npy], info.json
+
+    The keys hash every input that affects the stored arrays, including the size and
+    mtime of the source files. Arrays are opened memory-mapped.
+"""
+from __future__ import print_function
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import numpy as np
+
+from star import Timeslots
+from star import minmax_normalization
+
+VERSION = 1
+
+
+def file_signature(fname):
+    st = os.stat(fname)
+    return [os.path.abspath(fname), st.st_size, int(st.st_mtime * 1e6)]
+
+
+def cache_key(config, fnames=()):
+    """sha1 of the config dict and of the signatures of the files `fnames`"""
+    content = dict(config, version=VERSION, files=[file_signature(fname) for fname in fnames])
+    return hashlib.sha1(json.dumps(content, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def _save(path, arrays, info):
+    # write into a temporary directory first so that readers never see a partial entry
+    parent = os.path.dirname(path)
+    if not os.path.isdir(parent):
+        os.makedirs(parent)
+    tmp = tempfile.mkdtemp(dir=parent, prefix='.tmp_')
+    for name, array in arrays.items():
+        np.save(os.path.join(tmp, name + '.npy'), array)
+    with open(os.path.join(tmp, 'info.json'), 'w') as f:
+        json.dump(info, f, sort_keys=True, default=str)
+    try:
+        os.rename(tmp, path)
+    except OSError:
+        # written concurrently by another process
+        shutil.rmtree(tmp)
+
+
+def _load(path, names, mmap_mode='r'):
+    with open(os.path.join(path, 'info.json')) as f:
+        info = json.load(f)
+    arrays = dict()
+    for name in names:
+        fname = os.path.join(path, name + '.npy')
+        if os.path.exists(fname):
+            arrays[name] = np.load(fname, mmap_mode=mmap_mode)
+    return arrays, info
+
+
+def frames_path(cache_dir, name, key):
+    return os.path.join(cache_dir, '{}_{}'.format(name, key[:16]))
+
+
+def plan_path(frames_dir, key):
+    return os.path.join(frames_dir, 'plans', key[:16])
+
+
+def exists(path):
+    return os.path.exists(os.path.join(path, 'info.json'))
+
+
+def save_frames(path, frames, timestamps_all, mmn, dtype=None):
+    """frames: normalized base frames; timestamps_all: Timeslots of every source file
+    dtype: dtype of the stored frames (default: frames.dtype)
+    """
+    if dtype is not None and np.dtype(dtype) != frames.dtype:
+        frames = frames.astype(dtype)
+    _save(path, dict(frames=frames,
+                     slots=np.concatenate([ts.slots for ts in timestamps_all]),
+                     lengths=np.asarray([len(ts) for ts in timestamps_all], dtype=np.int64)),
+          dict(T=timestamps_all[0].T, scaler=type(mmn).__name__, min=float(mmn._min), max=float(mmn._max)))
+
+
+def load_frames(path, mmap_mode='r', dtype=None):
+    """return: frames (memory-mapped, or converted in memory to dtype), timestamps of every source file, scaler"""
+    arrays, info = _load(path, ['frames', 'slots', 'lengths'], mmap_mode=mmap_mode)
+    slots = np.asarray(arrays['slots'])
+    bounds = np.concatenate([[0], np.cumsum(arrays['lengths'])])
+    timestamps_all = [Timeslots(slots[lo:hi], info['T']) for lo, hi in zip(bounds[:-1], bounds[1:])]
+    mmn = getattr(minmax_normalization, info['scaler'])()
+    mmn._min, mmn._max = info['min'], info['max']
+    frames = arrays['frames']
+    if dtype is not None and np.dtype(dtype) != frames.dtype:
+        frames = frames.astype(dtype)
+    return frames, timestamps_all, mmn
+
+
+def save_plan(path, index, target, meta, timestamps):
+    arrays = dict(index=index, target=target, slots=timestamps.slots)
+    if meta is not None:
+        arrays['meta'] = meta
+    _save(path, arrays, dict(T=timestamps.T))
+
+
+def load_plan(path, mmap_mode='r'):
+    """return: index, target, meta (or None) and timestamps of the samples"""
+    arrays, info = _load(path, ['index', 'target', 'slots', 'meta'], mmap_mode=mmap_mode)
+    return arrays['index'], arrays['target'], arrays.get('meta'), Timeslots(arrays['slots'], info['T'])
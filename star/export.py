@@ -0,0 +1,252 @@
+"""
+    inference export: frozen TensorFlow graph (constant and BatchNorm folding), optionally TFLite
+
+Usage:
+    python -m star.export --weights MODEL/BJ/c3.p1.t1.resunit4.lr0.00015.iter0.cont.h5 \
+        --output MODEL/BJ/c3.p1.t1.resunit4 [--tflite] [--data_format channels_last] \
+        [--weights_format channels_last  (weights trained with data_format='channels_last')] \
+        [--len_closeness 3 --len_period 1 --len_trend 1 --external_dim 8 --nb_residual_unit 4]
+
+    writes <output>.pb       the frozen GraphDef: variables turned into constants, training nodes
+                             removed, constants and BatchNormalization layers folded
+           <output>.json     names, shapes and data_format of the inputs and of the output
+           <output>.tflite   with --tflite
+
+FrozenModel and TFLiteModel run the artifacts with tensorflow only (no keras, no star.model)
+and have the predict(X, batch_size) of a keras model, so they can replace it in
+multi_step, metrics.evaluate or the prediction server.
+
+Requires TensorFlow 1.x (written against 1.12, the keras 2.2 backend of the experiments):
+tensorflow.tools.graph_transforms and tf.contrib.lite do not exist in TensorFlow 2.
+"""
+from __future__ import print_function
+import sys
+import json
+import argparse
+import numpy as np
+
+# graph_transforms applied to the frozen graph, in order
+TRANSFORMS = ['strip_unused_nodes',
+              'remove_nodes(op=Identity, op=CheckNumerics)',
+              'fold_constants(ignore_errors=true)',
+              'fold_batch_norms',
+              'fold_old_batch_norms',
+              'fold_constants(ignore_errors=true)',
+              'sort_by_execution_order']
+
+
+def _tf():
+    import tensorflow as tf
+    return tf
+
+
+def freeze(model, transforms=TRANSFORMS):
+    """frozen and optimized GraphDef of a keras model built in inference mode
+    (keras.backend.set_learning_phase(0) called before building it)
+
+    return: graph_def, input names, output names
+    """
+    import keras.backend as K
+    tf = _tf()
+    if not tf.__version__.startswith('1.'):
+        raise RuntimeError('star.export requires TensorFlow 1.x, %s installed' % tf.__version__)
+    if not isinstance(K.learning_phase(), int):
+        raise ValueError('call keras.backend.set_learning_phase(0) before building the model to export')
+    inputs = [x.op.name for x in model.inputs]
+    outputs = [y.op.name for y in model.outputs]
+    sess = K.get_session()
+    graph_def = tf.graph_util.convert_variables_to_constants(sess, sess.graph.as_graph_def(), outputs)
+    graph_def = tf.graph_util.remove_training_nodes(graph_def, protected_nodes=inputs + outputs)
+    if transforms:
+        from tensorflow.tools.graph_transforms import TransformGraph
+        graph_def = TransformGraph(graph_def, inputs, outputs, transforms)
+    return graph_def, inputs, outputs
+
+
+def to_tflite(fname_pb, info):
+    """TFLite flatbuffer of a frozen graph written by export, for a batch size of 1"""
+    tf = _tf()
+    lite = getattr(tf, 'lite', None) or tf.contrib.lite
+    Converter = getattr(lite, 'TFLiteConverter', None) or lite.TocoConverter
+    shapes = dict((name, [1] + shape[1:]) for name, shape in zip(info['inputs'], info['input_shapes']))
+    converter = Converter.from_frozen_graph(fname_pb, info['inputs'], info['outputs'], shapes)
+    return converter.convert()
+
+
+def export(model, path, tflite=False, data_format='channels_first', transforms=TRANSFORMS):
+    """write path.pb, path.json and, with tflite, path.tflite
+
+    model: built after keras.backend.set_learning_phase(0)
+    data_format: layout of the model, recorded for the callers of the exported model
+    """
+    tf = _tf()
+    graph_def, inputs, outputs = freeze(model, transforms)
+    info = dict(inputs=inputs, outputs=outputs, data_format=data_format,
+                input_shapes=[[None] + [int(d) for d in x.shape[1:]] for x in model.inputs],
+                output_shapes=[[None] + [int(d) for d in y.shape[1:]] for y in model.outputs])
+    with tf.gfile.GFile(path + '.pb', 'wb') as f:
+        f.write(graph_def.SerializeToString())
+    with open(path + '.json', 'w') as f:
+        json.dump(info, f, indent=2, sort_keys=True)
+    print('%s.pb: %i nodes' % (path, len(graph_def.node)))
+    if tflite:
+        with open(path + '.tflite', 'wb') as f:
+            f.write(to_tflite(path + '.pb', info))
+        print('%s.tflite written' % path)
+    return info
+
+
+def _load_info(path):
+    with open(path + '.json') as f:
+        return json.load(f)
+
+
+def _batches(X, batch_size):
+    X = X if isinstance(X, (list, tuple)) else [X]
+    n = len(X[0])
+    for start in range(0, n, batch_size):
+        yield [np.ascontiguousarray(x[start:start + batch_size], dtype=np.float32) for x in X]
+
+
+class FrozenModel(object):
+    """the frozen graph written by export, in its own tf.Session
+
+    path: without the .pb extension
+    intra_op_parallelism_threads, inter_op_parallelism_threads: 0 lets tensorflow choose
+    """
+
+    def __init__(self, path, intra_op_parallelism_threads=0, inter_op_parallelism_threads=0):
+        tf = _tf()
+        self.info = _load_info(path)
+        self.data_format = self.info['data_format']
+        graph_def = tf.GraphDef()
+        with tf.gfile.GFile(path + '.pb', 'rb') as f:
+            graph_def.ParseFromString(f.read())
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            tf.import_graph_def(graph_def, name='')
+        self.inputs = [self.graph.get_tensor_by_name(name + ':0') for name in self.info['inputs']]
+        self.outputs = [self.graph.get_tensor_by_name(name + ':0') for name in self.info['outputs']]
+        config = tf.ConfigProto(intra_op_parallelism_threads=intra_op_parallelism_threads,
+                                inter_op_parallelism_threads=inter_op_parallelism_threads)
+        self.sess = tf.Session(graph=self.graph, config=config)
+
+    def predict(self, X, batch_size=32):
+        y = [self.sess.run(self.outputs[0], feed_dict=dict(zip(self.inputs, x))) for x in _batches(X, batch_size)]
+        return np.concatenate(y)
+
+    def close(self):
+        self.sess.close()
+
+
+class TFLiteModel(object):
+    """the TFLite flatbuffer written by export (tflite_runtime is used if installed)
+
+    path: without the .tflite extension
+    """
+
+    def __init__(self, path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            tf = _tf()
+            Interpreter = (getattr(tf, 'lite', None) or tf.contrib.lite).Interpreter
+        self.info = _load_info(path)
+        self.data_format = self.info['data_format']
+        kwargs = dict(num_threads=num_threads) if num_threads else dict()
+        self.interpreter = Interpreter(model_path=path + '.tflite', **kwargs)
+        details = dict((d['name'], d['index']) for d in self.interpreter.get_input_details())
+        # the input tensors in the order of the keras model
+        self.inputs = [details[name] for name in self.info['inputs']]
+        self.output = self.interpreter.get_output_details()[0]['index']
+        self.batch_size = None
+
+    def _resize(self, batch_size):
+        for index, shape in zip(self.inputs, self.info['input_shapes']):
+            self.interpreter.resize_tensor_input(index, [batch_size] + shape[1:])
+        self.interpreter.allocate_tensors()
+        self.batch_size = batch_size
+
+    def predict(self, X, batch_size=32):
+        y = []
+        for x in _batches(X, batch_size):
+            if len(x[0]) != self.batch_size:
+                self._resize(len(x[0]))
+            for index, array in zip(self.inputs, x):
+                self.interpreter.set_tensor(index, array)
+            self.interpreter.invoke()
+            y.append(self.interpreter.get_tensor(self.output).copy())
+        return np.concatenate(y)
+
+
+def load(path, **kwargs):
+    """FrozenModel of path.pb, or TFLiteModel of path.tflite"""
+    if path.endswith('.tflite'):
+        return TFLiteModel(path[:-len('.tflite')], **kwargs)
+    if path.endswith('.pb'):
+        path = path[:-len('.pb')]
+    return FrozenModel(path, **kwargs)
+
+
+def build_model(weights=None, len_closeness=3, len_period=1, len_trend=1, nb_flow=2, map_height=32, map_width=32,
+                external_dim=8, nb_residual_unit=4, data_format='channels_first', nb_filter=64, conv_type='conv',
+                unit_depth=2, weights_format='channels_first'):
+    """STAR model in inference mode, with the weights saved by the experiment scripts
+
+    data_format: layout of the built model
+    weights_format: layout of the model the weights were saved from (the data_format of
+                    exptTaxiBJ.py, whose channels_last weights end in .channels_last);
+                    the weights are converted when it is not data_format
+    """
+    import keras.backend as K
+    K.set_learning_phase(0)
+    from star.model import STAR, convert_weights
+    c_conf = (len_closeness, nb_flow, map_height, map_width) if len_closeness > 0 else None
+    p_conf = (len_period, nb_flow, map_height, map_width) if len_period > 0 else None
+    t_conf = (len_trend, nb_flow, map_height, map_width) if len_trend > 0 else None
+    kwargs = dict(c_conf=c_conf, p_conf=p_conf, t_conf=t_conf, external_dim=external_dim,
+                  nb_residual_unit=nb_residual_unit, nb_filter=nb_filter, conv_type=conv_type, unit_depth=unit_depth)
+    model = STAR(data_format=data_format, **kwargs)
+    if weights is not None:
+        if weights_format == data_format:
+            model.load_weights(weights)
+        else:
+            src = STAR(data_format=weights_format, **kwargs)
+            src.load_weights(weights)
+            convert_weights(src, model, src_format=weights_format, dst_format=data_format)
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='export a trained STAR model for inference')
+    parser.add_argument('--weights', required=True)
+    parser.add_argument('--output', required=True, help='path of the artifacts, without extension')
+    parser.add_argument('--tflite', action='store_true')
+    parser.add_argument('--data_format', default='channels_first', choices=['channels_first', 'channels_last'],
+                        help='layout of the exported model (TFLite and the CPU kernels prefer channels_last)')
+    parser.add_argument('--weights_format', default='channels_first', choices=['channels_first', 'channels_last'],
+                        help='layout the weights were trained in (data_format of exptTaxiBJ.py)')
+    parser.add_argument('--len_closeness', type=int, default=3)
+    parser.add_argument('--len_period', type=int, default=1)
+    parser.add_argument('--len_trend', type=int, default=1)
+    parser.add_argument('--nb_flow', type=int, default=2)
+    parser.add_argument('--map_height', type=int, default=32)
+    parser.add_argument('--map_width', type=int, default=32)
+    parser.add_argument('--external_dim', type=int, default=8, help='0 for a model without meta features')
+    parser.add_argument('--nb_residual_unit', type=int, default=4)
+    parser.add_argument('--nb_filter', type=int, default=64)
+    parser.add_argument('--conv_type', default='conv', choices=['conv', 'separable'])
+    parser.add_argument('--unit_depth', type=int, default=2, help='number of convolutions per residual unit')
+    args = parser.parse_args(argv)
+
+    model = build_model(args.weights, len_closeness=args.len_closeness, len_period=args.len_period,
+                        len_trend=args.len_trend, nb_flow=args.nb_flow, map_height=args.map_height,
+                        map_width=args.map_width, external_dim=args.external_dim or None,
+                        nb_residual_unit=args.nb_residual_unit, data_format=args.data_format,
+                        nb_filter=args.nb_filter, conv_type=args.conv_type, unit_depth=args.unit_depth,
+                        weights_format=args.weights_format)
+    export(model, args.output, tflite=args.tflite, data_format=args.data_format)
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,117 @@
+"""
+    STAR inference with the external branch replaced by a lookup table
+
+    With the time features only (meta_data=True without meteorology nor holidays, as in
+    exptTaxiBJ.py), the external input takes 7 distinct values: day of week one-hot and
+    weekday flag. The output of Dense(10) -> Dense(2 * h * w) -> Reshape is computed once
+    per distinct vector, and the core of the model (every layer after the Reshape) takes
+    the looked up maps as its second input.
+"""
+from __future__ import print_function
+import numpy as np
+from keras.layers import Input, Reshape
+from keras.models import Model
+
+from star import Timeslots, timestamp2vec
+
+
+def _row_keys(meta):
+    """one comparable bytes key per row of meta"""
+    meta = np.ascontiguousarray(meta, dtype=np.float32)
+    return meta.view(np.dtype((np.void, meta.itemsize * meta.shape[1]))).ravel()
+
+
+def external_branch(model):
+    """the Reshape layer ending the external branch of a STAR model, None without meta features"""
+    reshape = [layer for layer in model.layers if isinstance(layer, Reshape)]
+    return reshape[0] if len(model.inputs) > 1 and reshape else None
+
+
+def split_model(model):
+    """(branch, core) sharing the layers (and weights) of model:
+    branch: meta --> external maps, the output of the Reshape
+    core: [XCPT, external maps] --> the output of model
+
+    The core is rebuilt by applying again, in the order of model.layers, every layer whose
+    inputs are available from XCPT and the external maps.
+    """
+    reshape = external_branch(model)
+    # the inputs and output of every layer in the original graph, its first call (node 0),
+    # read before the layers are called again
+    nodes = [(layer, layer.get_input_at(0), layer.get_output_at(0)) for layer in model.layers]
+    branch = Model(input=model.inputs[1], output=reshape.output)
+    external_map = Input(shape=tuple(int(d) for d in reshape.output.shape[1:]))
+    tensors = {model.inputs[0].name: model.inputs[0], reshape.output.name: external_map}
+    for layer, inputs, output in nodes:
+        inputs = inputs if isinstance(inputs, list) else [inputs]
+        if output.name in tensors or not all(x.name in tensors for x in inputs):
+            continue
+        inputs = [tensors[x.name] for x in inputs]
+        tensors[output.name] = layer(inputs[0] if len(inputs) == 1 else inputs)
+    core = Model(input=[model.inputs[0], external_map], output=tensors[model.outputs[0].name])
+    return branch, core
+
+
+def time_features_domain():
+    """the 7 distinct vectors of timestamp2vec"""
+    return timestamp2vec(Timeslots(np.arange(7) * 48, 48)).astype(np.float32)
+
+
+class ExternalLookup(object):
+    """predict of a STAR model, the output of its external branch looked up in a table
+
+    model: STAR model with meta features
+    meta: external vectors defining the domain of the table, e.g. the meta features of the
+          training set (default: time_features_domain(), for a model with the time features only;
+          no table if the model has other external features)
+    max_size: no table if meta has more distinct vectors (continuous meteorology features):
+              predict is then model.predict
+
+    Vectors missing from the table go through the dense branch (nb_fallback counts them).
+    """
+
+    def __init__(self, model, meta=None, max_size=64):
+        self.model = model
+        self.table = None
+        self.nb_fallback = 0
+        if external_branch(model) is None:
+            print('no external branch: no lookup table')
+            return
+        external_dim = int(model.inputs[1].shape[-1])
+        if meta is None:
+            meta = time_features_domain()
+            if meta.shape[1] != external_dim:
+                # e.g. holiday or meteorology features: the domain is that of the training meta
+                print('%i external features, not the %i time features: no lookup table'
+                      % (external_dim, meta.shape[1]))
+                return
+        meta = np.asarray(meta)
+        if meta.ndim != 2 or meta.shape[1] != external_dim:
+            raise ValueError('meta of shape %s for a model of %i external features' % (meta.shape, external_dim))
+        keys, first = np.unique(_row_keys(meta), return_index=True)
+        if len(keys) > max_size:
+            print('%i distinct external vectors (> %i): no lookup table' % (len(keys), max_size))
+            return
+        self.branch, self.core = split_model(model)
+        self.keys = keys
+        self.table = self.branch.predict(np.asarray(meta[first], dtype=np.float32))
+        # built now, in the graph of this thread (see server.load_model)
+        self.branch._make_predict_function()
+        self.core._make_predict_function()
+        print('lookup table of the external branch: %i vectors' % len(keys))
+
+    def lookup(self, meta):
+        """external maps of meta"""
+        keys = _row_keys(meta)
+        ids = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        maps = self.table[ids]
+        missing = np.flatnonzero(self.keys[ids] != keys)
+        if len(missing):
+            self.nb_fallback += len(missing)
+            maps[missing] = self.branch.predict(np.asarray(meta[missing], dtype=np.float32))
+        return maps
+
+    def predict(self, X, batch_size=32):
+        if self.table is None:
+            return self.model.predict(X, batch_size=batch_size)
+        return self.core.predict([X[0], self.lookup(X[1])], batch_size=batch_size)
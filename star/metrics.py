@@ -1,7 +1,8 @@
-# import numpy as np
-from keras import backend as K
+import numpy as np
 
 def mean_squared_error(y_true, y_pred):
+    # keras imported here: the Evaluator and evaluate need NumPy only
+    from keras import backend as K
     return K.mean(K.square(y_pred - y_true))
 
 def root_mean_square_error(y_true, y_pred):
@@ -13,3 +14,121 @@ def rmse(y_true, y_pred):
 # aliases
 mse = MSE = mean_squared_error
 # rmse = RMSE = root_mean_square_error
+
+
+class Evaluator(object):
+    """streaming metrics of predictions, in the unit of the flows
+
+    Only sums are accumulated, per horizon, flow channel and grid cell and per time of
+    day of the predicted slot, so that the predictions are never held all together:
+        squared error, absolute error, and absolute percentage error over the true
+        flows above mape_threshold (the MAPE of near-zero flows is meaningless)
+
+    mmn: scaler of the flows, None to evaluate the scaled values
+    frame_shape: (nb_flow, h, w), whatever data_format the batches are in
+    """
+
+    def __init__(self, frame_shape=(2, 32, 32), nb_horizon=1, T=48, mmn=None, mape_threshold=10.,
+                 data_format='channels_first'):
+        self.nb_horizon = nb_horizon
+        self.T = T
+        self.mmn = mmn
+        self.mape_threshold = mape_threshold
+        self.data_format = data_format
+        shape = (nb_horizon, ) + tuple(frame_shape)
+        self.se = np.zeros(shape)
+        self.ae = np.zeros(shape)
+        self.ape = np.zeros(shape)
+        self.nb_pe = np.zeros(shape)
+        self.nb_sample = 0
+        # per time of day of the predicted slot, over the flows and cells
+        self.se_tod = np.zeros((nb_horizon, T))
+        self.nb_tod = np.zeros((nb_horizon, T))
+
+    def update(self, y_true, y_pred, timestamps=None):
+        """y_true, y_pred: (nb_sample, nb_horizon * nb_flow, h, w) scaled values, or NHWC
+        timestamps: Timeslots (or slot numbers) of the first predicted frames
+        """
+        if self.data_format == 'channels_last':
+            y_true, y_pred = np.moveaxis(y_true, -1, 1), np.moveaxis(y_pred, -1, 1)
+        shape = (len(y_true), self.nb_horizon) + self.se.shape[1:]
+        if self.mmn is not None:
+            y_true = self.mmn.inverse_transform(y_true)
+            y_pred = self.mmn.inverse_transform(y_pred)
+        y_true = np.asarray(y_true, dtype=np.float64).reshape(shape)
+        error = np.asarray(y_pred, dtype=np.float64).reshape(shape) - y_true
+        se = np.square(error)
+        self.se += se.sum(axis=0)
+        np.abs(error, out=error)
+        self.ae += error.sum(axis=0)
+        valid = y_true > self.mape_threshold
+        self.ape += np.divide(error, y_true, out=np.zeros_like(error), where=valid).sum(axis=0)
+        self.nb_pe += valid.sum(axis=0)
+        self.nb_sample += len(y_true)
+        if timestamps is not None:
+            slots = np.asarray(getattr(timestamps, 'slots', timestamps), dtype=np.int64)
+            tod = (slots[:, None] + np.arange(self.nb_horizon)[None, :]) % self.T
+            se = se.reshape(shape[:2] + (-1, )).sum(axis=2)
+            for k in range(self.nb_horizon):
+                self.se_tod[k] += np.bincount(tod[:, k], weights=se[:, k], minlength=self.T)
+                self.nb_tod[k] += np.bincount(tod[:, k], minlength=self.T)
+
+    def result(self):
+        """dict of metrics: rmse, mae, mape (overall), and their breakdowns
+            *_horizon (nb_horizon, ), *_flow (nb_flow, ), *_cell (nb_flow, h, w),
+            rmse_tod (nb_horizon, T) (nan for the slots of the day never predicted),
+            rmse_norm: rmse of the scaled values
+        """
+        def mean(total, count):
+            return total / np.maximum(count, 1)
+
+        nb_horizon, nb_sample = self.nb_horizon, self.nb_sample
+        frame_size = self.se[0].size
+        nb_cell = frame_size // self.se.shape[1]
+        result = dict(nb_sample=nb_sample)
+        for name, total, f in [('rmse', self.se, np.sqrt), ('mae', self.ae, np.asarray)]:
+            result[name] = float(f(mean(total.sum(), nb_horizon * nb_sample * frame_size)))
+            result[name + '_horizon'] = f(mean(total.reshape(nb_horizon, -1).sum(axis=1), nb_sample * frame_size))
+            result[name + '_flow'] = f(mean(total.sum(axis=(0, 2, 3)), nb_horizon * nb_sample * nb_cell))
+            result[name + '_cell'] = f(mean(total.sum(axis=0), nb_horizon * nb_sample))
+        result['mape'] = float(mean(self.ape.sum(), self.nb_pe.sum()))
+        result['mape_horizon'] = mean(self.ape.reshape(nb_horizon, -1).sum(axis=1),
+                                      self.nb_pe.reshape(nb_horizon, -1).sum(axis=1))
+        result['mape_flow'] = mean(self.ape.sum(axis=(0, 2, 3)), self.nb_pe.sum(axis=(0, 2, 3)))
+        result['mape_cell'] = mean(self.ape.sum(axis=0), self.nb_pe.sum(axis=0))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            result['rmse_tod'] = np.sqrt(self.se_tod / (self.nb_tod * frame_size))
+        scale = 1. if self.mmn is None else float(self.mmn.inverse_transform(1.) - self.mmn.inverse_transform(0.))
+        result['rmse_norm'] = result['rmse'] / scale
+        return result
+
+
+def evaluate(model, X, Y=None, timestamps=None, mmn=None, nb_horizon=1, T=48, batch_size=256, chunk_size=4096,
+             mape_threshold=10., data_format='channels_first'):
+    """metrics of model.predict over X, Y (as returned by load_data), or over an STDataset X
+    gathered chunk by chunk (Y None); see Evaluator.result
+
+    batch_size: batch size of model.predict, much larger than the training one
+    chunk_size: number of samples predicted (and gathered) at a time
+    data_format: layout of Y and of the predictions
+    """
+    if Y is None:
+        dataset = X
+        nb_sample = len(dataset)
+        timestamps = dataset.timestamps if timestamps is None else timestamps
+        get = lambda s: dataset.batch(np.arange(s.start, s.stop))
+    else:
+        nb_sample = len(Y)
+        get = lambda s: ([x[s] for x in X], Y[s])
+    evaluator = None
+    for start in range(0, nb_sample, chunk_size):
+        s = slice(start, min(start + chunk_size, nb_sample))
+        X_chunk, Y_chunk = get(s)
+        if evaluator is None:
+            shape = Y_chunk.shape if data_format == 'channels_first' else np.moveaxis(Y_chunk, -1, 1).shape
+            frame_shape = (shape[1] // nb_horizon, ) + shape[2:]
+            evaluator = Evaluator(frame_shape, nb_horizon=nb_horizon, T=T, mmn=mmn, mape_threshold=mape_threshold,
+                                  data_format=data_format)
+        y_pred = model.predict(X_chunk, batch_size=batch_size)
+        evaluator.update(Y_chunk, y_pred, timestamps[s] if timestamps is not None else None)
+    return evaluator.result()
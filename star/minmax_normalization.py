@@ -6,56 +6,85 @@ import numpy as np
 np.random.seed(1337)  # for reproducibility
 
 
-class MinMaxNormalization(object):
-    '''MinMax Normalization --> [-1, 1]
-       x = (x - min) / (max - min).
-       x = x * 2 - 1
+class _MinMaxScaler(object):
+    '''min/max fitting and the affine transform x = (x - min) / (max - min), shared by the scalers;
+       the subclasses map [0, 1] to their range with _rescale / _unscale
     '''
 
     def __init__(self):
-        pass
+        self._min = None
+        self._max = None
 
     def fit(self, X):
-        self._min = X.min()
-        self._max = X.max()
+        self._min = None
+        self._max = None
+        self.partial_fit(X)
         print("min:", self._min, "max:", self._max)
 
-    def transform(self, X):
-        X = 1. * (X - self._min) / (self._max - self._min)
-        X = X * 2. - 1.
+    def partial_fit(self, X):
+        '''update min/max with X, a chunk/year of the data (an H5Array is read chunk by chunk)'''
+        if hasattr(X, 'iter_chunks'):
+            for _, _, chunk in X.iter_chunks():
+                self.partial_fit(chunk)
+            return self
+        if len(X) == 0:
+            return self
+        # floats, whatever the dtype of X (e.g. raw uint16 counts)
+        _min, _max = float(X.min()), float(X.max())
+        self._min = _min if self._min is None else min(self._min, _min)
+        self._max = _max if self._max is None else max(self._max, _max)
+        return self
+
+    def _rescale(self, X, out=None):
+        return X
+
+    def _unscale(self, X):
         return X
 
+    def transform(self, X, out=None, dtype=None):
+        '''out: array to write the result into (X itself for an in-place transform)
+           dtype: dtype of the result when out is not given
+        '''
+        if out is None:
+            if dtype is None and not hasattr(X, 'iter_chunks'):
+                X = 1. * (X - self._min) / (self._max - self._min)
+                return self._rescale(X)
+            out = np.empty(X.shape, dtype=dtype or np.float64)
+        if hasattr(X, 'iter_chunks'):
+            for start, stop, chunk in X.iter_chunks():
+                self.transform(chunk, out=out[start:stop])
+            return out
+        # integer counts are promoted first, so that X - min does not wrap around
+        np.subtract(X, self._min, out=out, casting='unsafe',
+                    dtype=out.dtype if X.dtype.kind in 'ui' else None)
+        out /= (self._max - self._min)
+        return self._rescale(out, out=out)
+
     def fit_transform(self, X):
         self.fit(X)
         return self.transform(X)
 
     def inverse_transform(self, X):
-        X = (X + 1.) / 2.
+        X = self._unscale(X)
         X = 1. * X * (self._max - self._min) + self._min
         return X
 
 
-class MinMaxNormalization_01(object):
-    '''MinMax Normalization --> [0, 1]
+class MinMaxNormalization(_MinMaxScaler):
+    '''MinMax Normalization --> [-1, 1]
        x = (x - min) / (max - min).
+       x = x * 2 - 1
     '''
 
-    def __init__(self):
-        pass
-
-    def fit(self, X):
-        self._min = X.min()
-        self._max = X.max()
-        print("min:", self._min, "max:", self._max)
+    def _rescale(self, X, out=None):
+        X = np.multiply(X, 2., out=out)
+        return np.subtract(X, 1., out=out)
 
-    def transform(self, X):
-        X = 1. * (X - self._min) / (self._max - self._min)
-        return X
+    def _unscale(self, X):
+        return (X + 1.) / 2.
 
-    def fit_transform(self, X):
-        self.fit(X)
-        return self.transform(X)
 
-    def inverse_transform(self, X):
-        X = 1. * X * (self._max - self._min) + self._min
-        return X
+class MinMaxNormalization_01(_MinMaxScaler):
+    '''MinMax Normalization --> [0, 1]
+       x = (x - min) / (max - min).
+    '''
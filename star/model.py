@@ -31,50 +31,77 @@ def _shortcut(input, residual):
     return add([input, residual])
 
 # 2D
-def _bn_relu_conv(nb_filter, nb_row, nb_col, subsample=(1, 1), bn=False):
+def channel_axis(data_format='channels_first'):
+    return 1 if data_format == 'channels_first' else -1
+
+def _bn_relu_conv(nb_filter, nb_row, nb_col, subsample=(1, 1), bn=False, data_format='channels_first',
+                  conv_type='conv'):
     def f(input):
-        if bn:                                                                                                                                                                                                                                                                                                                                                                                                              
-            input = BatchNormalization(mode=0, axis=1)(input)
+        if bn:
+            input = BatchNormalization(mode=0, axis=channel_axis(data_format))(input)
         activation = Activation('relu')(input)
 
+        if conv_type == 'separable':
+            # depthwise 3x3 then pointwise 1x1: about 1 / nb_filter + 1 / 9 of the multiply-adds
+            return SeparableConv2D(filters=nb_filter, kernel_size=(nb_row, nb_col), strides=subsample,
+                                   depthwise_regularizer=regularizers.l2(regularizers_l2),
+                                   pointwise_regularizer=regularizers.l2(regularizers_l2), padding="same",
+                                   data_format=data_format)(activation)
         return Conv2D(filters=nb_filter, kernel_size=(nb_row, nb_col), strides=subsample, 
-                         kernel_regularizer=regularizers.l2(regularizers_l2), padding="same")(activation)                                                                                                                                                                                                                                        
+                         kernel_regularizer=regularizers.l2(regularizers_l2), padding="same",
+                         data_format=data_format)(activation)                                                                                                                                                                                                                                        
     return f
 
-def ResUnits2D(residual_unit, nb_filter, map_height=16, map_width=8, repetations=1):
+def ResUnits2D(residual_unit, nb_filter, map_height=16, map_width=8, repetations=1, data_format='channels_first',
+               conv_type='conv', unit_depth=2):
     def f(input):
         for i in range(repetations): 
             init_subsample = (1, 1)
             input = _residual_unit(nb_filter=nb_filter,
-                                  init_subsample=init_subsample)(input)
+                                  init_subsample=init_subsample, data_format=data_format,
+                                  conv_type=conv_type, depth=unit_depth)(input)
             # y = cbam_block(y)                      
             # input = add([input, y])
 
         return input
     return f
 
-def _residual_unit(nb_filter, init_subsample=(1, 1)):
+def _residual_unit(nb_filter, init_subsample=(1, 1), data_format='channels_first', conv_type='conv', depth=2):
     def f(input):
-        residual = _bn_relu_conv(nb_filter, 3, 3)(input)
-        residual = _bn_relu_conv(nb_filter, 3, 3)(residual)
+        residual = input
+        for i in range(depth):
+            residual = _bn_relu_conv(nb_filter, 3, 3, data_format=data_format, conv_type=conv_type)(residual)
         return _shortcut(input, residual)
     return f
 
-def STAR(c_conf=(3, 2, 32, 32), p_conf=(1, 2, 32, 32), t_conf=(1, 2, 32, 32), external_dim=8, nb_residual_unit=3):
+def STAR(c_conf=(3, 2, 32, 32), p_conf=(1, 2, 32, 32), t_conf=(1, 2, 32, 32), external_dim=8, nb_residual_unit=3,
+         nb_horizon=1, data_format='channels_first', nb_filter=64, conv_type='conv', unit_depth=2):
     '''
     C - Temporal Closeness
     P - Period
     T - Trend
-    conf = (len_seq, nb_flow, map_height, map_width)
+    conf = (len_seq, nb_flow, map_height, map_width), None for a sequence not used;
+           nb_flow and the map size are those of the first given conf
     external_dim
+    nb_horizon: number of future frames predicted at once, output channels
+                [k * nb_flow:(k + 1) * nb_flow] being the frame k steps ahead
+    data_format: 'channels_first' (NCHW) or 'channels_last' (NHWC, faster on CPU),
+                 for the inputs, the output and every layer
+    nb_filter, conv_type, unit_depth: width, convolution ('conv' or 'separable') and number of
+                 convolutions of the residual units; the defaults are the published STAR,
+                 e.g. nb_filter=32, conv_type='separable' is a lite variant (see complexity)
     '''
-    map_height, map_width = 32, 32
-    nb_flow = 2
-    nb_filter = 64
+    confs = [conf for conf in (c_conf, p_conf, t_conf) if conf is not None]
+    nb_flow, map_height, map_width = confs[0][1:]
+    len_seq = [0 if conf is None else conf[0] for conf in (c_conf, p_conf, t_conf)]
 
     main_inputs = []
 
-    input = Input(shape=((nb_flow * (c_conf[0]+p_conf[0]*2+t_conf[0]*2), map_height, map_width)))
+    nb_channel = nb_flow * (len_seq[0]+len_seq[1]*2+len_seq[2]*2)
+    if data_format == 'channels_first':
+        input = Input(shape=((nb_channel, map_height, map_width)))
+    else:
+        input = Input(shape=((map_height, map_width, nb_channel)))
 
     main_inputs.append(input)
     main_output = main_inputs[0]
@@ -85,25 +112,76 @@ def STAR(c_conf=(3, 2, 32, 32), p_conf=(1, 2, 32, 32), t_conf=(1, 2, 32, 32), ex
         main_inputs.append(external_input)
         embedding = Dense(units=10, activation='relu')(external_input)
         h1 = Dense(units=2*map_height * map_width, activation='relu')(embedding)
-        external_output = Reshape((2, map_height, map_width))(h1)
-        main_output = Concatenate(axis=1)([main_output, external_output])
+        if data_format == 'channels_first':
+            external_output = Reshape((2, map_height, map_width))(h1)
+        else:
+            external_output = Reshape((map_height, map_width, 2))(h1)
+        main_output = Concatenate(axis=channel_axis(data_format))([main_output, external_output])
     else:
         print('external_dim:', external_dim)
 
-    conv1 = Conv2D(nb_filter, (3, 3), kernel_regularizer=regularizers.l2(regularizers_l2),padding="same")(main_output)
+    conv1 = Conv2D(nb_filter, (3, 3), kernel_regularizer=regularizers.l2(regularizers_l2),padding="same",
+                   data_format=data_format)(main_output)
 
     # [nb_residual_unit] Residual Units
     residual_output = ResUnits2D(_residual_unit, nb_filter=nb_filter,
-                      repetations=nb_residual_unit)(conv1)
+                      repetations=nb_residual_unit, data_format=data_format,
+                      conv_type=conv_type, unit_depth=unit_depth)(conv1)
     activation = Activation('relu')(residual_output)
 
-    conv2 = Conv2D(nb_flow, (3, 3), padding='same')(activation)
+    conv2 = Conv2D(nb_flow * nb_horizon, (3, 3), padding='same', data_format=data_format)(activation)
     main_output = Activation('tanh')(conv2)
 
     model = Model(input=main_inputs, output=main_output)
 
     return model
 
+def convert_weights(src_model, dst_model, src_format='channels_first', dst_format='channels_last'):
+    '''
+    copy the weights of src_model into dst_model, the same architecture built with another data_format
+
+    The conv kernels (kh, kw, in, out) and the BN parameters do not depend on the layout;
+    only the Dense layers feeding a Reshape to a frame have their units permuted.
+    '''
+    # names of the tensors reshaped to a frame
+    reshaped = dict((layer.input.name, layer.target_shape) for layer in src_model.layers
+                    if isinstance(layer, Reshape))
+    for src, dst in zip(src_model.layers, dst_model.layers):
+        weights = src.get_weights()
+        if isinstance(src, Dense) and src.output.name in reshaped and src_format != dst_format:
+            shape = reshaped[src.output.name]
+            # the units, in the src layout --> in the dst layout
+            axes = (0, 2, 3, 1) if src_format == 'channels_first' else (0, 3, 1, 2)
+            weights = [w.reshape((-1, ) + shape).transpose(axes).reshape(w.shape) for w in weights]
+        dst.set_weights(weights)
+    return dst_model
+
+def complexity(model, verbose=False):
+    '''
+    number of parameters and of multiply-adds per sample of the Conv2D, SeparableConv2D and Dense layers
+    return: dict(params=..., flops=...), flops counting one multiply-add
+    '''
+    params, flops = model.count_params(), 0
+    for layer in model.layers:
+        if isinstance(layer, (Conv2D, SeparableConv2D)):
+            shape = layer.output_shape
+            h, w, c_out = (shape[2], shape[3], shape[1]) if layer.data_format == 'channels_first' else shape[1:]
+            c_in = int(layer.input_shape[1 if layer.data_format == 'channels_first' else -1])
+            kh, kw = layer.kernel_size
+            if isinstance(layer, SeparableConv2D):
+                c_mid = c_in * layer.depth_multiplier
+                n = h * w * (kh * kw * c_mid + c_mid * c_out)
+            else:
+                n = h * w * kh * kw * c_in * c_out
+        elif isinstance(layer, Dense):
+            n = int(layer.input_shape[-1]) * layer.units
+        else:
+            continue
+        flops += n
+        if verbose:
+            print('%-24s %10i params %12i multiply-adds' % (layer.name, layer.count_params(), n))
+    return dict(params=params, flops=flops)
+
 if __name__ == '__main__':
     model = STAR(external_dim=8, nb_residual_unit=2)
     plot_model(model, to_file='/home/suhan/wanghn/ST-ResNet.png', show_shapes=True)
@@ -1,65 +1,90 @@
 import numpy as np
 import os
 
-def multi_step_2D(model, path_model, hyperparams_name, X_test, Y_test, step):
-    # model = build_model(external_dim)
+
+def channels_first(X, data_format='channels_first'):
+    """NCHW view of a batch in data_format"""
+    return X if data_format == 'channels_first' else np.moveaxis(X, -1, 1)
+
+
+def multi_step(model, X_test, Y_test, step, len_closeness, nb_flow=2, mmn=None, batch_size=32,
+               data_format='channels_first'):
+    """rolling forecast: the prediction of a step is the most recent closeness frame of the next step
+
+    X_test: [XCPT] (+ [meta]) of consecutive target slots, Y_test: their targets
+    mmn: scaler of the flows (RMSE in flows), None for the RMSE of the scaled values
+    data_format: layout of the model inputs and outputs
+    return: {step index: RMSE of the step}
+
+    Row k of the input buffer first predicts target k, then target k + 1, ... : its
+    closeness frames are shifted in place and its period/trend frames and meta are
+    those of the next target. Only the squared errors of every step are kept.
+    """
+    assert len_closeness > 0
+    nb_closeness = len_closeness * nb_flow
+    nb_sample = len(Y_test)
+    # the scalers are affine: error in flows = scale * error of the scaled values
+    scale = 1. if mmn is None else float(mmn.inverse_transform(1.) - mmn.inverse_transform(0.))
+
+    # preallocated once
+    XCPT = np.array(X_test[0], copy=True)
+    # the closeness frames are shifted through NCHW views
+    C, C_test = channels_first(XCPT, data_format), channels_first(X_test[0], data_format)
     dic_muilt_rmse = {}
-    fname_param = os.path.join(path_model, '{}_cont.h5'.format(hyperparams_name))
-    model.load_weights(fname_param)
-    print(hyperparams_name)
-    nb_flow = 2
-    len_closeness = int(hyperparams_name.split('.')[0][-1])
-    y_pre = []
-    X_test_now = X_test
-
-    # inference
-    for i in range(1, step + 1):
-        y_pre_inference = model.predict(X_test_now)  # 1
-        # expand dims [timeslots, flow, height, width] --> [step, timeslots, flow, height, width]
-        y_pre_expand_dims = np.expand_dims(y_pre_inference, axis=0)
-        # append in all step
-        y_pre.append(y_pre_expand_dims)
-
-        X_test_noremove = X_test_now[0][1:]
-        X_test_noremove = X_test_noremove.transpose((1, 0, 2, 3))
-        X_test_noremove = X_test_noremove[len_closeness * nb_flow:]
-        X_test_noremove = X_test_noremove.transpose((1, 0, 2, 3))
-
-        X_test_remove = X_test_now[0].transpose((1, 0, 2, 3))
-        X_test_remove = X_test_remove[:len_closeness * nb_flow]
-
-        y_pre_remove = y_pre_inference.transpose((1, 0, 2, 3))
-
-        if len_closeness > 1:
-            for j in range(len_closeness * nb_flow, 3, -nb_flow):
-                X_test_remove[j - 2:j] = X_test_remove[j - 4:j - 2]  #
-            X_test_remove[0:2] = y_pre_remove
-        else:
-            X_test_remove[0:2] = y_pre_remove
-
-        X_test_remove = X_test_remove.transpose((1, 0, 2, 3))
-        X_test_remove = X_test_remove[:-1]
-
-        X_test_next = np.concatenate((X_test_remove, X_test_noremove), axis=1)
-        #
-        # make training data
-        X_test_makeData = []
-
-        X_test_makeData.append(X_test_next)
-        X_test_makeData.append(X_test[1][i:])
-
-        X_test_now = X_test_makeData
-
-    # inverse_transform
-    for i in range(len(y_pre)):
-        y_pre[i] = (y_pre[i] + 1) / 2 * 1292
-
-    Y_test = (Y_test + 1) / 2 * 1292
-
-    for i in range(len(y_pre)):
-        rmse = np.sqrt(np.sum((y_pre[i][0] - Y_test[i:]) ** 2) / (
-                    Y_test[i:].shape[0] * Y_test.shape[1] * Y_test.shape[2] * Y_test.shape[3]))
+    for i in range(step):
+        n = nb_sample - i
+        y_pre = model.predict([XCPT[:n]] + [X[i:] for X in X_test[1:]], batch_size=batch_size)
+
+        if i + 1 < step:
+            # next step: shift the closeness frames, the prediction being the most recent one
+            for j in range(len_closeness - 1, 0, -1):
+                C[:n - 1, j * nb_flow:(j + 1) * nb_flow] = C[:n - 1, (j - 1) * nb_flow:j * nb_flow]
+            C[:n - 1, :nb_flow] = channels_first(y_pre, data_format)[:n - 1]
+            C[:n - 1, nb_closeness:] = C_test[i + 1:, nb_closeness:]
+
+        y_pre -= Y_test[i:]
+        rmse = scale * np.sqrt(np.dot(y_pre.ravel(), y_pre.ravel()) / y_pre.size)
+        print("RMSE of step%d=%f'" % (i, rmse))
+        dic_muilt_rmse[i] = rmse
+
+    return dic_muilt_rmse
+
+
+def multi_horizon(model, X_test, Y_test, nb_horizon, nb_flow=2, mmn=None, batch_size=32, chunk_size=1024,
+                  data_format='channels_first'):
+    """RMSE of every horizon of a multi-horizon model (STAR with nb_horizon), in one forward pass
+
+    Y_test: (nb_sample, nb_horizon * nb_flow, h, w) as built with len_horizon
+    mmn: scaler of the flows (RMSE in flows), None for the RMSE of the scaled values
+    chunk_size: number of samples predicted at a time, only their squared errors being kept
+    return: {step index: RMSE of the step}, as multi_step
+    """
+    scale = 1. if mmn is None else float(mmn.inverse_transform(1.) - mmn.inverse_transform(0.))
+    nb_sample = len(Y_test)
+    sse = np.zeros(nb_horizon)
+    for start in range(0, nb_sample, chunk_size):
+        stop = min(start + chunk_size, nb_sample)
+        y_pre = model.predict([X[start:stop] for X in X_test], batch_size=batch_size)
+        y_pre -= Y_test[start:stop]
+        y_pre = channels_first(y_pre, data_format).reshape((stop - start, nb_horizon, -1))
+        sse += np.einsum('nkc,nkc->k', y_pre, y_pre)
+
+    dic_muilt_rmse = {}
+    for i in range(nb_horizon):
+        rmse = scale * np.sqrt(sse[i] / (np.prod(Y_test.shape) // nb_horizon))
         print("RMSE of step%d=%f'" % (i, rmse))
         dic_muilt_rmse[i] = rmse
 
     return dic_muilt_rmse
+
+
+def multi_step_2D(model, path_model, hyperparams_name, X_test, Y_test, step, len_closeness, mmn, nb_flow=2,
+                  data_format='channels_first'):
+    """multi_step with the weights saved after the training (cont) stage, path_model/hyperparams_name_cont.h5
+
+    mmn: scaler of the flows, the one the data was normalized with (e.g. the preprocessing pickle)
+    """
+    fname_param = os.path.join(path_model, '{}_cont.h5'.format(hyperparams_name))
+    model.load_weights(fname_param)
+    print(hyperparams_name)
+    return multi_step(model, X_test, Y_test, step, len_closeness, nb_flow=nb_flow, mmn=mmn, data_format=data_format)
@@ -0,0 +1,177 @@
+"""
+    tf.data input pipeline over an STDataset
+
+    The normalized base frames are uploaded once per session into a graph variable; the batches of
+    window indices go through shuffle -> batch -> parallel map (the gather of the C/P/T
+    and target frames, in the graph) -> prefetch, so that the next batches are prepared
+    by the tf.data threads while the model trains on the current one.
+
+Usage:
+    pipeline = STPipeline(dataset_train, batch_size=16, shuffle=True)
+    stall = StallTime(pipeline)
+    model.fit_generator(pipeline, steps_per_epoch=len(pipeline), epochs=nb_epoch,
+                        validation_data=STPipeline(dataset_val, batch_size=256), validation_steps=...,
+                        callbacks=[stall, ...], workers=0)
+
+    workers=0 runs the pipeline in the training loop: the time spent waiting for a batch
+    is then the stall time of the model, reported per epoch by StallTime.
+
+    The batches come back to NumPy (sess.run) and fit_generator feeds them into the graph again:
+    the window gather, shuffle and prefetch are off the training loop, but every batch is copied
+    out and back in, about 1 MB for a TaxiBJ batch of 16. Wiring the iterator into the model
+    (Input(tensor=...), target_tensors) would avoid it at the cost of one model per pipeline
+    (train, val) and of the fit_generator validation; benchmarks/bench_pipeline.py measures the
+    round trip against the training step.
+"""
+from __future__ import print_function
+import math
+import time
+import weakref
+import numpy as np
+import tensorflow as tf
+import keras.backend as K
+from keras.callbacks import Callback
+
+# session --> {frames key: (frames, variable)}, the frames being kept alive so that their id is not
+# reused; the entries go with their session (keras.backend.clear_session)
+_frames_variables = weakref.WeakKeyDictionary()
+
+
+def _frames_key(dataset):
+    """the frames of a dataset: the file of memory-mapped frames (star.cache), the same for every
+    load_dataset call, or the array itself; their dtype and the scaler applied to them
+    """
+    frames = getattr(dataset.frames, 'filename', None) or id(dataset.frames)
+    scaler = None if dataset.scaler is None else (type(dataset.scaler).__name__, dataset.scaler._min,
+                                                  dataset.scaler._max)
+    return frames, np.dtype(dataset.dtype or np.float32).str, scaler
+
+
+def frames_variable(dataset, sess=None):
+    """graph variable of the normalized base frames of dataset, uploaded once per session and shared
+    by the pipelines of the datasets over the same frames (e.g. the train and val splits, or the
+    datasets of successive load_dataset calls on the same cache)
+    """
+    sess = sess or K.get_session()
+    dtype = np.dtype(dataset.dtype or np.float32)
+    variables = _frames_variables.setdefault(sess, dict())
+    key = _frames_key(dataset)
+    if key not in variables:
+        frames = dataset.frames
+        if dataset.scaler is not None:
+            # raw counts: normalized once, at upload time
+            frames = dataset.scaler.transform(frames, dtype=dtype)
+        frames = np.asarray(frames, dtype=dtype)
+        with sess.graph.as_default():
+            # a variable initialized from a placeholder: the frames are not copied into the GraphDef
+            placeholder = tf.placeholder(frames.dtype, frames.shape)
+            variable = tf.Variable(placeholder, trainable=False, collections=[])
+            sess.run(variable.initializer, feed_dict={placeholder: frames})
+        variables[key] = (dataset.frames, variable)
+    return variables[key][1]
+
+
+class STPipeline(object):
+    """endless iterator of ([XCPT] (+ [meta]), Y) batches of an STDataset, as keras fit_generator expects
+
+    batch_size: samples per batch, the last batch of an epoch being smaller
+    shuffle: shuffle the samples every epoch, with a buffer of shuffle_buffer samples
+             (default: the whole dataset, a uniform shuffle)
+    num_parallel_calls: number of batches gathered concurrently
+    prefetch: number of batches prepared in advance
+    sess: session of the pipeline (default: the keras session); the pipelines of a session
+          share the frames variable of the datasets over the same frames (see frames_variable)
+    """
+
+    def __init__(self, dataset, batch_size=16, shuffle=False, shuffle_buffer=None, seed=None, num_parallel_calls=4,
+                 prefetch=2, sess=None):
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.sess = sess or K.get_session()
+        self.stall_time = 0.
+        self.nb_batch = 0
+
+        dtype = dataset.dtype or np.float32
+        self.frames = frames_variable(dataset, self.sess)
+        with self.sess.graph.as_default():
+            index = tf.constant(np.asarray(dataset.index))
+            target = tf.constant(np.asarray(dataset.target))
+            meta = tf.constant(np.asarray(dataset.meta, dtype=dtype)) if dataset.metadata_dim is not None else None
+
+            def gather(ids):
+                X = [self.stack(tf.gather(self.frames, tf.gather(index, ids)), dataset.data_format)]
+                if meta is not None:
+                    X.append(tf.gather(meta, ids))
+                Y = tf.gather(self.frames, tf.gather(target, ids))
+                if dataset.target.ndim > 1:
+                    Y = self.stack(Y, dataset.data_format)
+                elif dataset.data_format == 'channels_last':
+                    Y = tf.transpose(Y, (0, 2, 3, 1))
+                return tuple(X), Y
+
+            ids = tf.data.Dataset.range(len(dataset))
+            if shuffle:
+                ids = ids.shuffle(shuffle_buffer or len(dataset), seed=seed, reshuffle_each_iteration=True)
+            # batched before the repeat: every epoch is len(self) batches, reshuffled
+            pipeline = ids.batch(batch_size).repeat()
+            pipeline = pipeline.map(gather, num_parallel_calls=num_parallel_calls).prefetch(prefetch)
+            # initializable: a one-shot iterator cannot capture the frames variable
+            iterator = pipeline.make_initializable_iterator()
+            self.sess.run(iterator.initializer)
+            self.next_batch = iterator.get_next()
+
+    @staticmethod
+    def stack(frames, data_format='channels_first'):
+        """(nb_sample, nb_frame, nb_flow, h, w) --> (nb_sample, nb_frame * nb_flow, h, w) or NHWC,
+        in the channel order of STDataset.stack
+        """
+        shape = tf.shape(frames)
+        if data_format == 'channels_last':
+            frames = tf.transpose(frames, (0, 3, 4, 1, 2))
+            return tf.reshape(frames, tf.stack([shape[0], shape[3], shape[4], shape[1] * shape[2]]))
+        return tf.reshape(frames, tf.stack([shape[0], shape[1] * shape[2], shape[3], shape[4]]))
+
+    def __len__(self):
+        """number of batches per epoch"""
+        return int(math.ceil(len(self.dataset) / float(self.batch_size)))
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        ts = time.time()
+        X, Y = self.sess.run(self.next_batch)
+        self.stall_time += time.time() - ts
+        self.nb_batch += 1
+        return list(X), Y
+
+    next = __next__
+
+
+class StallTime(Callback):
+    """time (s) the training loop waited for the batches of pipeline during every epoch,
+    added to the epoch logs as `stall` and `stall_ratio` (of the epoch time, validation included);
+    put it before CSVLogger in the callbacks to have them logged
+    """
+
+    def __init__(self, pipeline, verbose=1):
+        super(StallTime, self).__init__()
+        self.pipeline = pipeline
+        self.verbose = verbose
+        self.history = []
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.stall_time, self.nb_batch = self.pipeline.stall_time, self.pipeline.nb_batch
+        self.ts = time.time()
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = time.time() - self.ts
+        stall = self.pipeline.stall_time - self.stall_time
+        nb_batch = self.pipeline.nb_batch - self.nb_batch
+        self.history.append(stall)
+        if logs is not None:
+            logs['stall'] = stall
+            logs['stall_ratio'] = stall / elapsed
+        if self.verbose:
+            print('epoch %i: input stall %.3f s (%.1f%% of %.1f s, %.2f ms/batch)'
+                  % (epoch + 1, stall, stall / elapsed * 100., elapsed, stall / max(nb_batch, 1) * 1000.))
@@ -0,0 +1,168 @@
+"""
+    post-training INT8 quantization (TFLite) and its accuracy / latency report
+
+Usage:
+    python -m star.quantize --weights MODEL/BJ/c3.p1.t1.resunit4.lr0.00015.iter0.cont.h5 \
+        --output MODEL/BJ/c3.p1.t1.resunit4 [--dataset TaxiBJ] [--nb_calibration 256] \
+        [--len_closeness 3 --len_period 1 --len_trend 1 --nb_residual_unit 4]
+
+    writes <output>.pb / .json / .tflite    the float model (see star.export), channels_last
+           <output>_int8.tflite / .json     weights and activations in INT8, the activation
+                                            ranges calibrated on a slice of the training windows
+    and prints, for the float and INT8 models, the RMSE (in the unit of the flows) on the
+    test set and the latency per batch.
+
+Requires TensorFlow 1.15 (TFLiteConverter.representative_dataset and the INT8 builtins), see star.export.
+"""
+from __future__ import print_function
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+from star.export import TFLiteModel, FrozenModel, _load_info, _tf
+
+
+def calibration_slice(X, nb_sample=256):
+    """nb_sample training windows evenly spaced over X (arrays as returned by load_data, or an
+    STDataset), so that every time of day and day of week is represented
+    """
+    n = len(X) if not isinstance(X, (list, tuple)) else len(X[0])
+    ids = np.unique(np.linspace(0, n - 1, min(nb_sample, n)).astype(np.int64))
+    if not isinstance(X, (list, tuple)):
+        return X.get_X(ids)
+    return [np.asarray(x[ids]) for x in X]
+
+
+def quantize(path, X_calibration, output=None, allow_float=False):
+    """INT8 TFLite model of the frozen graph path.pb (written by star.export.export)
+
+    X_calibration: inputs of the model, used to calibrate the ranges of the activations
+    output: path of the INT8 model, without extension (default: path_int8)
+    allow_float: keep in float the operators without an INT8 kernel instead of failing
+    """
+    tf = _tf()
+    output = output or path + '_int8'
+    info = _load_info(path)
+    shapes = dict((name, [1] + shape[1:]) for name, shape in zip(info['inputs'], info['input_shapes']))
+    converter = tf.lite.TFLiteConverter.from_frozen_graph(path + '.pb', info['inputs'], info['outputs'], shapes)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+    def representative_dataset():
+        # one sample at a time, the inputs in the order of info['inputs']
+        for i in range(len(X_calibration[0])):
+            yield [np.asarray(x[i:i + 1], dtype=np.float32) for x in X_calibration]
+
+    converter.representative_dataset = representative_dataset
+    if not allow_float:
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+    with open(output + '.tflite', 'wb') as f:
+        f.write(converter.convert())
+    with open(output + '.json', 'w') as f:
+        json.dump(dict(info, quantization='int8', nb_calibration=len(X_calibration[0])), f, indent=2,
+                  sort_keys=True)
+    print('%s.tflite written (calibrated on %i samples)' % (output, len(X_calibration[0])))
+    return output
+
+
+def latency(model, X, batch_size, nb_batch=50):
+    """median and p90 latency (ms) of model.predict on one batch of batch_size samples"""
+    n = len(X[0])
+    latencies = []
+    for i in range(nb_batch + 1):
+        start = (i * batch_size) % max(n - batch_size + 1, 1)
+        x = [v[start:start + batch_size] for v in X]
+        ts = time.time()
+        model.predict(x, batch_size=batch_size)
+        latencies.append((time.time() - ts) * 1000.)
+    p50, p90 = np.percentile(latencies[1:], [50, 90])  # without the first call
+    return p50, p90
+
+
+def report(models, X_test, Y_test=None, mmn=None, batch_sizes=(1, 16), T=48, data_format='channels_last',
+           nb_latency=256):
+    """RMSE (real unit) over the test set and latency per batch of every (name, model) in models
+
+    X_test, Y_test: arrays as returned by load_data, or an STDataset X_test (Y_test None),
+                    evaluated chunk by chunk
+    nb_latency: number of test samples the latency batches are taken from
+    """
+    from star import metrics
+    if Y_test is None:
+        X_latency = X_test.get_X(slice(0, nb_latency))
+    else:
+        X_latency = [x[:nb_latency] for x in X_test]
+    results = dict()
+    print('=' * 10)
+    for name, model in models:
+        score = metrics.evaluate(model, X_test, Y_test, mmn=mmn, T=T, batch_size=256, data_format=data_format)
+        results[name] = dict(rmse=score['rmse'], mae=score['mae'])
+        line = '%-8s rmse (real): %.4f, mae: %.4f' % (name, score['rmse'], score['mae'])
+        for batch_size in batch_sizes:
+            p50, p90 = latency(model, X_latency, batch_size)
+            results[name]['latency_%i' % batch_size] = (p50, p90)
+            line += ', batch %i: p50 %.2f ms, p90 %.2f ms' % (batch_size, p50, p90)
+        print(line)
+    ref = results[models[0][0]]
+    for name, _ in models[1:]:
+        print('%-8s rmse %+.2f%%, ' % (name, (results[name]['rmse'] / ref['rmse'] - 1.) * 100.) +
+              ', '.join('batch %i: x%.2f' % (b, ref['latency_%i' % b][0] / results[name]['latency_%i' % b][0])
+                        for b in batch_sizes))
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='INT8 quantization of a trained STAR model')
+    parser.add_argument('--weights', required=True)
+    parser.add_argument('--output', required=True, help='path of the artifacts, without extension')
+    parser.add_argument('--dataset', default='TaxiBJ', choices=['TaxiBJ', 'BikeNYC'])
+    parser.add_argument('--weights_format', default='channels_first', choices=['channels_first', 'channels_last'],
+                        help='layout the weights were trained in (data_format of exptTaxiBJ.py)')
+    parser.add_argument('--nb_calibration', type=int, default=256, help='number of training windows')
+    parser.add_argument('--allow_float', action='store_true', help='float fallback for the unsupported operators')
+    parser.add_argument('--batch_sizes', default='1,16')
+    parser.add_argument('--len_closeness', type=int, default=3)
+    parser.add_argument('--len_period', type=int, default=1)
+    parser.add_argument('--len_trend', type=int, default=1)
+    parser.add_argument('--nb_residual_unit', type=int, default=4)
+    parser.add_argument('--nb_filter', type=int, default=64)
+    parser.add_argument('--conv_type', default='conv', choices=['conv', 'separable'])
+    parser.add_argument('--unit_depth', type=int, default=2, help='number of convolutions per residual unit')
+    args = parser.parse_args(argv)
+
+    from star.export import build_model, export
+    # STDataset views over the base frames: only the calibration windows and the test chunks are gathered
+    if args.dataset == 'TaxiBJ':
+        from star import TaxiBJ
+        T, days_test = 48, 28
+        dataset_train_all, _, _, dataset_test, mmn, external_dim = TaxiBJ.load_dataset(
+            T=T, nb_flow=2, len_closeness=args.len_closeness, len_period=args.len_period, len_trend=args.len_trend,
+            len_test=T * days_test, len_val=2 * T * days_test, preprocess_name='preprocessing_bj.pkl',
+            meta_data=True, meteorol_data=False, holiday_data=False, data_format='channels_last')
+        map_height, map_width = 32, 32
+    else:
+        from star import BikeNYC
+        T, days_test = 24, 10
+        dataset_train_all, _, _, dataset_test, mmn, external_dim = BikeNYC.load_dataset(
+            T=T, nb_flow=2, len_closeness=args.len_closeness, len_period=args.len_period, len_trend=args.len_trend,
+            len_test=T * days_test, len_val=2 * T * days_test, preprocess_name='preprocessing_nyc.pkl',
+            meta_data=True, data_format='channels_last')
+        map_height, map_width = 16, 8
+
+    # TFLite runs NHWC convolutions only
+    model = build_model(args.weights, len_closeness=args.len_closeness, len_period=args.len_period,
+                        len_trend=args.len_trend, map_height=map_height, map_width=map_width,
+                        external_dim=external_dim, nb_residual_unit=args.nb_residual_unit,
+                        data_format='channels_last', nb_filter=args.nb_filter, conv_type=args.conv_type,
+                        unit_depth=args.unit_depth, weights_format=args.weights_format)
+    export(model, args.output, tflite=True, data_format='channels_last')
+    output = quantize(args.output, calibration_slice(dataset_train_all, args.nb_calibration),
+                      allow_float=args.allow_float)
+
+    models = [('float', FrozenModel(args.output)), ('tflite', TFLiteModel(args.output)),
+              ('int8', TFLiteModel(output))]
+    report(models, dataset_test, mmn=mmn, batch_sizes=[int(b) for b in args.batch_sizes.split(',')], T=T)
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
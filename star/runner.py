@@ -0,0 +1,130 @@
+"""
+    parallel runner of independent training runs (e.g. the repetitions of exptTaxiBJ.py)
+
+    Every worker process is pinned to its own slice of the CPU cores and its TensorFlow
+    session gets as many intra-op threads as the slice has cores, so that the concurrent
+    runs do not oversubscribe the machine. The runs read their base frames from the
+    star.cache frame store: built once, then memory-mapped read only by every process,
+    whose pages are shared.
+
+Usage (in a script, under if __name__ == '__main__'):
+    results = run_parallel(run, nb_run=10, nb_parallel=10, cores_per_run=6)
+    summary = aggregate(results)
+
+    run(i, **kwargs): a module-level function training the run i and returning a dict with
+    its test 'rmse' and optionally its 'multi_step' {step: RMSE}
+"""
+from __future__ import print_function
+import os
+import time
+import multiprocessing
+import numpy as np
+
+# set in every worker process by _init_worker
+_cores = None
+_inter_op_parallelism_threads = None
+
+
+def available_cores():
+    """the cores the calling process may run on"""
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(multiprocessing.cpu_count()))
+
+
+def core_slices(nb_slice, cores_per_run=None, cores=None):
+    """disjoint slices of cores, one per concurrent run
+
+    cores_per_run: default: the cores split evenly over nb_slice slices (at least 1 per slice)
+    return: min(nb_slice, len(cores) // cores_per_run) lists of cores_per_run cores
+    """
+    cores = available_cores() if cores is None else list(cores)
+    cores_per_run = cores_per_run or max(len(cores) // nb_slice, 1)
+    nb_slice = max(min(nb_slice, len(cores) // cores_per_run), 1)
+    return [cores[k * cores_per_run:(k + 1) * cores_per_run] for k in range(nb_slice)]
+
+
+def configure(cores, inter_op_parallelism_threads=2):
+    """pin the calling process to cores and return the matching tf.ConfigProto"""
+    import tensorflow as tf
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, cores)
+    return tf.ConfigProto(intra_op_parallelism_threads=len(cores),
+                          inter_op_parallelism_threads=inter_op_parallelism_threads)
+
+
+def _init_worker(slices, inter_op_parallelism_threads):
+    global _cores, _inter_op_parallelism_threads
+    _cores = slices.get()
+    _inter_op_parallelism_threads = inter_op_parallelism_threads
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, _cores)
+
+
+def _run(target, i, seed, kwargs, tf_session=True):
+    np.random.seed(seed + i)
+    if tf_session:
+        import tensorflow as tf
+        import keras.backend as K
+        # a fresh graph and session per run, the worker running several runs in turn
+        K.clear_session()
+        tf.set_random_seed(seed + i)
+        K.set_session(tf.Session(config=configure(_cores, _inter_op_parallelism_threads)))
+    ts = time.time()
+    print('run %i: pid %i, cores %s' % (i, os.getpid(), ','.join(str(c) for c in _cores)))
+    result = target(i, **kwargs)
+    print('run %i: %.1f seconds' % (i, time.time() - ts))
+    return result
+
+
+def run_parallel(target, nb_run, nb_parallel=None, cores_per_run=None, inter_op_parallelism_threads=2, seed=1337,
+                 kwargs=None, tf_session=True):
+    """target(i, **kwargs) for i in range(nb_run), in concurrent processes pinned to disjoint core slices
+
+    target: picklable (module-level) function; it runs in a fresh keras session, seeded with seed + i
+    tf_session: False for a target without keras (NumPy seeded only, tensorflow not imported)
+    nb_parallel: max number of concurrent runs (default: nb_run), at most the number of slices
+                 of cores_per_run cores
+    return: the results of the runs, in the order of i
+    """
+    slices = core_slices(min(nb_parallel or nb_run, nb_run), cores_per_run)
+    print('%i runs, %i at a time on %i cores each' % (nb_run, len(slices), len(slices[0])))
+    # spawn: tensorflow is not fork-safe
+    ctx = multiprocessing.get_context('spawn')
+    queue = ctx.Queue()
+    for cores in slices:
+        queue.put(cores)
+    # read by OpenMP/MKL when the worker processes load tensorflow
+    omp_num_threads = os.environ.get('OMP_NUM_THREADS')
+    os.environ['OMP_NUM_THREADS'] = str(len(slices[0]))
+    try:
+        pool = ctx.Pool(len(slices), initializer=_init_worker, initargs=(queue, inter_op_parallelism_threads))
+        try:
+            results = pool.starmap(_run, [(target, i, seed, kwargs or dict(), tf_session) for i in range(nb_run)],
+                                   chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    finally:
+        if omp_num_threads is None:
+            del os.environ['OMP_NUM_THREADS']
+        else:
+            os.environ['OMP_NUM_THREADS'] = omp_num_threads
+    return results
+
+
+def aggregate(results):
+    """mean and std over the runs of the test RMSE and of the RMSE of every multi_step step"""
+    rmse = np.asarray([result['rmse'] for result in results], dtype=np.float64)
+    summary = dict(rmse=rmse.tolist(), rmse_mean=float(rmse.mean()), rmse_std=float(rmse.std()))
+    print('=' * 10)
+    print('rmse over %i runs: %.6f +/- %.6f (min: %.6f, max: %.6f)'
+          % (len(rmse), rmse.mean(), rmse.std(), rmse.min(), rmse.max()))
+    steps = [result['multi_step'] for result in results if result.get('multi_step')]
+    if steps:
+        summary['multi_step'] = dict()
+        for k in sorted(steps[0]):
+            values = np.asarray([step[k] for step in steps])
+            summary['multi_step'][k] = (float(values.mean()), float(values.std()))
+            print('RMSE of step%d over %i runs: %.6f +/- %.6f' % (k, len(values), values.mean(), values.std()))
+    return summary
@@ -0,0 +1,298 @@
+"""
+    local prediction server: frame ingest and micro-batched forecasts over HTTP
+
+Usage:
+    python -m star.server --weights MODEL/BJ/c3.p1.t1.resunit4.lr0.00015.iter0.cont.h5 \
+        --preprocessing preprocessing_bj.pkl [--port 8000] [--len_closeness 3 --len_period 1 --len_trend 1]
+
+    POST /ingest   {"frame": [[[...]]], "timestamp": "2016040101"}   raw flows (nb_flow, h, w), negative
+                                                                      flows set to 0 as in training;
+                                                                      timestamp default: the next slot
+    POST /predict  {"timestamp": "2016040102", "external": [...]}     timestamp default: the next slot;
+                                                                      external: meta features after the
+                                                                      time features, if the model has any
+                   --> {"timestamp": ..., "forecast": [[[...]]], "latency_ms": ...}
+    GET  /stats    request count, latency percentiles (ms) and mean batch size
+
+    400: malformed request (JSON, timestamp, frame shape), 409: a dependency of the forecast
+    was not ingested.
+
+The forecast requests received while the model is busy are coalesced into one
+model.predict call (up to --max_batch samples, waiting at most --max_delay ms).
+"""
+from __future__ import print_function
+import sys
+import json
+import time
+import pickle
+import argparse
+import threading
+from collections import deque
+from queue import Queue, Empty
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+import numpy as np
+
+from star import slot2string
+from star.STMatrix import StreamingSTMatrix
+
+
+class LatencyStats(object):
+    """latencies (ms) of the last `maxlen` requests"""
+
+    def __init__(self, maxlen=10000):
+        self.latencies = deque(maxlen=maxlen)
+        self.batch_sizes = deque(maxlen=maxlen)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, latency):
+        with self.lock:
+            self.latencies.append(latency)
+            self.count += 1
+
+    def add_batch(self, batch_size):
+        with self.lock:
+            self.batch_sizes.append(batch_size)
+
+    def summary(self):
+        with self.lock:
+            latencies = np.asarray(self.latencies, dtype=np.float64)
+            batch_sizes = np.asarray(self.batch_sizes, dtype=np.float64)
+            count = self.count
+        summary = dict(count=count, mean_batch_size=float(batch_sizes.mean()) if len(batch_sizes) else 0.)
+        if len(latencies):
+            p50, p90, p99 = np.percentile(latencies, [50, 90, 99])
+            summary.update(mean=float(latencies.mean()), p50=float(p50), p90=float(p90), p99=float(p99),
+                           max=float(latencies.max()))
+        return summary
+
+
+class MicroBatcher(object):
+    """runs predict on micro-batches of the inputs submitted by concurrent threads
+
+    predict: function of a list of input arrays (model.predict)
+    max_batch: max number of samples per call
+    max_delay: max time (seconds) the first request of a batch waits for others
+    """
+
+    def __init__(self, predict, max_batch=32, max_delay=0.005, stats=None):
+        self.predict = predict
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self.stats = stats
+        self.queue = Queue()
+        self.thread = threading.Thread(target=self._run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, X):
+        """X: list of inputs of one sample (batch dimension of 1); blocks until its prediction is ready"""
+        request = dict(X=X, done=threading.Event())
+        self.queue.put(request)
+        request['done'].wait()
+        if 'error' in request:
+            raise request['error']
+        return request['y']
+
+    def _collect(self):
+        batch = [self.queue.get()]
+        deadline = time.time() + self.max_delay
+        while len(batch) < self.max_batch:
+            timeout = deadline - time.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self.queue.get(timeout=timeout))
+            except Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                X = [np.concatenate([request['X'][i] for request in batch])
+                     for i in range(len(batch[0]['X']))]
+                y = self.predict(X)
+                for i, request in enumerate(batch):
+                    request['y'] = y[i]
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            if self.stats is not None:
+                self.stats.add_batch(len(batch))
+            for request in batch:
+                request['done'].set()
+
+
+class PredictionServer(object):
+    """a trained model, its scaler and the ring buffer of the latest frames
+
+    model: with a predict method over [XCPT] (+ [meta]), e.g. a STAR model
+    mmn: the fitted MinMaxNormalization, applied to the ingested frames and
+         inverted on the forecasts
+    """
+
+    def __init__(self, model, mmn, frame_shape=(2, 32, 32), T=48, len_closeness=3, len_period=1, len_trend=1,
+                 meta_data=True, max_batch=32, max_delay=0.005):
+        self.mmn = mmn
+        self.meta_data = meta_data
+        self.stmatrix = StreamingSTMatrix(frame_shape, T=T, len_closeness=len_closeness, len_period=len_period,
+                                          len_trend=len_trend, scaler=mmn)
+        self.lock = threading.Lock()
+        self.stats = LatencyStats()
+        self.batcher = MicroBatcher(lambda X: model.predict(X, batch_size=len(X[0])),
+                                    max_batch=max_batch, max_delay=max_delay, stats=self.stats)
+
+    def ingest(self, frame, timestamp=None):
+        with self.lock:
+            self.stmatrix.append(frame, timestamp)
+            return self.stmatrix.last_slot
+
+    def extend(self, frames, timestamps):
+        with self.lock:
+            self.stmatrix.extend(frames, timestamps)
+
+    def predict(self, timestamp=None, external=None):
+        """denormalized forecast of `timestamp` (default: the next slot) and its slot number"""
+        ts = time.time()
+        with self.lock:
+            slot = self.stmatrix._slot(timestamp)
+            X = self.stmatrix.get_X(slot, meta_data=self.meta_data, external=external)
+        y = self.mmn.inverse_transform(self.batcher.submit(X))
+        self.stats.add((time.time() - ts) * 1000.)
+        return y, slot
+
+    def serve(self, host='127.0.0.1', port=8000, verbose=False):
+        httpd = ThreadingHTTPServer((host, port), RequestHandler)
+        httpd.app = self
+        httpd.verbose = verbose
+        print('serving on http://%s:%i' % httpd.server_address[:2])
+        return httpd
+
+
+class ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # headers and body are sent separately: avoid the delayed-ACK stall on keep-alive connections
+    disable_nagle_algorithm = True
+
+    def _reply(self, code, content):
+        body = json.dumps(content).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            self._reply(200, self.server.app.stats.summary())
+        else:
+            self._reply(404, dict(error='unknown path %s' % self.path))
+
+    def do_POST(self):
+        app = self.server.app
+        ts = time.time()
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8')) if length else dict()
+            if not isinstance(request, dict):
+                raise ValueError('a JSON object expected')
+            if self.path == '/ingest':
+                if 'frame' not in request:
+                    raise ValueError('missing field frame')
+                slot = app.ingest(np.asarray(request['frame']), request.get('timestamp'))
+                self._reply(200, dict(timestamp=slot2string([slot], app.stmatrix.T)[0].decode()))
+            elif self.path == '/predict':
+                y, slot = app.predict(request.get('timestamp'), request.get('external'))
+                self._reply(200, dict(timestamp=slot2string([slot], app.stmatrix.T)[0].decode(),
+                                      forecast=y.tolist(), latency_ms=(time.time() - ts) * 1000.))
+            else:
+                self._reply(404, dict(error='unknown path %s' % self.path))
+        except KeyError as e:
+            self._reply(409, dict(error='missing timeslot %s' % e))
+        except ValueError as e:
+            # malformed request: JSON, timestamp (see StreamingSTMatrix._slot) or frame shape
+            self._reply(400, dict(error=str(e)))
+        except Exception as e:
+            self._reply(500, dict(error='%s: %s' % (type(e).__name__, e)))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def load_model(weights, len_closeness=3, len_period=1, len_trend=1, nb_flow=2, map_height=32, map_width=32,
+               external_dim=8, nb_residual_unit=4, nb_filter=64, conv_type='conv', unit_depth=2,
+               weights_format='channels_first'):
+    """channels_first STAR model (the layout of StreamingSTMatrix.get_X) in inference mode, with the
+    weights saved by the experiment scripts in weights_format (see star.export.build_model)
+    """
+    # keras is only needed here
+    from star.export import build_model
+    model = build_model(weights, len_closeness=len_closeness, len_period=len_period, len_trend=len_trend,
+                        nb_flow=nb_flow, map_height=map_height, map_width=map_width, external_dim=external_dim,
+                        nb_residual_unit=nb_residual_unit, data_format='channels_first', nb_filter=nb_filter,
+                        conv_type=conv_type, unit_depth=unit_depth, weights_format=weights_format)
+    # keras builds the predict function lazily, in the graph of the calling thread:
+    # build it now, model.predict then runs in the batching thread
+    model._make_predict_function()
+    return model
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='STAR prediction server')
+    parser.add_argument('--weights', required=True)
+    parser.add_argument('--preprocessing', required=True, help='pickle of the fitted MinMaxNormalization')
+    parser.add_argument('--weights_format', default='channels_first', choices=['channels_first', 'channels_last'],
+                        help='layout the weights were trained in (data_format of exptTaxiBJ.py)')
+    parser.add_argument('--T', type=int, default=48)
+    parser.add_argument('--len_closeness', type=int, default=3)
+    parser.add_argument('--len_period', type=int, default=1)
+    parser.add_argument('--len_trend', type=int, default=1)
+    parser.add_argument('--nb_flow', type=int, default=2)
+    parser.add_argument('--map_height', type=int, default=32)
+    parser.add_argument('--map_width', type=int, default=32)
+    parser.add_argument('--external_dim', type=int, default=8, help='0 for a model without meta features')
+    parser.add_argument('--nb_residual_unit', type=int, default=4)
+    parser.add_argument('--nb_filter', type=int, default=64)
+    parser.add_argument('--conv_type', default='conv', choices=['conv', 'separable'])
+    parser.add_argument('--unit_depth', type=int, default=2, help='number of convolutions per residual unit')
+    parser.add_argument('--lookup', action='store_true',
+                        help='look up the external branch output of the 7 time feature vectors (star.lookup); '
+                             'ignored unless the external features are the time features only')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--max_batch', type=int, default=32)
+    parser.add_argument('--max_delay', type=float, default=5., help='ms')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args(argv)
+
+    mmn = pickle.load(open(args.preprocessing, 'rb'))
+    model = load_model(args.weights, len_closeness=args.len_closeness, len_period=args.len_period,
+                       len_trend=args.len_trend, nb_flow=args.nb_flow, map_height=args.map_height,
+                       map_width=args.map_width, external_dim=args.external_dim or None,
+                       nb_residual_unit=args.nb_residual_unit, nb_filter=args.nb_filter,
+                       conv_type=args.conv_type, unit_depth=args.unit_depth, weights_format=args.weights_format)
+    if args.lookup:
+        from star.lookup import ExternalLookup
+        model = ExternalLookup(model)
+    app = PredictionServer(model, mmn, frame_shape=(args.nb_flow, args.map_height, args.map_width), T=args.T,
+                           len_closeness=args.len_closeness, len_period=args.len_period, len_trend=args.len_trend,
+                           meta_data=args.external_dim > 0, max_batch=args.max_batch,
+                           max_delay=args.max_delay / 1000.)
+    httpd = app.serve(args.host, args.port, verbose=args.verbose)
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    httpd.server_close()
+
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
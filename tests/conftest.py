@@ -0,0 +1,61 @@
+from __future__ import print_function
+import os
+import sys
+from datetime import datetime, timedelta
+import numpy as np
+import h5py
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+
+def _timestamps(rng, start, nb_day, T, missing_ratio):
+    timestamps = []
+    for d in range(nb_day):
+        day = (start + timedelta(days=d)).strftime('%Y%m%d')
+        timestamps += [('%s%02i' % (day, slot)).encode('ascii') for slot in range(1, T + 1)]
+    keep = rng.rand(len(timestamps)) >= missing_ratio
+    return [t for t, k in zip(timestamps, keep) if k]
+
+
+@pytest.fixture(scope='session')
+def datapath(tmp_path_factory):
+    """synthetic TaxiBJ (4 years of 12 days) and BikeNYC (40 days) flow files"""
+    path = tmp_path_factory.mktemp('data')
+    rng = np.random.RandomState(0)
+    os.makedirs(str(path / 'TaxiBJ'))
+    os.makedirs(str(path / 'BikeNYC'))
+    for year in range(13, 17):
+        timestamps = _timestamps(rng, datetime(2000 + year, 3, 1), 12, 48, 0.002)
+        with h5py.File(str(path / 'TaxiBJ' / ('BJ%d_M32x32_T30_InOut.h5' % year)), 'w') as f:
+            f['data'] = rng.randint(-2, 1200, size=(len(timestamps), 2, 32, 32)).astype(np.float64)
+            f['date'] = np.array(timestamps)
+    timestamps = _timestamps(rng, datetime(2014, 4, 1), 40, 24, 0.003)
+    with h5py.File(str(path / 'BikeNYC' / 'NYC14_M16x8_T60_NewEnd.h5'), 'w') as f:
+        f['data'] = rng.randint(0, 300, size=(len(timestamps), 2, 16, 8)).astype(np.float64)
+        f['date'] = np.array(timestamps)
+    return str(path)
+
+
+@pytest.fixture
+def data(datapath, tmp_path, monkeypatch):
+    """DATAPATH of the synthetic files, the preprocessing pickles being written in tmp_path"""
+    from star import TaxiBJ, BikeNYC
+    monkeypatch.setattr(TaxiBJ, 'DATAPATH', datapath)
+    monkeypatch.setattr(BikeNYC, 'DATAPATH', datapath)
+    monkeypatch.chdir(tmp_path)
+    return datapath
+
+
+def bj_kwargs(**kwargs):
+    """load_data/load_dataset arguments of a small TaxiBJ setting (time features only)"""
+    return dict(dict(T=48, nb_flow=2, len_closeness=3, len_period=1, len_trend=1, len_test=48 * 2, len_val=48 * 4,
+                     meta_data=True, meteorol_data=False, holiday_data=False), **kwargs)
+
+
+def keras_tf1():
+    """skip the test unless keras 2 runs on TensorFlow 1 (the versions the models are written for)"""
+    tf = pytest.importorskip('tensorflow')
+    if not tf.__version__.startswith('1.'):
+        pytest.skip('TensorFlow 1.x required, %s installed' % tf.__version__)
+    return pytest.importorskip('keras')
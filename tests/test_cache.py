@@ -0,0 +1,25 @@
+import os
+import pickle
+import numpy as np
+
+from conftest import bj_kwargs
+from star import TaxiBJ, BikeNYC
+
+
+def test_preprocessing_written_on_cache_hit(data, tmp_path):
+    cache_dir = str(tmp_path / 'CACHE')
+    miss = TaxiBJ.load_dataset(cache_dir=cache_dir, **bj_kwargs())
+    fitted = pickle.load(open('preprocessing_bj.pkl', 'rb'))
+    os.remove('preprocessing_bj.pkl')
+
+    hit = TaxiBJ.load_dataset(cache_dir=cache_dir, **bj_kwargs())
+    mmn = pickle.load(open('preprocessing_bj.pkl', 'rb'))
+    assert type(mmn) is type(fitted) and (mmn._min, mmn._max) == (fitted._min, fitted._max)
+    assert np.array_equal(hit[3].materialize()[1], miss[3].materialize()[1])
+
+    kwargs = dict(T=24, nb_flow=2, len_closeness=3, len_period=1, len_trend=1, len_test=24 * 4, len_val=24 * 8,
+                  preprocess_name='preprocessing_nyc.pkl', cache_dir=cache_dir)
+    BikeNYC.load_dataset(**kwargs)
+    os.remove('preprocessing_nyc.pkl')
+    BikeNYC.load_dataset(**kwargs)
+    assert os.path.exists('preprocessing_nyc.pkl')
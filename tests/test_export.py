@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from conftest import keras_tf1
+
+
+def test_frozen_graph_matches_keras(tmp_path):
+    K = keras_tf1().backend
+    from star import export
+    K.clear_session()
+    try:
+        rng = np.random.RandomState(0)
+        # a map size other than 32x32: built from --map_height/--map_width
+        model = export.build_model(len_closeness=2, len_period=1, len_trend=0, map_height=8, map_width=4,
+                                   external_dim=5, nb_residual_unit=1, nb_filter=8)
+        assert model.input_shape[0] == (None, 2 * (2 + 2), 8, 4)
+        X = [rng.uniform(-1, 1, (10, 8, 8, 4)).astype(np.float32), rng.uniform(size=(10, 5)).astype(np.float32)]
+        expected = model.predict(X)
+
+        path = str(tmp_path / 'star')
+        info = export.export(model, path)
+        assert info['input_shapes'] == [[None, 8, 8, 4], [None, 5]]
+        frozen = export.load(path + '.pb')
+        np.testing.assert_allclose(frozen.predict(X, batch_size=4), expected, atol=1e-5)
+        frozen.close()
+    finally:
+        K.clear_session()
+        K.set_learning_phase(1)
+
+
+@pytest.mark.parametrize('data_format', ['channels_last', 'channels_first'])
+def test_channels_last_weights(tmp_path, data_format):
+    """weights of a channels_last model, exported in both layouts"""
+    K = keras_tf1().backend
+    from star import export
+    from star.model import STAR
+    kwargs = dict(c_conf=(2, 2, 8, 4), p_conf=(1, 2, 8, 4), t_conf=None, external_dim=5, nb_residual_unit=1,
+                  nb_filter=8)
+    rng = np.random.RandomState(0)
+    X = [rng.uniform(-1, 1, (10, 8, 4, 8)).astype(np.float32), rng.uniform(size=(10, 5)).astype(np.float32)]
+    weights = str(tmp_path / 'weights.channels_last.h5')
+    K.clear_session()
+    try:
+        trained = STAR(data_format='channels_last', **kwargs)
+        expected = trained.predict(X)
+        trained.save_weights(weights)
+        K.clear_session()
+
+        model = export.build_model(weights, len_closeness=2, len_period=1, len_trend=0, map_height=8, map_width=4,
+                                   external_dim=5, nb_residual_unit=1, nb_filter=8, data_format=data_format,
+                                   weights_format='channels_last')
+        if data_format == 'channels_first':
+            X = [np.moveaxis(X[0], -1, 1), X[1]]
+            expected = np.moveaxis(expected, -1, 1)
+        np.testing.assert_allclose(model.predict(X), expected, atol=1e-5)
+        path = str(tmp_path / 'star')
+        export.export(model, path, data_format=data_format)
+        frozen = export.load(path)
+        np.testing.assert_allclose(frozen.predict(X), expected, atol=1e-5)
+        frozen.close()
+    finally:
+        K.clear_session()
+        K.set_learning_phase(1)
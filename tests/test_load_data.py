@@ -0,0 +1,46 @@
+import numpy as np
+
+from conftest import bj_kwargs
+from star import TaxiBJ, BikeNYC
+
+
+def test_taxibj_splits_are_views(data):
+    X_train_all, Y_train_all, X_train, Y_train, X_val, Y_val, X_test, Y_test = TaxiBJ.load_data(**bj_kwargs())[:8]
+    for X_all, X, X_v in zip(X_train_all, X_train, X_val):
+        assert np.shares_memory(X, X_all) and np.shares_memory(X_v, X_all)
+        assert len(X) + len(X_v) == len(X_all)
+    assert np.shares_memory(Y_train, Y_train_all) and np.shares_memory(Y_val, Y_train_all)
+
+    train_all, train, val, test = TaxiBJ.load_dataset(**bj_kwargs())[:4]
+    for dataset, (X, Y) in [(train, (X_train, Y_train)), (val, (X_val, Y_val)), (test, (X_test, Y_test))]:
+        X_ref, Y_ref = dataset.materialize()
+        assert all(np.array_equal(x, x_ref) for x, x_ref in zip(X, X_ref))
+        assert np.array_equal(Y, Y_ref)
+
+
+def test_bikenyc_splits_are_views(data):
+    X_train_all, Y_train_all, X_train, Y_train, X_val, Y_val = BikeNYC.load_data(
+        T=24, nb_flow=2, len_closeness=3, len_period=1, len_trend=1, len_test=24 * 4, len_val=24 * 8)[:6]
+    assert np.shares_memory(X_train[0], X_train_all[0]) and np.shares_memory(X_val[0], X_train_all[0])
+    assert len(Y_train) + len(Y_val) == len(Y_train_all)
+
+
+def test_taxibj_load_frames_closes_files(data, monkeypatch):
+    import os
+    from star import H5Array
+    # every H5Array created while loading, kept alive to check its handle
+    arrays = []
+    init = H5Array.__init__
+
+    def recording_init(self, *args, **kwargs):
+        init(self, *args, **kwargs)
+        arrays.append(self)
+    monkeypatch.setattr(H5Array, '__init__', recording_init)
+
+    fnames = [os.path.join(data, 'TaxiBJ', 'BJ%d_M32x32_T30_InOut.h5' % year) for year in range(13, 17)]
+    frames, timestamps_all, mmn = TaxiBJ.load_frames(fnames, len_test=96)
+    assert len(arrays) >= len(fnames) and all(array._file is None for array in arrays)
+    # the per-year stages in worker processes give the same frames
+    frames_workers, _, mmn_workers = TaxiBJ.load_frames(fnames, len_test=96, workers=2)
+    np.testing.assert_array_equal(frames_workers, frames)
+    assert (mmn_workers._min, mmn_workers._max) == (mmn._min, mmn._max)
@@ -0,0 +1,59 @@
+import numpy as np
+import pytest
+
+from conftest import keras_tf1
+
+
+def test_lookup_matches_model():
+    K = keras_tf1().backend
+    from star.model import STAR
+    from star.lookup import ExternalLookup, time_features_domain
+    K.clear_session()
+    try:
+        rng = np.random.RandomState(0)
+        model = STAR(c_conf=(2, 2, 8, 4), p_conf=(1, 2, 8, 4), t_conf=None, external_dim=8, nb_residual_unit=1,
+                     nb_filter=8)
+        XCPT = rng.uniform(-1, 1, (20, 2 * (2 + 2), 8, 4)).astype(np.float32)
+        hits = time_features_domain()[rng.randint(0, 7, 20)]
+        misses = rng.uniform(size=(20, 8)).astype(np.float32)
+
+        lookup = ExternalLookup(model)
+        np.testing.assert_allclose(lookup.predict([XCPT, hits]), model.predict([XCPT, hits]), atol=1e-6)
+        assert lookup.nb_fallback == 0
+        # vectors missing from the table go through the dense branch
+        meta = np.concatenate([hits[:10], misses[10:]])
+        np.testing.assert_allclose(lookup.predict([XCPT, meta]), model.predict([XCPT, meta]), atol=1e-6)
+        assert lookup.nb_fallback == 10
+        # split again, the layers having been called twice
+        np.testing.assert_allclose(ExternalLookup(model).predict([XCPT, hits]), model.predict([XCPT, hits]),
+                                   atol=1e-6)
+    finally:
+        K.clear_session()
+
+
+def test_lookup_other_external_features():
+    """time features, holiday flag and a weather class: 10 external features"""
+    K = keras_tf1().backend
+    from star.model import STAR
+    from star.lookup import ExternalLookup, time_features_domain
+    K.clear_session()
+    try:
+        rng = np.random.RandomState(0)
+        model = STAR(c_conf=(2, 2, 8, 4), p_conf=(1, 2, 8, 4), t_conf=None, external_dim=10, nb_residual_unit=1,
+                     nb_filter=8)
+        XCPT = rng.uniform(-1, 1, (30, 2 * (2 + 2), 8, 4)).astype(np.float32)
+        meta = np.hstack([time_features_domain()[rng.randint(0, 7, 30)],
+                          rng.randint(0, 2, (30, 1)), rng.randint(0, 3, (30, 1))]).astype(np.float32)
+
+        # the default domain is that of the time features only: plain model
+        lookup = ExternalLookup(model)
+        assert lookup.table is None
+        np.testing.assert_allclose(lookup.predict([XCPT, meta]), model.predict([XCPT, meta]), atol=1e-6)
+        # the domain of the training meta
+        lookup = ExternalLookup(model, meta=np.unique(meta[:20], axis=0))
+        assert lookup.table is not None
+        np.testing.assert_allclose(lookup.predict([XCPT, meta]), model.predict([XCPT, meta]), atol=1e-6)
+        with pytest.raises(ValueError):
+            ExternalLookup(model, meta=time_features_domain())
+    finally:
+        K.clear_session()
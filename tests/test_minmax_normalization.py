@@ -0,0 +1,26 @@
+import pickle
+import numpy as np
+import pytest
+
+from star.minmax_normalization import MinMaxNormalization, MinMaxNormalization_01
+
+
+@pytest.mark.parametrize('Scaler, low', [(MinMaxNormalization, -1.), (MinMaxNormalization_01, 0.)])
+def test_transform_paths_agree(Scaler, low):
+    rng = np.random.RandomState(0)
+    counts = rng.randint(3, 1300, size=(20, 2, 4, 4)).astype(np.uint16)
+    mmn = Scaler()
+    mmn.partial_fit(counts[:10]).partial_fit(counts[10:])
+    assert type(mmn._min) is float and type(mmn._max) is float
+    assert (mmn._min, mmn._max) == (float(counts.min()), float(counts.max()))
+
+    expected = mmn.transform(counts.astype(np.float64))
+    assert expected.min() == low and expected.max() == 1.
+    np.testing.assert_allclose(mmn.transform(counts, dtype=np.float32), expected, atol=1e-6)
+    out = counts.astype(np.float64)
+    assert mmn.transform(out, out=out) is out
+    np.testing.assert_array_equal(out, expected)
+    np.testing.assert_allclose(mmn.inverse_transform(expected), counts)
+
+    restored = pickle.loads(pickle.dumps(mmn))
+    assert type(restored) is Scaler and restored._max == mmn._max
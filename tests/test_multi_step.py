@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+from star.minmax_normalization import MinMaxNormalization
+from star.multi_step import multi_step, multi_step_2D
+
+
+class Persistence(object):
+    """predicts the most recent closeness frame"""
+
+    def __init__(self, nb_flow):
+        self.nb_flow = nb_flow
+        self.weights = None
+
+    def load_weights(self, fname):
+        self.weights = fname
+
+    def predict(self, X, batch_size=32):
+        return X[0][:, :self.nb_flow].copy()
+
+
+@pytest.mark.parametrize('len_closeness', [1, 3])
+def test_multi_step_2D(len_closeness, tmp_path):
+    rng = np.random.RandomState(0)
+    nb_flow, nb_sample, step = 2, 20, 4
+    X_test = [rng.uniform(-1, 1, (nb_sample, (len_closeness + 2) * nb_flow, 4, 4)), rng.uniform(size=(nb_sample, 8))]
+    Y_test = rng.uniform(-1, 1, (nb_sample, nb_flow, 4, 4))
+    mmn = MinMaxNormalization()
+    mmn._min, mmn._max = 0., 500.
+    model = Persistence(nb_flow)
+
+    rmse = multi_step_2D(model, str(tmp_path), 'c%i.p1.t1' % len_closeness, X_test, Y_test, step,
+                         len_closeness, mmn, nb_flow=nb_flow)
+    assert model.weights == str(tmp_path / ('c%i.p1.t1_cont.h5' % len_closeness))
+    assert rmse == multi_step(model, X_test, Y_test, step, len_closeness, nb_flow=nb_flow, mmn=mmn)
+    # persistence: every step forecasts the first closeness frame of the first sample of the roll
+    for i in range(step):
+        error = X_test[0][:nb_sample - i, :nb_flow] - Y_test[i:]
+        assert rmse[i] == pytest.approx(250. * np.sqrt(np.mean(error ** 2)))
@@ -0,0 +1,53 @@
+import numpy as np
+import pytest
+
+from conftest import bj_kwargs, keras_tf1
+from star import TaxiBJ
+
+
+@pytest.mark.parametrize('kwargs', [dict(), dict(counts=True, data_format='channels_last')])
+def test_pipeline_batches(data, kwargs):
+    K = keras_tf1().backend
+    from star.pipeline import STPipeline
+    _, dataset_train, dataset_val, _, _, _ = TaxiBJ.load_dataset(**bj_kwargs(**kwargs))
+    K.clear_session()
+    try:
+        train = STPipeline(dataset_train, batch_size=16)
+        val = STPipeline(dataset_val, batch_size=64)
+        # one upload of the frames per session
+        assert train.frames is val.frames
+        for pipeline, dataset in [(train, dataset_train), (val, dataset_val)]:
+            # a few batches, into the next epoch
+            for k in range(len(pipeline) + 1 if len(pipeline) < 3 else 3):
+                start = (k % len(pipeline)) * pipeline.batch_size
+                X, Y = next(pipeline)
+                X_expected, Y_expected = dataset.batch(np.arange(start, min(start + pipeline.batch_size,
+                                                                            len(dataset))))
+                assert len(X) == len(X_expected)
+                for x, expected in zip(X, X_expected):
+                    np.testing.assert_allclose(x, expected, atol=1e-6)
+                np.testing.assert_allclose(Y, Y_expected, atol=1e-6)
+        assert train.nb_batch == 3
+    finally:
+        K.clear_session()
+
+
+def test_frames_variable_per_cache_file(data, tmp_path):
+    K = keras_tf1().backend
+    from star.pipeline import frames_variable, _frames_variables
+    kwargs = bj_kwargs(cache_dir=str(tmp_path / 'CACHE'))
+    TaxiBJ.load_dataset(**kwargs)
+    K.clear_session()
+    try:
+        # two load_dataset calls on the same cache: one upload
+        first = TaxiBJ.load_dataset(**kwargs)[1]
+        second = TaxiBJ.load_dataset(**kwargs)[2]
+        assert first.frames is not second.frames
+        assert frames_variable(first) is frames_variable(second)
+        assert len(_frames_variables[K.get_session()]) == 1
+        sess = K.get_session()
+        K.clear_session()
+        assert frames_variable(first) is not None and len(_frames_variables[K.get_session()]) == 1
+        del sess
+    finally:
+        K.clear_session()
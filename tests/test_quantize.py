@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+
+from conftest import bj_kwargs, keras_tf1
+from star import TaxiBJ
+from star.quantize import calibration_slice, report
+
+
+class Persistence(object):
+    """NHWC model predicting the most recent closeness frame"""
+
+    def predict(self, X, batch_size=32):
+        return np.array(X[0][..., :2])
+
+
+def test_calibration_slice(data):
+    dataset = TaxiBJ.load_dataset(data_format='channels_last', **bj_kwargs())[0]
+    X_calibration = calibration_slice(dataset, 16)
+    assert len(X_calibration[0]) == 16 and X_calibration[0].shape[1:] == dataset.shape[1:]
+    for x, expected in zip(X_calibration, calibration_slice(dataset.materialize()[0], 16)):
+        np.testing.assert_array_equal(x, expected)
+
+
+def test_report(data):
+    dataset_test, mmn = TaxiBJ.load_dataset(data_format='channels_last', **bj_kwargs())[3:5]
+    X_test, Y_test = dataset_test.materialize()
+    results = report([('a', Persistence()), ('b', Persistence())], dataset_test, mmn=mmn, batch_sizes=(1, 4),
+                     nb_latency=8)
+
+    error = mmn.inverse_transform(X_test[0][..., :2]) - mmn.inverse_transform(Y_test)
+    for name in 'ab':
+        assert results[name]['rmse'] == pytest.approx(np.sqrt(np.mean(error ** 2)), rel=1e-5)
+        assert results[name]['mae'] == pytest.approx(np.mean(np.abs(error)), rel=1e-5)
+        assert sorted(results[name]) == ['latency_1', 'latency_4', 'mae', 'rmse']
+    # the arrays of load_data give the same metrics
+    assert report([('a', Persistence())], X_test, Y_test, mmn, batch_sizes=(1, ))['a']['rmse'] == \
+        pytest.approx(results['a']['rmse'])
+
+
+def test_quantize_tiny_model(data, tmp_path):
+    K = keras_tf1().backend
+    import tensorflow as tf
+    from star.export import build_model, export, FrozenModel, TFLiteModel
+    from star.quantize import quantize
+    dataset_train_all, _, _, dataset_test, mmn, external_dim = TaxiBJ.load_dataset(
+        data_format='channels_last', **bj_kwargs())
+    K.clear_session()
+    try:
+        model = build_model(external_dim=external_dim, nb_residual_unit=1, nb_filter=8, data_format='channels_last')
+        path = str(tmp_path / 'star')
+        export(model, path, data_format='channels_last')
+        models = [('keras', model), ('float', FrozenModel(path))]
+        if hasattr(tf.lite, 'Optimize'):
+            output = quantize(path, calibration_slice(dataset_train_all, 32), allow_float=True)
+            models.append(('int8', TFLiteModel(output)))
+        results = report(models, dataset_test, mmn=mmn, batch_sizes=(1, ), nb_latency=8)
+        assert results['float']['rmse'] == pytest.approx(results['keras']['rmse'], rel=1e-4)
+        if 'int8' in results:
+            assert results['int8']['rmse'] == pytest.approx(results['keras']['rmse'], rel=0.1)
+    finally:
+        K.clear_session()
+        K.set_learning_phase(1)
@@ -0,0 +1,53 @@
+import os
+import queue
+import numpy as np
+import pytest
+
+from star import runner
+
+
+def fake_run(i, offset=0.):
+    """a run without keras: its test 'RMSE', process and cores"""
+    return dict(rmse=i + offset, multi_step={0: float(i), 1: 2. * i}, seed=int(np.random.randint(1 << 30)),
+                pid=os.getpid(), cores=runner.available_cores())
+
+
+def test_core_slices():
+    assert runner.core_slices(3, cores=range(8)) == [[0, 1], [2, 3], [4, 5]]
+    assert runner.core_slices(2, cores_per_run=3, cores=range(8)) == [[0, 1, 2], [3, 4, 5]]
+    # at most len(cores) // cores_per_run slices, at least one
+    assert runner.core_slices(4, cores_per_run=3, cores=range(8)) == [[0, 1, 2], [3, 4, 5]]
+    assert runner.core_slices(16, cores=range(4)) == [[0], [1], [2], [3]]
+    assert runner.core_slices(2, cores_per_run=6, cores=range(4)) == [[0, 1, 2, 3]]
+
+
+@pytest.mark.skipif(not hasattr(os, 'sched_setaffinity'), reason='no CPU affinity on this platform')
+def test_init_worker_affinity():
+    cores = runner.available_cores()
+    slices = queue.Queue()
+    slices.put(cores[-1:])
+    try:
+        runner._init_worker(slices, 3)
+        assert runner._cores == cores[-1:] and runner._inter_op_parallelism_threads == 3
+        assert runner.available_cores() == cores[-1:]
+    finally:
+        os.sched_setaffinity(0, cores)
+        runner._cores = runner._inter_op_parallelism_threads = None
+
+
+def test_run_parallel_dry_run():
+    nb_slice = min(len(runner.available_cores()), 2)
+    results = runner.run_parallel(fake_run, 4, nb_parallel=2, cores_per_run=1, kwargs=dict(offset=.5),
+                                  tf_session=False)
+    assert [result['rmse'] for result in results] == [.5, 1.5, 2.5, 3.5]
+    # seeded with seed + i
+    assert [result['seed'] for result in results] == [int(np.random.RandomState(1337 + i).randint(1 << 30))
+                                                      for i in range(4)]
+    # every worker pinned to one core, the workers to distinct cores
+    workers = dict((result['pid'], tuple(result['cores'])) for result in results)
+    assert 1 <= len(workers) <= nb_slice
+    assert all(len(cores) == 1 for cores in workers.values())
+    assert len(set(workers.values())) == len(workers)
+
+    summary = runner.aggregate(results)
+    assert summary['rmse_mean'] == pytest.approx(2.) and summary['multi_step'][1][0] == pytest.approx(3.)
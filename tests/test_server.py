@@ -0,0 +1,139 @@
+import json
+import threading
+import time
+from http.client import HTTPConnection
+import numpy as np
+import pytest
+
+from star import slot2string
+from star.minmax_normalization import MinMaxNormalization
+from star.server import MicroBatcher, PredictionServer
+
+T = 4
+
+
+class Recorder(object):
+    """predict: the sum of the first input over the sample axes, recording the batch sizes"""
+
+    def __init__(self, delay=0.):
+        self.delay = delay
+        self.batch_sizes = []
+
+    def __call__(self, X):
+        time.sleep(self.delay)
+        self.batch_sizes.append(len(X[0]))
+        return X[0].reshape(len(X[0]), -1).sum(axis=1)
+
+
+def submit_all(batcher, values):
+    results = dict()
+
+    def submit(value):
+        results[value] = batcher.submit([np.full((1, 3), value, dtype=np.float64)])
+    threads = [threading.Thread(target=submit, args=(value, )) for value in values]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5.)
+    return results
+
+
+def test_micro_batches():
+    # the first call keeps the model busy while the other requests queue up
+    predict = Recorder(delay=0.05)
+    batcher = MicroBatcher(predict, max_batch=4, max_delay=0.05)
+    results = submit_all(batcher, range(10))
+    # every request gets its own prediction
+    assert results == dict((value, 3. * value) for value in range(10))
+    assert sum(predict.batch_sizes) == 10 and max(predict.batch_sizes) <= 4
+    assert len(predict.batch_sizes) < 10
+
+
+def test_max_delay():
+    predict = Recorder()
+    batcher = MicroBatcher(predict, max_batch=32, max_delay=0.02)
+    ts = time.time()
+    assert batcher.submit([np.ones((1, 3))]) == 3.
+    # a lone request waits for max_delay at most, not for a full batch
+    assert time.time() - ts < 1.
+    assert predict.batch_sizes == [1]
+
+
+def test_errors_reach_every_request():
+    def fail(X):
+        raise RuntimeError('model failure')
+    batcher = MicroBatcher(fail, max_delay=0.01)
+    with pytest.raises(RuntimeError):
+        batcher.submit([np.ones((1, 3))])
+
+
+class Persistence(object):
+    """predicts the most recent closeness frame"""
+
+    def predict(self, X, batch_size=32):
+        return np.array(X[0][:, :2])
+
+
+@pytest.fixture
+def server():
+    mmn = MinMaxNormalization()
+    mmn._min, mmn._max = 0., 100.
+    app = PredictionServer(Persistence(), mmn, frame_shape=(2, 3, 2), T=T, len_closeness=2, len_period=0,
+                           len_trend=0, max_delay=0.001)
+    httpd = app.serve(port=0)
+    thread = threading.Thread(target=httpd.serve_forever, kwargs=dict(poll_interval=0.01))
+    thread.daemon = True
+    thread.start()
+    yield app, HTTPConnection(*httpd.server_address[:2], timeout=10)
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def post(connection, path, content):
+    body = content if isinstance(content, bytes) else json.dumps(content).encode('utf-8')
+    connection.request('POST', path, body, {'Content-Type': 'application/json'})
+    response = connection.getresponse()
+    return response.status, json.loads(response.read().decode('utf-8'))
+
+
+def test_ingest_and_predict(server):
+    app, connection = server
+    timestamps = [t.decode() for t in slot2string(16436 * T + np.arange(3), T)]
+    frame = np.full((2, 3, 2), 40.)
+    frame[0, 0, 0] = -5.
+    assert post(connection, '/ingest', dict(frame=frame.tolist(), timestamp=timestamps[0])) == \
+        (200, dict(timestamp=timestamps[0]))
+    # a dependency is missing
+    assert post(connection, '/predict', dict())[0] == 409
+    assert post(connection, '/ingest', dict(frame=frame.tolist()))[0] == 200
+    status, content = post(connection, '/predict', dict())
+    assert status == 200 and content['timestamp'] == timestamps[2]
+    # the negative flow was set to 0 at ingest time, as in the training frames
+    expected = frame.copy()
+    expected[0, 0, 0] = 0.
+    np.testing.assert_allclose(content['forecast'], expected, atol=1e-4)
+
+
+@pytest.mark.parametrize('request_body', [
+    dict(frame=np.zeros((2, 3, 2)).tolist(), timestamp='2016-04-01'),
+    dict(frame=np.zeros((2, 3, 2)).tolist(), timestamp='2016133101'),
+    dict(frame=np.zeros((2, 3, 2)).tolist(), timestamp='2016040109'),
+    dict(frame=np.zeros((2, 3, 2)).tolist(), timestamp=-3),
+    dict(frame=np.zeros((2, 3, 2)).tolist(), timestamp=[2016040101]),
+    dict(frame=np.zeros((3, 3)).tolist()),
+    dict(timestamp='2016040101'),
+    [1, 2],
+    b'{"frame": ',
+])
+def test_malformed_ingest(server, request_body):
+    app, connection = server
+    status, content = post(connection, '/ingest', request_body)
+    assert status == 400 and content['error']
+    assert app.stmatrix.last_slot == -1
+
+
+def test_malformed_predict(server):
+    app, connection = server
+    for timestamp in ['20160401', '2016040100', 'x' * 10]:
+        status, content = post(connection, '/predict', dict(timestamp=timestamp))
+        assert status == 400 and 'timestamp' in content['error']
@@ -0,0 +1,14 @@
+import os
+import numpy as np
+
+from star import load_stdata
+
+
+def test_load_stdata(datapath):
+    fname = os.path.join(datapath, 'BikeNYC', 'NYC14_M16x8_T60_NewEnd.h5')
+    data, timestamps = load_stdata(fname)
+    lazy, lazy_timestamps = load_stdata(fname, lazy=True)
+    assert isinstance(data, np.ndarray) and data.shape == lazy.shape
+    np.testing.assert_array_equal(data, lazy[:])
+    np.testing.assert_array_equal(timestamps, lazy_timestamps)
+    lazy.close()
@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+
+from star import slot2string
+from star.STMatrix import STMatrix, StreamingSTMatrix
+
+T = 4
+CONFIG = dict(len_closeness=3, len_period=1, len_trend=1)
+
+
+def frames_and_timestamps(nb_slot=80, first_slot=16436 * T):
+    rng = np.random.RandomState(0)
+    slots = first_slot + np.arange(nb_slot)
+    return rng.uniform(size=(nb_slot, 2, 3, 2)).astype(np.float32), slot2string(slots, T), slots
+
+
+def test_get_X_matches_stmatrix():
+    frames, timestamps, slots = frames_and_timestamps()
+    XC, XP, XT, Y, timestamps_Y = STMatrix(frames, timestamps, T).create_dataset(**CONFIG)
+    expected = dict(zip(timestamps_Y.slots, np.concatenate([XC, XP, XT], axis=1)))
+
+    st = StreamingSTMatrix(frames.shape[1:], T=T, **CONFIG)
+    # the samples of the last slots are built after the ring buffer wrapped around
+    assert len(slots) > 2 * st.capacity
+    nb_sample = 0
+    for frame, timestamp, slot in zip(frames, timestamps, slots):
+        if slot in expected:
+            assert st.check_it(timestamp)
+            X = st.get_X(timestamp)
+            np.testing.assert_array_equal(X[0][0], expected[slot])
+            assert X[1].shape == (1, 8)
+            nb_sample += 1
+        st.append(frame, timestamp)
+    assert nb_sample == len(expected)
+
+
+def test_get_X_before_the_buffer_is_full():
+    frames, timestamps, slots = frames_and_timestamps()
+    st = StreamingSTMatrix(frames.shape[1:], T=T, **CONFIG)
+    st.extend(frames[:5], timestamps[:5])
+    assert not st.check_it()
+    with pytest.raises(KeyError):
+        st.get_X()
+    # the closeness frames only
+    st = StreamingSTMatrix(frames.shape[1:], T=T, len_closeness=3, len_period=0, len_trend=0)
+    st.extend(frames[:3], timestamps[:3])
+    np.testing.assert_array_equal(st.get_X(meta_data=False)[0][0], frames[2::-1].reshape(-1, 3, 2))
+
+
+def test_extend_equals_append():
+    frames, timestamps, slots = frames_and_timestamps()
+    appended = StreamingSTMatrix(frames.shape[1:], T=T, **CONFIG)
+    for frame, timestamp in zip(frames[:10], timestamps[:10]):
+        appended.append(frame, timestamp)
+    extended = StreamingSTMatrix(frames.shape[1:], T=T, **CONFIG)
+    extended.extend(frames[:10], timestamps[:10])
+    # more frames than the capacity, with a missing slot: only the last ones are written
+    keep = np.delete(np.arange(10, len(frames)), 7)
+    for i in keep:
+        appended.append(frames[i], timestamps[i])
+    extended.extend(frames[keep], timestamps[keep])
+    np.testing.assert_array_equal(extended.slots, appended.slots)
+    np.testing.assert_array_equal(extended.buffer, appended.buffer)
+    assert extended.last_slot == appended.last_slot == slots[-1]
+    with pytest.raises(ValueError):
+        extended.extend(frames[:2], timestamps[:2])
+    with pytest.raises(ValueError):
+        extended.append(frames[0], timestamps[-1])
+
+
+def test_save_load(tmp_path):
+    frames, timestamps, slots = frames_and_timestamps()
+    st = StreamingSTMatrix(frames.shape[1:], T=T, **CONFIG)
+    st.extend(frames[:-1], timestamps[:-1])
+    fname = str(tmp_path / 'st.npz')
+    st.save(fname)
+    loaded = StreamingSTMatrix.load(fname)
+    assert (loaded.T, loaded.config, loaded.last_slot) == (st.T, st.config, st.last_slot)
+    np.testing.assert_array_equal(loaded.buffer, st.buffer)
+    np.testing.assert_array_equal(loaded.slots, st.slots)
+    for x, x_loaded in zip(st.get_X(), loaded.get_X()):
+        np.testing.assert_array_equal(x_loaded, x)
+
+
+def test_no_dependency():
+    with pytest.raises(ValueError):
+        StreamingSTMatrix((2, 3, 2), T=T, len_closeness=0, len_period=0, len_trend=0)